@@ -1,9 +1,14 @@
 import os
-from flask import Flask
+import importlib
+from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_cors import CORS
+from flask_caching import Cache
+from sqlalchemy import CheckConstraint, inspect, text
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.schema import AddConstraint
 
 # ============================================================================
 # INICIALIZACIÓN DE EXTENSIONES
@@ -11,21 +16,37 @@ from flask_cors import CORS
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
+cache = Cache()
 
+# Blueprints disponibles: nombre → url_prefix
+# El módulo se resuelve como project.<nombre>_routes y el blueprint como <nombre>_bp
+BLUEPRINTS = {
+    'auth': None,
+    'api': '/api',
+    'super_admin': '/super-admin',
+    'clinic_admin': '/clinic-admin',
+}
 
-def create_app(config_name=None):
+
+def create_app(config_name=None, blueprints=None):
     """
     Application Factory Pattern.
     Crea y configura la aplicación Flask.
     
     Args:
         config_name (str): Nombre del entorno ('development', 'production', 'testing')
+        blueprints (list | None): Blueprints a registrar (ej: ['api']).
+            None registra todos. Solo se importan los módulos solicitados.
     
     Returns:
         Flask: Aplicación configurada
     """
     app = Flask(__name__)
     
+    # JSON con orjson para todos los jsonify()
+    from project.json_utils import OrjsonProvider
+    app.json = OrjsonProvider(app)
+    
     # ========================================================================
     # CONFIGURACIÓN
     # ========================================================================
@@ -46,9 +67,7 @@ def create_app(config_name=None):
             os.path.dirname(os.path.dirname(__file__)), 
             'instance'
         )
-        if not os.path.exists(instance_path):
-            os.makedirs(instance_path)
-            app.logger.info(f"✅ Carpeta instance creada: {instance_path}")
+        os.makedirs(instance_path, exist_ok=True)  # Idempotente entre workers
     
     # ========================================================================
     # INICIALIZAR EXTENSIONES
@@ -56,6 +75,7 @@ def create_app(config_name=None):
     db.init_app(app)
     bcrypt.init_app(app)
     login_manager.init_app(app)
+    cache.init_app(app)
     CORS(app, origins=app.config.get('CORS_ORIGINS', '*'))
     
     # ========================================================================
@@ -65,33 +85,47 @@ def create_app(config_name=None):
     login_manager.login_message = 'Por favor inicia sesión para acceder a esta página.'
     login_manager.login_message_category = 'warning'
     
-    from project.models import User
+    from project.models import User, Clinic
+    from sqlalchemy.orm import load_only, joinedload
     
     @login_manager.user_loader
     def load_user(user_id):
-        """Carga un usuario por su ID para Flask-Login"""
-        return User.query.get(int(user_id))
+        """
+        Carga un usuario por su ID para Flask-Login.
+        Solo trae las columnas que usan los decoradores de rol y los templates base;
+        el resto se carga bajo demanda. Flask-Login ya guarda el resultado en g
+        durante la petición, así que esto se ejecuta una vez por request.
+        La clínica (navbar de base.html, verificación de clínica activa) viene en el
+        mismo SELECT con un LEFT JOIN, en lugar de una consulta perezosa aparte.
+        """
+        return db.session.get(
+            User,
+            int(user_id),
+            options=[
+                load_only(
+                    User.id, User.username, User.email, User.full_name, User.role,
+                    User.clinic_id, User.is_active, User.pref_dark_mode
+                ),
+                joinedload(User.clinic).load_only(
+                    Clinic.id, Clinic.name, Clinic.logo_url, Clinic.is_active
+                )
+            ]
+        )
     
     # ========================================================================
     # REGISTRAR BLUEPRINTS
     # ========================================================================
-    from project.auth_routes import auth_bp
-    from project.api_routes import api_bp
-    from project.super_admin_routes import super_admin_bp
-    from project.clinic_admin_routes import clinic_admin_bp
-    
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(api_bp, url_prefix='/api')
-    app.register_blueprint(super_admin_bp, url_prefix='/super-admin')
-    app.register_blueprint(clinic_admin_bp, url_prefix='/clinic-admin')
+    _register_blueprints(app, blueprints or list(BLUEPRINTS))
     
     # ========================================================================
     # INICIALIZAR BASE DE DATOS Y SEED
     # ========================================================================
     with app.app_context():
-        # Crear todas las tablas
-        db.create_all()
-        app.logger.info("✅ Base de datos inicializada")
+        # Crear todas las tablas (se puede omitir con RUN_MIGRATIONS_ON_START=false)
+        if app.config.get('RUN_MIGRATIONS_ON_START', True):
+            db.create_all()
+            ensure_indexes(app)
+            app.logger.info("✅ Base de datos inicializada")
         
         # Seed de datos iniciales
         seed_initial_data(app)
@@ -99,28 +133,38 @@ def create_app(config_name=None):
     # ========================================================================
     # CUSTOM ERROR HANDLERS (Opcional)
     # ========================================================================
+    # Templates de error compilados una sola vez (render_template acepta el objeto
+    # Template y sigue aplicando los context processors)
+    error_templates = {
+        code: app.jinja_env.get_template(f'errors/{code}.html')
+        for code in (403, 404, 500)
+    }
+    
     @app.errorhandler(404)
     def not_found(error):
-        from flask import render_template
-        return render_template('errors/404.html'), 404
+        return render_template(error_templates[404]), 404
     
     @app.errorhandler(403)
     def forbidden(error):
-        from flask import render_template
-        return render_template('errors/403.html'), 403
+        return render_template(error_templates[403]), 403
     
     @app.errorhandler(500)
     def internal_error(error):
-        db.session.rollback()  # Rollback en caso de error
-        from flask import render_template
-        return render_template('errors/500.html'), 500
+        # Rollback en caso de error; si falla, igual se muestra la página de error
+        try:
+            db.session.rollback()
+        except Exception:
+            app.logger.exception('Error al hacer rollback de la sesión')
+        return render_template(error_templates[500]), 500
     
     # ========================================================================
     # LOGGING PERSONALIZADO
     # ========================================================================
     if not app.debug:
+        import atexit
         import logging
-        from logging.handlers import RotatingFileHandler
+        import queue
+        from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
         
         if not os.path.exists('logs'):
             os.mkdir('logs')
@@ -134,13 +178,144 @@ def create_app(config_name=None):
             '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
         ))
         file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+        
+        # El request solo encola el registro; un hilo de fondo escribe a disco
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # Vacía la cola al terminar el proceso
+        
+        app.logger.addHandler(QueueHandler(log_queue))
         app.logger.setLevel(logging.INFO)
         app.logger.info('🚀 AgendaNova iniciado')
     
     return app
 
 
+# ============================================================================
+# REGISTRO DE BLUEPRINTS
+# ============================================================================
+def _register_blueprints(app, names):
+    """
+    Importa y registra solo los blueprints indicados.
+    
+    Args:
+        app (Flask): Aplicación
+        names (list): Nombres de BLUEPRINTS a registrar
+    """
+    for name in names:
+        module = importlib.import_module(f'project.{name}_routes')
+        app.register_blueprint(getattr(module, f'{name}_bp'), url_prefix=BLUEPRINTS[name])
+
+
+# ============================================================================
+# ÍNDICES Y RESTRICCIONES EN BASES DE DATOS EXISTENTES
+# ============================================================================
+# Índices de columna (index=True) del esquema publicado que ya no están en los modelos
+# (reemplazados por compuestos): se eliminan de las bases existentes para no
+# mantenerlos en cada escritura
+_RETIRED_INDEXES = (
+    'ix_appointment_clinic_id',
+    'ix_appointment_professional_id',
+    'ix_appointment_start_datetime',
+    'ix_appointment_end_datetime',
+    'ix_patient_clinic_id',
+    'ix_service_clinic_id',
+)
+
+
+def _constraint_violations(conn, table, constraint):
+    """
+    Filas existentes que impiden crear la restricción (máximo 50).
+    CHECK: filas donde la condición no se cumple. EXCLUDE anti-solapamiento: pares
+    de citas activas del mismo profesional que se cruzan, como "id/id".
+    """
+    if isinstance(constraint, CheckConstraint):
+        rows = conn.execute(text(
+            f'SELECT id FROM {table.name} WHERE NOT ({constraint.sqltext}) ORDER BY id LIMIT 50'
+        ))
+    else:
+        # Comparación directa en lugar de tsrange(): no falla con rangos invertidos
+        active = "('PROGRAMADA', 'COMPLETADA')"
+        rows = conn.execute(text(
+            f'SELECT a.id, b.id FROM {table.name} a JOIN {table.name} b '
+            'ON a.id < b.id AND a.clinic_id = b.clinic_id AND a.professional_id = b.professional_id '
+            'AND a.start_datetime < b.end_datetime AND b.start_datetime < a.end_datetime '
+            f'WHERE a.status IN {active} AND b.status IN {active} ORDER BY a.id LIMIT 50'
+        ))
+    return ['/'.join(str(value) for value in row) for row in rows]
+
+
+def ensure_indexes(app):
+    """
+    Sincroniza índices y restricciones de los modelos en una base ya existente.
+    Solo corre con RUN_MIGRATIONS_ON_START (junto a db.create_all()).
+    
+    db.create_all() crea las tablas nuevas completas, pero en tablas existentes no
+    agrega nada. Aquí se crean los índices que falten, las restricciones CHECK y
+    EXCLUDE de citas en PostgreSQL, y se eliminan los índices retirados. Cualquier
+    otro cambio de esquema en una base existente (columnas, tipos) requiere DDL manual.
+    
+    Antes de agregar una restricción se buscan las filas que la violan; si hay, la
+    restricción no se crea y se registran sus ids como error. SQLite no permite
+    agregar restricciones a una tabla existente: ahí solo se reportan las filas.
+    Nada de esto detiene el arranque.
+    """
+    with db.engine.begin() as conn:
+        for name in _RETIRED_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    
+    inspector = inspect(db.engine)
+    is_postgresql = db.engine.dialect.name == 'postgresql'
+    missing = []
+    
+    for table in db.metadata.sorted_tables:
+        # Un solo listado de índices por tabla en lugar de un checkfirst por índice
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                missing.append(index.name)
+                app.logger.error(f"❌ No se pudo crear el índice {index.name}: {e}")
+        
+        # CHECK antes que EXCLUDE: tsrange() falla con filas de fin anterior al inicio
+        constraints = sorted(
+            (c for c in table.constraints if isinstance(c, (CheckConstraint, ExcludeConstraint)) and c.name),
+            key=lambda c: isinstance(c, ExcludeConstraint)
+        )
+        for constraint in constraints:
+            if isinstance(constraint, ExcludeConstraint) and not is_postgresql:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    if is_postgresql and conn.scalar(
+                        text('SELECT 1 FROM pg_constraint WHERE conname = :name'),
+                        {'name': constraint.name}
+                    ):
+                        continue
+                    bad_rows = _constraint_violations(conn, table, constraint)
+                    if bad_rows:
+                        missing.append(constraint.name)
+                        app.logger.error(
+                            f"❌ {len(bad_rows)} fila(s) de {table.name} violan {constraint.name} "
+                            f"(ids: {', '.join(bad_rows)}). Corrígelas antes de crear la restricción."
+                        )
+                    elif is_postgresql:
+                        conn.execute(AddConstraint(constraint))
+            except Exception as e:
+                missing.append(constraint.name)
+                app.logger.error(f"❌ No se pudo crear la restricción {constraint.name}: {e}")
+    
+    if missing:
+        app.logger.error(
+            f"❌ Esquema incompleto, falta: {', '.join(missing)}. "
+            "Revisa el error de cada uno y aplica el DDL a mano."
+        )
+
+
 # ============================================================================
 # SEED DE DATOS INICIALES
 # ============================================================================
@@ -154,6 +329,18 @@ def seed_initial_data(app):
     from project.models import User, Clinic, Patient, Service, Appointment, UserRole
     from datetime import datetime, timedelta
     
+    # ========================================================================
+    # 0. SALIDA RÁPIDA: una sola consulta EXISTS si ya está todo sembrado
+    # ========================================================================
+    create_demo = app.config.get('CREATE_DEMO_DATA', False)
+    probes = [User.query.filter_by(role=UserRole.SUPER_ADMIN).exists()]
+    if create_demo:
+        probes.append(Clinic.query.filter_by(name='Clínica Demo').exists())
+    
+    if all(db.session.query(*probes).one()):
+        app.logger.info("✓ Datos iniciales ya existen, seed omitido")
+        return
+    
     # ========================================================================
     # 1. CREAR SUPER_ADMIN (SIEMPRE)
     # ========================================================================
@@ -186,7 +373,7 @@ def seed_initial_data(app):
     # ========================================================================
     # 2. CREAR DATOS DEMO (SOLO SI CREATE_DEMO_DATA=true)
     # ========================================================================
-    if not app.config.get('CREATE_DEMO_DATA', False):
+    if not create_demo:
         app.logger.info("ℹ️  CREATE_DEMO_DATA=false, saltando datos de prueba")
         return
     
@@ -208,7 +395,7 @@ def seed_initial_data(app):
             plan='free'
         )
         db.session.add(clinic_demo)
-        db.session.commit()
+        db.session.flush()  # Obtener ID sin cerrar la transacción del seed
         app.logger.info(f"✅ Clínica Demo creada (ID: {clinic_demo.id})")
     else:
         app.logger.info(f"✓ Clínica Demo ya existe (ID: {clinic_demo.id})")
@@ -216,9 +403,13 @@ def seed_initial_data(app):
     # ========================================================================
     # 2.2. CREAR CLINIC_ADMIN PARA CLÍNICA DEMO
     # ========================================================================
-    clinic_admin = User.query.filter_by(
-        username='admin_clinica_demo'
-    ).first()
+    # Una sola consulta IN para todos los usuarios demo (admin + profesionales)
+    demo_usernames = ['admin_clinica_demo', 'dr_lopez', 'dra_martinez']
+    by_username = {
+        u.username: u for u in User.query.filter(User.username.in_(demo_usernames))
+    }
+    
+    clinic_admin = by_username.get('admin_clinica_demo')
     
     if not clinic_admin:
         clinic_admin = User(
@@ -232,7 +423,7 @@ def seed_initial_data(app):
         )
         clinic_admin.set_password('Admin@2025!')
         db.session.add(clinic_admin)
-        db.session.commit()
+        db.session.flush()  # Antes del bulk insert de profesionales (conserva el orden de IDs)
         
         app.logger.info(f"✅ CLINIC_ADMIN creado: {clinic_admin.username}")
         app.logger.info(f"   Password: Admin@2025!")
@@ -259,29 +450,43 @@ def seed_initial_data(app):
         }
     ]
     
-    professionals = []
-    for prof_data in professionals_data:
-        prof = User.query.filter_by(username=prof_data['username']).first()
-        
-        if not prof:
-            prof = User(
-                username=prof_data['username'],
-                email=prof_data['email'],
-                role=UserRole.PROFESSIONAL,
-                full_name=prof_data['full_name'],
-                phone=prof_data['phone'],
-                clinic_id=clinic_demo.id,
-                is_active=True
-            )
-            prof.set_password(prof_data['password'])
-            db.session.add(prof)
-            professionals.append(prof)
-            app.logger.info(f"✅ Profesional creado: {prof.username}")
+    # Existentes ya cargados arriba; un solo executemany para los faltantes
+    usernames = [p['username'] for p in professionals_data]
+    missing = [p for p in professionals_data if p['username'] not in by_username]
+    
+    for p in professionals_data:
+        if p in missing:
+            app.logger.info(f"✅ Profesional creado: {p['username']}")
         else:
-            professionals.append(prof)
-            app.logger.info(f"✓ Profesional ya existe: {prof.username}")
+            app.logger.info(f"✓ Profesional ya existe: {p['username']}")
     
-    db.session.commit()
+    if missing:
+        # bcrypt es costoso: un solo hash por contraseña distinta
+        password_hashes = {
+            password: bcrypt.generate_password_hash(password).decode('utf-8')
+            for password in {p['password'] for p in missing}
+        }
+        db.session.bulk_insert_mappings(User, [
+            {
+                'username': p['username'],
+                'email': p['email'],
+                'role': UserRole.PROFESSIONAL,
+                'full_name': p['full_name'],
+                'phone': p['phone'],
+                'password_hash': password_hashes[p['password']],
+                'clinic_id': clinic_demo.id,
+                'is_active': True
+            }
+            for p in missing
+        ])
+        # Recargar solo los recién insertados (bulk no devuelve objetos)
+        by_username.update({
+            u.username: u for u in
+            User.query.filter(User.username.in_([p['username'] for p in missing]))
+        })
+    
+    # En el orden de professionals_data (las citas demo dependen del orden)
+    professionals = [by_username[username] for username in usernames]
     
     # ========================================================================
     # 2.4. CREAR SERVICIOS PARA CLÍNICA DEMO
@@ -313,28 +518,28 @@ def seed_initial_data(app):
         }
     ]
     
-    services = []
-    for service_data in services_data:
-        service = Service.query.filter_by(
-            name=service_data['name'],
-            clinic_id=clinic_demo.id
-        ).first()
-        
-        if not service:
-            service = Service(
-                name=service_data['name'],
-                description=service_data['description'],
-                duration_minutes=service_data['duration_minutes'],
-                price=service_data['price'],
-                clinic_id=clinic_demo.id,
-                is_active=True
+    service_names = [sd['name'] for sd in services_data]
+    by_name = {
+        service.name: service for service in Service.query.filter(
+            Service.clinic_id == clinic_demo.id,
+            Service.name.in_(service_names)
+        )
+    }
+    missing = [sd for sd in services_data if sd['name'] not in by_name]
+    
+    if missing:
+        db.session.bulk_insert_mappings(Service, [
+            dict(sd, clinic_id=clinic_demo.id, is_active=True) for sd in missing
+        ])
+        by_name.update({
+            service.name: service for service in Service.query.filter(
+                Service.clinic_id == clinic_demo.id,
+                Service.name.in_([sd['name'] for sd in missing])
             )
-            db.session.add(service)
-            services.append(service)
-        else:
-            services.append(service)
+        })
+    
+    services = [by_name[name] for name in service_names]
     
-    db.session.commit()
     app.logger.info(f"✅ {len(services)} servicios creados/verificados")
     
     # ========================================================================
@@ -373,27 +578,27 @@ def seed_initial_data(app):
         }
     ]
     
-    patients = []
-    for patient_data in patients_data:
-        patient = Patient.query.filter_by(
-            phone=patient_data['phone'],
-            clinic_id=clinic_demo.id
-        ).first()
-        
-        if not patient:
-            patient = Patient(
-                name=patient_data['name'],
-                phone=patient_data['phone'],
-                email=patient_data['email'],
-                notes=patient_data['notes'],
-                clinic_id=clinic_demo.id
-            )
-            db.session.add(patient)
-            patients.append(patient)
-        else:
-            patients.append(patient)
+    phones = [pd['phone'] for pd in patients_data]
+    by_phone = {}
+    
+    def load_patients(phone_list):
+        for patient in Patient.query.filter(
+            Patient.clinic_id == clinic_demo.id,
+            Patient.phone.in_(phone_list)
+        ).order_by(Patient.id):
+            by_phone.setdefault(patient.phone, patient)
+    
+    load_patients(phones)
+    missing = [pd for pd in patients_data if pd['phone'] not in by_phone]
+    
+    if missing:
+        db.session.bulk_insert_mappings(Patient, [
+            dict(pd, clinic_id=clinic_demo.id) for pd in missing
+        ])
+        load_patients([pd['phone'] for pd in missing])
+    
+    patients = [by_phone[phone] for phone in phones]
     
-    db.session.commit()
     app.logger.info(f"✅ {len(patients)} pacientes creados/verificados")
     
     # ========================================================================
@@ -444,7 +649,7 @@ def seed_initial_data(app):
                     'patient': patients[3],
                     'service': services[0],
                     'start': now - timedelta(days=2, hours=11),
-                    'end': now - timedelta(days=2, hours=11, minutes=30),
+                    'end': now - timedelta(days=2, hours=10, minutes=30),
                     'status': AppointmentStatus.COMPLETADA,
                     'notes': 'Paciente atendido satisfactoriamente'
                 },
@@ -452,31 +657,33 @@ def seed_initial_data(app):
                     'professional': professionals[1],
                     'patient': patients[4],
                     'service': services[3],
-                    'start': now - timedelta(days=1, hours=15),
-                    'end': now - timedelta(days=1, hours=16),
+                    'start': now - timedelta(days=1, hours=16),
+                    'end': now - timedelta(days=1, hours=15),
                     'status': AppointmentStatus.COMPLETADA,
                     'notes': 'Consulta de especialidad - Todo OK'
                 }
             ]
             
-            for apt_data in appointments_data:
-                appointment = Appointment(
-                    clinic_id=clinic_demo.id,
-                    professional_id=apt_data['professional'].id,
-                    patient_id=apt_data['patient'].id,
-                    service_id=apt_data['service'].id,
-                    start_datetime=apt_data['start'].replace(tzinfo=None),
-                    end_datetime=apt_data['end'].replace(tzinfo=None),
-                    status=apt_data['status'],
-                    notes=apt_data['notes']
-                )
-                db.session.add(appointment)
-            
-            db.session.commit()
+            db.session.bulk_insert_mappings(Appointment, [
+                {
+                    'clinic_id': clinic_demo.id,
+                    'professional_id': apt_data['professional'].id,
+                    'patient_id': apt_data['patient'].id,
+                    'service_id': apt_data['service'].id,
+                    'start_datetime': apt_data['start'].replace(tzinfo=None),
+                    'end_datetime': apt_data['end'].replace(tzinfo=None),
+                    'status': apt_data['status'],
+                    'notes': apt_data['notes']
+                }
+                for apt_data in appointments_data
+            ])
             app.logger.info(f"✅ {len(appointments_data)} citas de ejemplo creadas")
         else:
             app.logger.info(f"✓ Ya existen {existing_appointments} citas en la clínica demo")
     
+    # Una sola transacción para todos los datos demo
+    db.session.commit()
+    
     # ========================================================================
     # RESUMEN FINAL
     # ========================================================================
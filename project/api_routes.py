@@ -1,48 +1,67 @@
-from flask import Blueprint, request, jsonify
+from flask import (
+    Blueprint, request, jsonify, abort, Response, stream_with_context, current_app, g,
+    send_file, url_for
+)
 from flask_login import login_required, current_user
-from project import db
+from project import db, cache
+from project.json_utils import stream_json_array
+from project.caching import cached, clinic_cache_key
+from project.exports import (
+    appointments_csv, async_exports_enabled, count_appointments, discard_export_job,
+    get_export_job, gzip_chunks, remove_export_file, start_export_job
+)
+from project.reports import refresh_view_if_stale, status_totals, professional_totals
 from project.models import (
     Appointment, Patient, Service, User, Notification, Clinic,
-    AppointmentStatus, UserRole, get_peru_time, PERU_TZ
+    AppointmentStatus, UserRole, get_peru_time, PERU_TZ, PERM_MANAGE_APPT,
+    OVERLAP_CONSTRAINT, APPOINTMENT_STATUS_BY_VALUE, ACTIVE_STATUSES
 )
-from datetime import datetime
-from sqlalchemy import and_, or_
+from datetime import date, datetime, time, timedelta
+import hashlib
+from functools import lru_cache
+from urllib.parse import quote
+from sqlalchemy import or_, func, select, cast, String, lambda_stmt, union_all, literal_column
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, selectinload, joinedload, lazyload
 
 api_bp = Blueprint('api', __name__)
 
+# Parser ISO 8601 en C si ciso8601 está instalado (opcional);
+# si no, datetime.fromisoformat (Python 3.11+ ya acepta el sufijo 'Z')
+try:
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    _parse_iso = datetime.fromisoformat
+
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 def parse_datetime(date_string):
     """
-    Parsea una fecha ISO 8601 y la convierte a datetime naive en zona horaria de Perú.
+    Parsea una fecha ISO 8601 y la convierte a datetime en zona horaria de Perú.
     
     Args:
         date_string (str): Fecha en formato ISO 8601
     
     Returns:
-        datetime: Datetime naive en zona horaria de Perú
+        datetime: Datetime con tzinfo=PERU_TZ (igual que las citas leídas de la BD)
     
     Raises:
         ValueError: Si el formato es inválido
     """
     try:
-        # Parsear el string ISO (soporta con/sin timezone)
-        dt = datetime.fromisoformat(date_string.replace('Z', '+00:00'))
-        
-        # Si tiene timezone, convertir a Perú
-        if dt.tzinfo is not None:
-            dt_peru = dt.astimezone(PERU_TZ)
-        else:
-            # Es hora naive, asumimos que ya es hora de Perú
-            dt_peru = dt.replace(tzinfo=PERU_TZ)
-        
-        # Retornar como naive (sin timezone) para SQLite
-        return dt_peru.replace(tzinfo=None)
-        
-    except (ValueError, AttributeError) as e:
+        # Parser nativo (soporta 'Z' y offsets sin manipular el string)
+        dt = _parse_iso(date_string)
+    except (ValueError, TypeError, AttributeError):
         raise ValueError(f'Formato de fecha inválido: {date_string}. Usa ISO 8601 (ej: 2025-01-15T09:00:00)')
+    
+    # Es hora naive, asumimos que ya es hora de Perú
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=PERU_TZ)
+    
+    # Si tiene timezone, convertir a Perú (PeruDateTime la guarda naive)
+    return dt.astimezone(PERU_TZ)
 
 
 def get_user_clinic_id():
@@ -50,12 +69,30 @@ def get_user_clinic_id():
     Obtiene el clinic_id del usuario autenticado.
     SUPER_ADMIN retorna None (acceso a todas las clínicas).
     
+    Se calcula una vez por petición y se guarda en g: después de un commit
+    current_user queda expirado y leerlo de nuevo haría un SELECT.
+    
     Returns:
         int | None: ID de clínica o None para SUPER_ADMIN
     """
+    if 'user_clinic_id' not in g:
+        # SUPER_ADMIN: None (acceso global)
+        g.user_clinic_id = None if current_user.is_super_admin() else current_user.clinic_id
+    return g.user_clinic_id
+
+
+def resolve_clinic_id():
+    """
+    Clínica sobre la que opera la petición.
+    CLINIC_ADMIN / PROFESSIONAL: su propia clínica.
+    SUPER_ADMIN: el parámetro ?clinic_id= (None si no lo envió).
+    
+    Returns:
+        int | None: ID de clínica efectivo
+    """
     if current_user.is_super_admin():
-        return None  # Acceso global
-    return current_user.clinic_id
+        return request.args.get('clinic_id', type=int)
+    return get_user_clinic_id()
 
 
 def verify_clinic_access(clinic_id):
@@ -73,6 +110,169 @@ def verify_clinic_access(clinic_id):
     return current_user.clinic_id == clinic_id
 
 
+def get_scoped_appointment_or_404(id, *options):
+    """
+    Obtiene una cita visible para el usuario autenticado o responde 404.
+    La autorización va en el WHERE (clínica y, para PROFESSIONAL, solo sus citas):
+    una cita ajena no se distingue de una inexistente.
+    
+    Args:
+        id (int): ID de la cita
+        *options: Opciones de carga (ej: joinedload(...))
+    
+    Returns:
+        Appointment: Cita autorizada
+    """
+    stmt = select(Appointment).where(Appointment.id == id).options(*options)
+    
+    if not current_user.is_super_admin():
+        stmt = stmt.where(Appointment.clinic_id == current_user.clinic_id)
+        if current_user.is_professional():
+            stmt = stmt.where(Appointment.professional_id == current_user.id)
+    
+    return db.first_or_404(stmt)
+
+
+def overlap_conflict_response(overlapping, message):
+    """
+    Respuesta 409 para un horario que se solapa con otra cita.
+    
+    Args:
+        overlapping (Appointment): Cita en conflicto (None si ya no es visible)
+        message (str): Mensaje para el cliente
+    """
+    payload = {'error': 'Conflict', 'message': message}
+    if overlapping:
+        payload['conflicting_appointment'] = {
+            'id': overlapping.id,
+            'patient': overlapping.patient.name,
+            'start': overlapping.start_datetime,
+            'end': overlapping.end_datetime
+        }
+    return jsonify(payload), 409  # HTTP 409 Conflict
+
+
+def is_overlap_violation(error):
+    """IntegrityError producida por la restricción EXCLUDE anti-solapamiento (PostgreSQL)"""
+    return OVERLAP_CONSTRAINT in str(error.orig)
+
+
+def content_etag(data):
+    """ETag del contenido: JSON con claves ordenadas (estable entre peticiones y workers)"""
+    return hashlib.md5(current_app.json.dumps(data).encode()).hexdigest()
+
+
+def etag_response(etag, build, max_age=30):
+    """
+    Respuesta JSON con ETag débil y Cache-Control privado.
+    Si el cliente ya tiene esa versión (If-None-Match) responde 304 sin cuerpo
+    y sin llamar a build().
+    
+    Args:
+        etag (str): Identificador de la versión de los datos
+        build (callable): Retorna los datos a serializar
+        max_age (int): Segundos que el navegador puede reutilizar la respuesta
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+    return response
+
+
+# ============================================================================
+# COERCIÓN DE CAMPOS DE ENTRADA (create/update)
+# ============================================================================
+def _str(value):
+    return value.strip()
+
+
+def _opt_str(value):
+    return value.strip() if value else None
+
+
+def _opt_date(value):
+    return datetime.fromisoformat(value).date() if value else None
+
+
+# (campo, conversor): una sola definición para POST y PUT
+_PATIENT_FIELDS = (
+    ('name', _str),
+    ('phone', _str),
+    ('email', _opt_str),
+    ('date_of_birth', _opt_date),
+    ('address', _opt_str),
+    ('notes', _opt_str),
+)
+
+
+def coerce_fields(data, spec, partial=False):
+    """
+    Convierte el JSON de entrada según una especificación (campo, conversor).
+    
+    Args:
+        data (dict): JSON recibido
+        spec (tuple): Pares (campo, conversor)
+        partial (bool): True para PUT (solo los campos presentes en data)
+    
+    Returns:
+        dict: Valores convertidos listos para asignar al modelo
+    """
+    if partial:
+        return {field: convert(data[field]) for field, convert in spec if field in data}
+    return {field: convert(data.get(field)) for field, convert in spec}
+
+
+# ============================================================================
+# COLUMNAS PARA LISTADOS (Core select, sin hidratar objetos ORM)
+# ============================================================================
+# date_of_birth se castea a texto en SQL ('YYYY-MM-DD'), igual que isoformat()
+_PATIENT_COLS = (
+    Patient.id, Patient.clinic_id, Patient.name, Patient.phone, Patient.email,
+    cast(Patient.date_of_birth, String).label('date_of_birth'),
+    Patient.address, Patient.notes, Patient.created_at
+)
+
+_SERVICE_COLS = (
+    Service.id, Service.clinic_id, Service.name, Service.description,
+    Service.duration_minutes, Service.price, Service.is_active, Service.created_at
+)
+
+
+# Columnas de Patient que usan to_dict() y update_patient (resto se difiere)
+_PATIENT_LOAD = (
+    Patient.id, Patient.clinic_id, Patient.name, Patient.phone, Patient.email,
+    Patient.date_of_birth, Patient.address, Patient.notes, Patient.created_at
+)
+
+
+def _patient_appointments_count(patient_id):
+    """Citas del paciente (un COUNT) para serializar un solo paciente"""
+    return db.session.scalar(
+        select(func.count(Appointment.id)).where(Appointment.patient_id == patient_id)
+    )
+
+
+def _row_to_dict(row):
+    """
+    Convierte un RowMapping de Core a dict con el mismo formato que to_dict().
+    Las fechas se dejan como datetime: el proveedor orjson las serializa en ISO 8601.
+    
+    Args:
+        row (RowMapping): Fila obtenida con .mappings()
+    
+    Returns:
+        dict: Datos de la fila (precio como float)
+    """
+    data = dict(row)
+    if 'price' in data:
+        data['price'] = float(data['price']) if data['price'] else None
+    return data
+
+
 # ============================================================================
 # API: PACIENTES (PATIENTS)
 # ============================================================================
@@ -87,45 +287,53 @@ def get_patients():
     """
     clinic_id = get_user_clinic_id()
     
-    # Base query con filtro de clínica
-    if clinic_id:
-        query = Patient.query.filter_by(clinic_id=clinic_id)
-    else:
-        # SUPER_ADMIN: necesita especificar clinic_id
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
+    if current_user.is_super_admin():
+        # SUPER_ADMIN necesita especificar clinic_id
+        clinic_id = request.args.get('clinic_id', type=int)
+        if not clinic_id:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        query = Patient.query.filter_by(clinic_id=clinic_id_param)
+    
+    # Core select: columnas de to_dict() + conteo de citas agregado en una sola consulta.
+    # lambda_stmt cachea la compilación del SQL por punto de llamada; las variables
+    # capturadas (clinic_id, search_pattern, limit) se envían como parámetros.
+    # El criterio multi-tenant global no aplica a lambda_stmt: clinic_id va explícito
+    stmt = lambda_stmt(lambda: select(
+        *_PATIENT_COLS,
+        func.count(Appointment.id).label('appointments_count')
+    ).outerjoin(
+        Appointment, Appointment.patient_id == Patient.id
+    ).where(Patient.clinic_id == clinic_id))
     
     # Búsqueda opcional
     search = request.args.get('search', '').strip()
     if search:
-        query = query.filter(
-            or_(
-                Patient.name.ilike(f'%{search}%'),
-                Patient.phone.ilike(f'%{search}%'),
-                Patient.email.ilike(f'%{search}%')
-            )
-        )
+        # Un solo predicado sobre search_text (índice trigram GIN en PostgreSQL)
+        search_pattern = f'%{search.lower()}%'
+        stmt += lambda s: s.where(Patient.search_text.like(search_pattern))
     
     # Límite
     limit = request.args.get('limit', 50, type=int)
-    patients = query.order_by(Patient.name).limit(limit).all()
+    stmt += lambda s: s.group_by(Patient.id).order_by(Patient.name).limit(limit)
     
-    return jsonify([patient.to_dict() for patient in patients])
+    # Streaming: filas por lotes del cursor (yield_per) directo a JSON, sin .all()
+    def generate():
+        rows = db.session.execute(stmt, execution_options={'yield_per': 500}).mappings()
+        yield from stream_json_array(dict(row) for row in rows)
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 @api_bp.route('/patients/<int:id>', methods=['GET'])
 @login_required
 def get_patient(id):
     """GET: Obtiene un paciente específico"""
-    patient = Patient.query.get_or_404(id)
+    patient = db.session.get(Patient, id, options=[load_only(*_PATIENT_LOAD)]) or abort(404)
     
     # Verificar acceso a la clínica
     if not verify_clinic_access(patient.clinic_id):
         return jsonify({'error': 'No autorizado para ver este paciente'}), 403
     
-    return jsonify(patient.to_dict())
+    return jsonify(patient.to_dict(appointments_count=_patient_appointments_count(patient.id)))
 
 
 @api_bp.route('/patients', methods=['POST'])
@@ -137,7 +345,7 @@ def create_patient():
     TAREA 1 FIX: Validación de campos opcionales antes de .strip()
     """
     # Solo PROFESSIONAL o superior puede crear pacientes
-    if not current_user.can_manage_appointments():
+    if not current_user.permissions_mask & PERM_MANAGE_APPT:
         return jsonify({'error': 'No autorizado para crear pacientes'}), 403
     
     data = request.get_json()
@@ -151,40 +359,30 @@ def create_patient():
         return jsonify({'error': 'SUPER_ADMIN debe especificar clinic_id'}), 400
     
     # Verificar duplicado por teléfono en la misma clínica
-    existing = Patient.query.filter_by(
-        phone=data['phone'],
-        clinic_id=clinic_id
-    ).first()
+    phone = data['phone']
+    existing = db.session.execute(lambda_stmt(
+        lambda: select(Patient).where(Patient.phone == phone, Patient.clinic_id == clinic_id).limit(1)
+    )).scalars().first()
     
     if existing:
         return jsonify({
             'error': 'Ya existe un paciente con este teléfono en esta clínica',
-            'existing_patient': existing.to_dict()
+            'existing_patient': existing.to_dict(
+                appointments_count=_patient_appointments_count(existing.id)
+            )
         }), 400
     
     # Crear paciente
     try:
-        # ✅ TAREA 1 FIX: Validar antes de .strip()
-        email_value = data.get('email')
-        address_value = data.get('address')
-        notes_value = data.get('notes')
-        
-        patient = Patient(
-            clinic_id=clinic_id,
-            name=data['name'].strip(),
-            phone=data['phone'].strip(),
-            email=email_value.strip() if email_value else None,  # ✅ FIX
-            date_of_birth=datetime.fromisoformat(data['date_of_birth']).date() if data.get('date_of_birth') else None,
-            address=address_value.strip() if address_value else None,  # ✅ FIX
-            notes=notes_value.strip() if notes_value else None  # ✅ FIX
-        )
+        # ✅ TAREA 1 FIX: opcionales vacíos → None (ver _PATIENT_FIELDS)
+        patient = Patient(clinic_id=clinic_id, **coerce_fields(data, _PATIENT_FIELDS))
         
         db.session.add(patient)
         db.session.commit()
         
         return jsonify({
             'message': 'Paciente creado exitosamente',
-            'patient': patient.to_dict()
+            'patient': patient.to_dict(appointments_count=0)
         }), 201
     
     except Exception as e:
@@ -196,42 +394,33 @@ def create_patient():
 @login_required
 def update_patient(id):
     """PUT: Actualiza un paciente existente"""
-    patient = Patient.query.get_or_404(id)
+    patient = db.session.get(Patient, id, options=[load_only(*_PATIENT_LOAD)]) or abort(404)
     
     # Verificar acceso
     if not verify_clinic_access(patient.clinic_id):
         return jsonify({'error': 'No autorizado'}), 403
     
-    if not current_user.can_manage_appointments():
+    if not current_user.permissions_mask & PERM_MANAGE_APPT:
         return jsonify({'error': 'No autorizado'}), 403
     
     data = request.get_json()
     
     try:
-        # Actualizar campos con validación similar
-        if 'name' in data:
-            patient.name = data['name'].strip()
-        if 'phone' in data:
-            patient.phone = data['phone'].strip()
-        if 'email' in data:
-            email_value = data['email']
-            patient.email = email_value.strip() if email_value else None
-        if 'date_of_birth' in data:
-            patient.date_of_birth = datetime.fromisoformat(data['date_of_birth']).date() if data['date_of_birth'] else None
-        if 'address' in data:
-            address_value = data['address']
-            patient.address = address_value.strip() if address_value else None
-        if 'notes' in data:
-            notes_value = data['notes']
-            patient.notes = notes_value.strip() if notes_value else None
+        # Actualizar solo los campos enviados, con la misma conversión que en POST
+        for field, value in coerce_fields(data, _PATIENT_FIELDS, partial=True).items():
+            setattr(patient, field, value)
         
         db.session.commit()
         
         return jsonify({
             'message': 'Paciente actualizado exitosamente',
-            'patient': patient.to_dict()
+            'patient': patient.to_dict(appointments_count=_patient_appointments_count(patient.id))
         })
     
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Los datos del paciente violan una restricción de la base de datos'}), 400
+    
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Error al actualizar paciente: {str(e)}'}), 500
@@ -246,22 +435,28 @@ def get_services():
     """GET: Obtiene lista de servicios activos de la clínica"""
     clinic_id = get_user_clinic_id()
     
-    if clinic_id:
-        services = Service.query.filter_by(
-            clinic_id=clinic_id,
-            is_active=True
-        ).order_by(Service.name).all()
-    else:
+    if current_user.is_super_admin():
         # SUPER_ADMIN necesita especificar clinic_id
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
+        clinic_id = request.args.get('clinic_id', type=int)
+        if not clinic_id:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        services = Service.query.filter_by(
-            clinic_id=clinic_id_param,
-            is_active=True
-        ).order_by(Service.name).all()
     
-    return jsonify([service.to_dict() for service in services])
+    # Catálogo cacheado por clínica (misma clave que el listado de servicios activos
+    # del admin de clínica; los cambios en servicios renuevan la versión de la clínica)
+    def build():
+        # El criterio multi-tenant global no aplica a lambda_stmt: clinic_id va explícito
+        stmt = lambda_stmt(lambda: select(*_SERVICE_COLS).where(
+            Service.clinic_id == clinic_id,
+            Service.is_active == True
+        ).order_by(Service.name))
+        
+        return [_row_to_dict(row) for row in db.session.execute(stmt).mappings()]
+    
+    services = cached(
+        clinic_cache_key('services', clinic_id, True), build,
+        timeout=current_app.config['SERVICES_CACHE_TIMEOUT']
+    )
+    return jsonify(services)
 
 
 # ============================================================================
@@ -273,33 +468,42 @@ def get_professionals():
     """GET: Obtiene lista de profesionales activos de la clínica"""
     clinic_id = get_user_clinic_id()
     
-    if clinic_id:
-        professionals = User.query.filter_by(
-            clinic_id=clinic_id,
-            role=UserRole.PROFESSIONAL,
-            is_active=True
-        ).order_by(User.full_name).all()
-    else:
+    if not clinic_id:
         # SUPER_ADMIN necesita especificar clinic_id
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
+        clinic_id = request.args.get('clinic_id', type=int)
+        if not clinic_id:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        professionals = User.query.filter_by(
-            clinic_id=clinic_id_param,
-            role=UserRole.PROFESSIONAL,
-            is_active=True
-        ).order_by(User.full_name).all()
     
-    return jsonify([
-        {
-            'id': prof.id,
-            'username': prof.username,
-            'full_name': prof.full_name or prof.username,
-            'email': prof.email,
-            'phone': prof.phone
-        }
-        for prof in professionals
-    ])
+    def build():
+        # Solo las columnas del listado.
+        # lambda_stmt: SQL compilado una vez, clinic_id viaja como parámetro
+        rows = db.session.execute(lambda_stmt(
+            lambda: select(User.id, User.username, User.full_name, User.email, User.phone).where(
+                User.clinic_id == clinic_id,
+                User.role == UserRole.PROFESSIONAL,
+                User.is_active == True
+            ).order_by(User.full_name)
+        ))
+        return [
+            {
+                'id': prof.id,
+                'username': prof.username,
+                'full_name': prof.full_name or prof.username,
+                'email': prof.email,
+                'phone': prof.phone
+            }
+            for prof in rows
+        ]
+    
+    # Con cache compartido el ETag sale de la versión de la clínica (cambia con
+    # cualquier usuario confirmado): un If-None-Match vigente responde 304 sin
+    # consultar la base. Sin él, del contenido (User no tiene updated_at)
+    version_key = clinic_cache_key('professionals', clinic_id)
+    if version_key:
+        return etag_response(hashlib.md5(version_key.encode()).hexdigest(), build)
+    
+    professionals = build()
+    return etag_response(content_etag(professionals), lambda: professionals)
 
 
 # ============================================================================
@@ -326,52 +530,71 @@ def search_patients():
     
     clinic_id = get_user_clinic_id()
     
-    # Base query
-    if clinic_id:
-        base_query = Patient.query.filter_by(clinic_id=clinic_id)
-    else:
+    if not clinic_id:
         # SUPER_ADMIN necesita especificar clinic_id
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
+        clinic_id = request.args.get('clinic_id', type=int)
+        if not clinic_id:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        base_query = Patient.query.filter_by(clinic_id=clinic_id_param)
     
+    # Resultado cacheado por (clínica, término) unos segundos: cubre el tecleo
+    # rápido y el backspace. Crear/editar pacientes renueva la versión de la clínica
+    results = cached(
+        clinic_cache_key('search_patients', clinic_id, query_term.lower()),
+        lambda: _search_patients(clinic_id, query_term),
+        timeout=current_app.config['SEARCH_CACHE_TIMEOUT']
+    )
+    return jsonify(results)
+
+
+def _search_patients(clinic_id, query_term):
+    """Ejecuta la búsqueda autocomplete (teléfono primero, luego nombre)"""
     # ✅ BÚSQUEDA CON PRIORIDAD: Teléfono PRIMERO, luego Nombre
+    # Una sola consulta UNION ALL con columna de prioridad y un único LIMIT 10.
+    # lambda_stmt: el SQL se compila una vez por forma; los patrones viajan como
+    # parámetros, así cada tecla del autocomplete reutiliza la compilación
+    phone_term = ''.join(filter(str.isdigit, query_term))
+    # 2️⃣ Coincidencias por NOMBRE (lower(name) LIKE 'término%' usa el índice de prefijo)
+    name_pattern = f'{query_term.lower()}%'
+    
+    if phone_term:
+        # 1️⃣ Coincidencias por TELÉFONO (prioridad alta), sin separadores;
+        # el bloque de nombre excluye lo que ya coincidió por teléfono (sin IN desde Python)
+        phone_pattern = f'{phone_term}%'
+        stmt = lambda_stmt(lambda: union_all(
+            select(
+                Patient.id, Patient.name, Patient.phone, literal_column('0').label('priority')
+            ).where(
+                Patient.clinic_id == clinic_id,
+                Patient.phone_digits.like(phone_pattern)
+            ),
+            select(
+                Patient.id, Patient.name, Patient.phone, literal_column('1').label('priority')
+            ).where(
+                Patient.clinic_id == clinic_id,
+                func.lower(Patient.name).like(name_pattern),
+                or_(Patient.phone.is_(None), ~Patient.phone_digits.like(phone_pattern))
+            )
+        ).order_by(literal_column('priority'), literal_column('name')).limit(10))
+    else:
+        stmt = lambda_stmt(lambda: select(
+            Patient.id, Patient.name, Patient.phone
+        ).where(
+            Patient.clinic_id == clinic_id,
+            func.lower(Patient.name).like(name_pattern)
+        ).order_by(Patient.name).limit(10))
     
-    # 1️⃣ Buscar por TELÉFONO (prioridad alta)
-    phone_matches = base_query.filter(
-        Patient.phone.ilike(f'{query_term}%')
-    ).order_by(Patient.name).limit(10).all()
-    
-    # 2️⃣ Buscar por NOMBRE (solo si no hay suficientes resultados por teléfono)
-    name_matches = []
-    if len(phone_matches) < 10:
-        remaining_slots = 10 - len(phone_matches)
-        
-        # Excluir IDs que ya están en phone_matches
-        exclude_ids = [p.id for p in phone_matches]
-        
-        name_query = base_query.filter(
-            Patient.name.ilike(f'{query_term}%')
-        )
-        
-        if exclude_ids:
-            name_query = name_query.filter(~Patient.id.in_(exclude_ids))
-        
-        name_matches = name_query.order_by(Patient.name).limit(remaining_slots).all()
-    
-    # 3️⃣ Combinar resultados: TELÉFONO primero, luego NOMBRE
-    patients = phone_matches + name_matches
+    # 3️⃣ Teléfono primero, luego nombre; orden alfabético dentro de cada grupo
+    rows = db.session.execute(stmt).all()
     
     # Retornar formato simplificado para autocomplete
-    return jsonify([
+    return [
         {
-            'id': patient.id,
-            'name': patient.name,
-            'phone': patient.phone
+            'id': row.id,
+            'name': row.name,
+            'phone': row.phone
         }
-        for patient in patients
-    ])
+        for row in rows
+    ]
 
 # ============================================================================
 # API: CITAS (APPOINTMENTS) - CRUD COMPLETO
@@ -389,23 +612,33 @@ def get_appointments():
     """
     clinic_id = get_user_clinic_id()
     
+    # lambda_stmt: el SQL de cada combinación de filtros se compila una sola vez;
+    # las variables capturadas (clinic_id, fechas, etc.) se envían como parámetros.
+    # Relaciones en un SELECT ... IN cada una, solo con las columnas del evento
+    stmt = lambda_stmt(lambda: select(Appointment).options(
+        selectinload(Appointment.patient).load_only(Patient.id, Patient.name, Patient.phone),
+        selectinload(Appointment.service).load_only(Service.id, Service.name),
+        selectinload(Appointment.professional).load_only(User.id, User.full_name, User.username)
+    ))
+    
     # Base query según rol
     if current_user.is_super_admin():
         # SUPER_ADMIN necesita especificar clinic_id
         clinic_id_param = request.args.get('clinic_id', type=int)
         if not clinic_id_param:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        query = Appointment.query.filter_by(clinic_id=clinic_id_param)
+        stmt += lambda s: s.where(Appointment.clinic_id == clinic_id_param)
     
     elif current_user.is_clinic_admin():
         # CLINIC_ADMIN ve todas las citas de su clínica
-        query = Appointment.query.filter_by(clinic_id=clinic_id)
+        stmt += lambda s: s.where(Appointment.clinic_id == clinic_id)
     
     elif current_user.is_professional():
         # PROFESSIONAL solo ve sus propias citas
-        query = Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            professional_id=current_user.id
+        user_id = current_user.id
+        stmt += lambda s: s.where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.professional_id == user_id
         )
     
     else:
@@ -420,58 +653,50 @@ def get_appointments():
         try:
             start_dt = parse_datetime(start_str)
             end_dt = parse_datetime(end_str)
-            query = query.filter(
-                and_(
-                    Appointment.start_datetime >= start_dt,
-                    Appointment.end_datetime <= end_dt
-                )
-            )
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
+        stmt += lambda s: s.where(
+            Appointment.start_datetime >= start_dt,
+            Appointment.end_datetime <= end_dt
+        )
     
     # Filtro por profesional (solo para CLINIC_ADMIN)
     professional_id = request.args.get('professional_id', type=int)
     if professional_id and current_user.is_clinic_admin():
-        query = query.filter_by(professional_id=professional_id)
+        stmt += lambda s: s.where(Appointment.professional_id == professional_id)
     
     # Filtro por estado
     status = request.args.get('status')
     if status:
-        try:
-            query = query.filter_by(status=AppointmentStatus(status))
-        except ValueError:
+        status_filter = APPOINTMENT_STATUS_BY_VALUE.get(status)
+        if status_filter is None:
             return jsonify({'error': f'Estado inválido: {status}'}), 400
+        stmt += lambda s: s.where(Appointment.status == status_filter)
     
     # Excluir canceladas por defecto (a menos que se pida explícitamente)
     include_cancelled = request.args.get('include_cancelled', 'false').lower() == 'true'
     if not include_cancelled:
-        query = query.filter(
-            Appointment.status.in_([
-                AppointmentStatus.PROGRAMADA,
-                AppointmentStatus.COMPLETADA
-            ])
-        )
+        stmt += lambda s: s.where(Appointment.status.in_(ACTIVE_STATUSES))
     
     # Ordenar por fecha
-    appointments = query.order_by(Appointment.start_datetime).all()
+    stmt += lambda s: s.order_by(Appointment.start_datetime)
+    
+    # Formato para FullCalendar, serializado con orjson y enviado por bloques.
+    # Sin yield_per: las relaciones selectin anidadas no lo admiten
+    def generate():
+        appointments = db.session.execute(stmt).scalars().all()
+        now = get_peru_time()
+        yield from stream_json_array(apt.to_fullcalendar_event(now) for apt in appointments)
     
-    # Formato para FullCalendar
-    return jsonify([apt.to_fullcalendar_event() for apt in appointments])
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 @api_bp.route('/appointments/<int:id>', methods=['GET'])
 @login_required
 def get_appointment(id):
     """GET: Obtiene una cita específica"""
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    # PROFESSIONAL solo puede ver sus propias citas
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado para ver esta cita'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     return jsonify(appointment.to_dict())
 
@@ -482,7 +707,7 @@ def create_appointment():
     """
     POST: Crea una nueva cita con validación anti-solapamiento.
     """
-    if not current_user.can_manage_appointments():
+    if not current_user.permissions_mask & PERM_MANAGE_APPT:
         return jsonify({'error': 'No autorizado para crear citas'}), 403
     
     data = request.get_json()
@@ -537,24 +762,17 @@ def create_appointment():
     # ========================================================================
     # VALIDACIÓN CRÍTICA: ANTI-SOLAPAMIENTO
     # ========================================================================
-    overlapping = Appointment.check_overlap(
+    # EXISTS en el caso común (sin conflicto); la fila solo se carga si hay solapamiento
+    overlap_args = dict(
         clinic_id=clinic_id,
         professional_id=professional_id,
         start_dt=start_dt,
         end_dt=end_dt
     )
+    overlapping = Appointment.has_overlap(**overlap_args) and Appointment.check_overlap(**overlap_args)
     
     if overlapping:
-        return jsonify({
-            'error': 'Conflict',
-            'message': 'El horario se solapa con otra cita existente',
-            'conflicting_appointment': {
-                'id': overlapping.id,
-                'patient': overlapping.patient.name,
-                'start': overlapping.start_datetime.replace(tzinfo=PERU_TZ).isoformat(),
-                'end': overlapping.end_datetime.replace(tzinfo=PERU_TZ).isoformat()
-            }
-        }), 409  # HTTP 409 Conflict
+        return overlap_conflict_response(overlapping, 'El horario se solapa con otra cita existente')
     
     # ========================================================================
     # CREAR CITA
@@ -581,6 +799,16 @@ def create_appointment():
             'appointment': appointment.to_dict()
         }), 201
     
+    except IntegrityError as e:
+        # Otra petición reservó el horario entre la verificación y el commit
+        db.session.rollback()
+        if not is_overlap_violation(e):
+            return jsonify({'error': 'Los datos de la cita violan una restricción de la base de datos'}), 400
+        return overlap_conflict_response(
+            Appointment.check_overlap(**overlap_args),
+            'El horario se solapa con otra cita existente'
+        )
+    
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Error al crear cita: {str(e)}'}), 500
@@ -593,15 +821,8 @@ def update_appointment(id):
     PUT: Actualiza una cita existente (fechas, paciente, servicio, notas).
     NO cambia el estado (usar endpoints dedicados).
     """
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    # PROFESSIONAL solo puede editar sus propias citas
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     # Solo se pueden editar citas programadas o no asistió
     if not appointment.can_be_edited():
@@ -632,26 +853,19 @@ def update_appointment(id):
     # ========================================================================
     # VALIDACIÓN CRÍTICA: ANTI-SOLAPAMIENTO (excluyendo esta cita)
     # ========================================================================
+    # EXISTS en el caso común (sin conflicto); la fila solo se carga si hay solapamiento
+    overlap_args = dict(
+        clinic_id=appointment.clinic_id,
+        professional_id=appointment.professional_id,
+        start_dt=start_dt,
+        end_dt=end_dt,
+        exclude_appointment_id=id
+    )
     if 'start_datetime' in data or 'end_datetime' in data:
-        overlapping = Appointment.check_overlap(
-            clinic_id=appointment.clinic_id,
-            professional_id=appointment.professional_id,
-            start_dt=start_dt,
-            end_dt=end_dt,
-            exclude_appointment_id=id
-        )
+        overlapping = Appointment.has_overlap(**overlap_args) and Appointment.check_overlap(**overlap_args)
         
         if overlapping:
-            return jsonify({
-                'error': 'Conflict',
-                'message': 'El nuevo horario se solapa con otra cita existente',
-                'conflicting_appointment': {
-                    'id': overlapping.id,
-                    'patient': overlapping.patient.name,
-                    'start': overlapping.start_datetime.replace(tzinfo=PERU_TZ).isoformat(),
-                    'end': overlapping.end_datetime.replace(tzinfo=PERU_TZ).isoformat()
-                }
-            }), 409
+            return overlap_conflict_response(overlapping, 'El nuevo horario se solapa con otra cita existente')
     
     # ========================================================================
     # ACTUALIZAR CITA
@@ -684,6 +898,15 @@ def update_appointment(id):
             'appointment': appointment.to_dict()
         })
     
+    except IntegrityError as e:
+        db.session.rollback()
+        if not is_overlap_violation(e):
+            return jsonify({'error': 'Los datos de la cita violan una restricción de la base de datos'}), 400
+        return overlap_conflict_response(
+            Appointment.check_overlap(**overlap_args),
+            'El nuevo horario se solapa con otra cita existente'
+        )
+    
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Error al actualizar cita: {str(e)}'}), 500
@@ -693,14 +916,8 @@ def update_appointment(id):
 @login_required
 def complete_appointment(id):
     """POST: Marca una cita como completada"""
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     try:
         appointment.complete()
@@ -722,14 +939,8 @@ def complete_appointment(id):
 @login_required
 def cancel_appointment(id):
     """POST: Cancela una cita con motivo opcional"""
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     data = request.get_json() or {}
     reason = data.get('reason', 'Cancelado por el profesional')
@@ -754,14 +965,8 @@ def cancel_appointment(id):
 @login_required
 def mark_no_show(id):
     """POST: Marca una cita como 'No Asistió'"""
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     data = request.get_json() or {}
     reason = data.get('reason', 'El paciente no asistió a la cita')
@@ -789,15 +994,12 @@ def delete_appointment(id):
     DELETE: Elimina permanentemente una cita.
     Solo CLINIC_ADMIN o SUPER_ADMIN pueden eliminar.
     """
-    appointment = Appointment.query.get_or_404(id)
-    
     # Solo admin puede eliminar permanentemente
     if not (current_user.is_super_admin() or current_user.is_clinic_admin()):
         return jsonify({'error': 'Solo administradores pueden eliminar citas permanentemente'}), 403
     
-    # Verificar acceso a la clínica
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas de la clínica del admin (ajenas → 404)
+    appointment = get_scoped_appointment_or_404(id)
     
     try:
         db.session.delete(appointment)
@@ -817,12 +1019,30 @@ def delete_appointment(id):
 @login_required
 def get_notifications():
     """GET: Obtiene notificaciones no leídas del usuario"""
-    notifications = Notification.query.filter_by(
-        user_id=current_user.id,
-        is_read=False
-    ).order_by(Notification.created_at.desc()).limit(10).all()
+    # Solo las columnas de la respuesta (cubiertas por ix_notification_unread):
+    # filas ligeras sin construir instancias Notification
+    rows = db.session.execute(
+        select(
+            Notification.id, Notification.message,
+            Notification.type, Notification.created_at
+        )
+        .where(Notification.user_id == current_user.id, Notification.is_read == False)
+        .order_by(Notification.created_at.desc())
+        .limit(10)
+    ).all()
     
-    return jsonify([notif.to_dict() for notif in notifications])
+    user_id = current_user.id
+    return jsonify([
+        {
+            'id': row.id,
+            'user_id': user_id,
+            'message': row.message,
+            'type': row.type,
+            'is_read': False,
+            'created_at': row.created_at.strftime('%Y-%m-%d %H:%M')
+        }
+        for row in rows
+    ])
 
 
 @api_bp.route('/notifications/<int:id>/read', methods=['POST'])
@@ -847,65 +1067,85 @@ def mark_notification_read(id):
 @api_bp.route('/stats', methods=['GET'])
 @login_required
 def get_stats():
-    """GET: Obtiene estadísticas según el rol del usuario"""
+    """
+    GET: Obtiene estadísticas según el rol del usuario.
+    Se cachean por usuario y se sirven con ETag. Las de una clínica usan la versión
+    de su cache (cualquier cambio confirmado las invalida), así que pueden vivir
+    STATS_CACHE_TIMEOUT segundos; las globales solo CACHE_DEFAULT_TIMEOUT.
+    """
     clinic_id = get_user_clinic_id()
+    
+    # Fecha de Perú leída una sola vez: la misma para la clave y para "hoy"
+    today = get_peru_time().date()
+    
+    if clinic_id:
+        # La fecha entra en la clave: appointments_today cambia a medianoche
+        cache_key = clinic_cache_key('stats', clinic_id, current_user.id, today)
+        timeout = current_app.config['STATS_CACHE_TIMEOUT']
+    else:
+        cache_key = f'stats:global:{current_user.id}'
+        timeout = None
+    
+    stats = cached(cache_key, lambda: _compute_stats(clinic_id, today), timeout=timeout)
+    
+    return etag_response(content_etag(stats), lambda: stats)
+
+
+def _compute_stats(clinic_id, today):
+    """Calcula las estadísticas del usuario actual (una consulta por rol) para la fecha dada"""
     stats = {}
     
+    def status_counts(prefix):
+        """count(*) FILTER (WHERE status = ...) por estado, en un solo SELECT"""
+        return [
+            func.count().filter(Appointment.status == status).label(f'{prefix}_{status.name.lower()}')
+            for status in (AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA, AppointmentStatus.CANCELADA)
+        ]
+    
     if current_user.is_super_admin():
-        # Estadísticas globales
-        stats['total_clinics'] = Clinic.query.filter_by(is_active=True).count()
-        stats['total_users'] = User.query.count()
-        stats['total_appointments'] = Appointment.query.count()
+        # Estadísticas globales (una sola consulta con subconsultas escalares)
+        stmt = select(
+            select(func.count(Clinic.id)).where(Clinic.is_active == True).scalar_subquery().label('total_clinics'),
+            select(func.count(User.id)).scalar_subquery().label('total_users'),
+            select(func.count(Appointment.id)).scalar_subquery().label('total_appointments')
+        )
     
     elif current_user.is_clinic_admin():
-        # Estadísticas de la clínica
-        stats['professionals_count'] = User.query.filter_by(
-            clinic_id=clinic_id,
-            role=UserRole.PROFESSIONAL,
-            is_active=True
-        ).count()
-        stats['patients_count'] = Patient.query.filter_by(clinic_id=clinic_id).count()
-        stats['appointments_programada'] = Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            status=AppointmentStatus.PROGRAMADA
-        ).count()
-        stats['appointments_completada'] = Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            status=AppointmentStatus.COMPLETADA
-        ).count()
-        stats['appointments_cancelada'] = Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            status=AppointmentStatus.CANCELADA
-        ).count()
+        # Estadísticas de la clínica: conteos por estado + profesionales y pacientes en un round-trip
+        stmt = select(
+            *status_counts('appointments'),
+            select(func.count(User.id)).where(
+                User.clinic_id == clinic_id,
+                User.role == UserRole.PROFESSIONAL,
+                User.is_active == True
+            ).scalar_subquery().label('professionals_count'),
+            select(func.count(Patient.id)).where(
+                Patient.clinic_id == clinic_id
+            ).scalar_subquery().label('patients_count')
+        ).select_from(Appointment).where(Appointment.clinic_id == clinic_id)
     
     elif current_user.is_professional():
-        # Estadísticas del profesional
-        stats['my_appointments_programada'] = Appointment.query.filter_by(
-            professional_id=current_user.id,
-            status=AppointmentStatus.PROGRAMADA
-        ).count()
-        stats['my_appointments_completada'] = Appointment.query.filter_by(
-            professional_id=current_user.id,
-            status=AppointmentStatus.COMPLETADA
-        ).count()
-        stats['my_appointments_cancelada'] = Appointment.query.filter_by(
-            professional_id=current_user.id,
-            status=AppointmentStatus.CANCELADA
-        ).count()
-        
         # Citas de hoy
-        from datetime import date
-        today_start = datetime.combine(date.today(), datetime.min.time())
-        today_end = datetime.combine(date.today(), datetime.max.time())
+        today_start = datetime.combine(today, datetime.min.time())
+        tomorrow_start = today_start + timedelta(days=1)  # Rango semiabierto [hoy, mañana)
         
-        stats['appointments_today'] = Appointment.query.filter(
-            Appointment.professional_id == current_user.id,
-            Appointment.start_datetime >= today_start,
-            Appointment.start_datetime <= today_end,
-            Appointment.status == AppointmentStatus.PROGRAMADA
-        ).count()
+        # Estadísticas del profesional (conteos por estado + citas de hoy en un solo SELECT)
+        stmt = select(
+            *status_counts('my_appointments'),
+            func.count().filter(
+                Appointment.start_datetime >= today_start,
+                Appointment.start_datetime < tomorrow_start,
+                Appointment.status == AppointmentStatus.PROGRAMADA
+            ).label('appointments_today')
+        ).select_from(Appointment).where(Appointment.professional_id == current_user.id)
+    
+    else:
+        stmt = None
     
-    return jsonify(stats)
+    if stmt is not None:
+        stats.update(db.session.execute(stmt).one()._mapping)
+    
+    return stats
 
 
 
@@ -936,45 +1176,58 @@ def check_availability():
     
     # Parsear fecha
     try:
-        target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        target_date = date.fromisoformat(date_str)  # Parser ISO en C
     except ValueError:
         return jsonify({'error': 'Formato de fecha inválido. Usa YYYY-MM-DD'}), 400
     
     # Obtener todas las citas del profesional en esa fecha
     day_start = datetime.combine(target_date, datetime.min.time())
-    day_end = datetime.combine(target_date, datetime.max.time())
-    
-    appointments = Appointment.query.filter(
-        Appointment.professional_id == professional_id,
-        Appointment.clinic_id == professional.clinic_id,
-        Appointment.start_datetime >= day_start,
-        Appointment.start_datetime <= day_end,
-        Appointment.status.in_([AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA])
-    ).order_by(Appointment.start_datetime).all()
+    next_day_start = day_start + timedelta(days=1)  # Rango semiabierto [día, día siguiente)
+    
+    # Solo se necesitan los intervalos (inicio, fin), ordenados por inicio
+    appointments = db.session.execute(
+        select(Appointment.start_datetime, Appointment.end_datetime).where(
+            Appointment.professional_id == professional_id,
+            Appointment.clinic_id == professional.clinic_id,
+            Appointment.start_datetime >= day_start,
+            Appointment.start_datetime < next_day_start,
+            Appointment.status.in_(ACTIVE_STATUSES)
+        ).order_by(Appointment.start_datetime)
+    ).all()
+    
+    # Fusionar citas solapadas en intervalos ocupados disjuntos y ordenados
+    busy = []
+    for apt_start, apt_end in appointments:
+        if busy and apt_start < busy[-1][1]:
+            busy[-1][1] = max(busy[-1][1], apt_end)
+        else:
+            busy.append([apt_start, apt_end])
     
     # Construir slots disponibles (horario: 8:00 - 20:00, cada 30 min)
-    from datetime import time, timedelta
-    
-    work_start = datetime.combine(target_date, time(8, 0))
-    work_end = datetime.combine(target_date, time(20, 0))
+    # Con zona horaria de Perú, igual que las citas leídas de la BD
+    work_start = datetime.combine(target_date, time(8, 0), tzinfo=PERU_TZ)
+    work_end = datetime.combine(target_date, time(20, 0), tzinfo=PERU_TZ)
     slot_duration = timedelta(minutes=duration)
     
     available_slots = []
     current_slot = work_start
+    busy_index = 0
     
+    # Barrido lineal: slots e intervalos avanzan juntos (O(slots + citas))
     while current_slot + slot_duration <= work_end:
         slot_end = current_slot + slot_duration
         
+        # Descartar intervalos que terminan antes de este slot
+        while busy_index < len(busy) and busy[busy_index][1] <= current_slot:
+            busy_index += 1
+        
         # Verificar si el slot está ocupado
-        is_occupied = any(
-            apt.start_datetime < slot_end and apt.end_datetime > current_slot
-            for apt in appointments
-        )
+        is_occupied = busy_index < len(busy) and busy[busy_index][0] < slot_end
         
         if not is_occupied:
             available_slots.append({
-                'start': current_slot.replace(tzinfo=PERU_TZ).isoformat(),
-                'end': slot_end.replace(tzinfo=PERU_TZ).isoformat()
+                'start': current_slot,
+                'end': slot_end
             })
         
         current_slot += slot_duration
@@ -991,20 +1244,45 @@ def check_availability():
 # ============================================================================
 # API: RECORDATORIOS DE WHATSAPP (DEEP LINK)
 # ============================================================================
+@lru_cache(maxsize=512)
+def _reminder_template(service_name, clinic_name):
+    """
+    Plantilla del recordatorio de WhatsApp, compilada una vez por (servicio, clínica).
+    Un cambio de nombre genera otra clave, así que no requiere invalidación.
+    
+    Returns:
+        tuple: (texto, texto codificado para URL), ambos con {} para
+            nombre del paciente, fecha y hora (en ese orden)
+    """
+    static_parts = (
+        'Hola ',
+        f', te recordamos tu cita de {service_name} el ',
+        ' a las ',
+        f' hrs en {clinic_name}. ¡Te esperamos!'
+    )
+    # Escapar llaves del texto fijo para str.format (quote ya las codifica)
+    message_template = '{}'.join(
+        part.replace('{', '{{').replace('}', '}}') for part in static_parts
+    )
+    encoded_template = '{}'.join(quote(part) for part in static_parts)
+    return message_template, encoded_template
+
+
 @api_bp.route('/appointments/<int:id>/whatsapp-reminder', methods=['GET'])
 @login_required
 def get_whatsapp_reminder(id):
     """
     GET: Genera deep link de WhatsApp para enviar recordatorio.
     """
-    appointment = Appointment.query.get_or_404(id)
-    
-    # Verificar acceso
-    if not verify_clinic_access(appointment.clinic_id):
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if current_user.is_professional() and appointment.professional_id != current_user.id:
-        return jsonify({'error': 'No autorizado'}), 403
+    # Solo citas visibles para el usuario (ajenas → 404); paciente, servicio y
+    # clínica en la misma consulta (sin lazy loads posteriores)
+    appointment = get_scoped_appointment_or_404(
+        id,
+        joinedload(Appointment.patient).load_only(Patient.id, Patient.name, Patient.phone),
+        joinedload(Appointment.service).load_only(Service.id, Service.name),
+        joinedload(Appointment.clinic).load_only(Clinic.id, Clinic.name),
+        lazyload(Appointment.professional)
+    )
     
     # Obtener paciente
     patient = appointment.patient
@@ -1012,7 +1290,7 @@ def get_whatsapp_reminder(id):
         return jsonify({'error': 'El paciente no tiene número de teléfono registrado'}), 400
     
     # Formatear fecha/hora de la cita
-    start_dt = appointment.start_datetime.replace(tzinfo=PERU_TZ)
+    start_dt = appointment.start_datetime
     fecha_str = start_dt.strftime('%d/%m/%Y')
     hora_str = start_dt.strftime('%H:%M')
     
@@ -1020,16 +1298,13 @@ def get_whatsapp_reminder(id):
     service_name = appointment.service.name if appointment.service else 'consulta'
     clinic_name = appointment.clinic.name if appointment.clinic else 'nuestra clínica'
     
-    message = (
-        f"Hola {patient.name}, "
-        f"te recordamos tu cita de {service_name} "
-        f"el {fecha_str} a las {hora_str} hrs "
-        f"en {clinic_name}. "
-        f"¡Te esperamos!"
-    )
+    # Plantilla compilada por (servicio, clínica): solo se codifican las partes variables
+    message_template, encoded_template = _reminder_template(service_name, clinic_name)
+    message = message_template.format(patient.name, fecha_str, hora_str)
+    encoded_message = encoded_template.format(quote(patient.name), quote(fecha_str), quote(hora_str))
     
     # Generar deep link
-    whatsapp_link = patient.get_whatsapp_link(message)
+    whatsapp_link = patient.get_whatsapp_link(encoded_message, quoted=True)
     
     if not whatsapp_link:
         return jsonify({'error': 'No se pudo generar el enlace de WhatsApp'}), 500
@@ -1054,26 +1329,24 @@ def export_appointments_csv():
         - start (str): Fecha inicio (YYYY-MM-DD)
         - end (str): Fecha fin (YYYY-MM-DD)
         - status (str): Filtrar por estado
-    """
-    from flask import Response
-    import csv
-    from io import StringIO
     
-    clinic_id = get_user_clinic_id()
+    Sobre EXPORT_ASYNC_THRESHOLD citas el archivo se genera en segundo plano:
+    responde 202 con la URL de estado en lugar del CSV.
+    """
+    clinic_id = resolve_clinic_id()
     
-    # Base query según rol
+    # Filtro base según rol
     if current_user.is_super_admin():
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
+        if not clinic_id:
             return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        query = Appointment.query.filter_by(clinic_id=clinic_id_param)
+        criteria = [Appointment.clinic_id == clinic_id]
     elif current_user.is_clinic_admin():
-        query = Appointment.query.filter_by(clinic_id=clinic_id)
+        criteria = [Appointment.clinic_id == clinic_id]
     elif current_user.is_professional():
-        query = Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            professional_id=current_user.id
-        )
+        criteria = [
+            Appointment.clinic_id == clinic_id,
+            Appointment.professional_id == current_user.id
+        ]
     else:
         return jsonify({'error': 'No autorizado'}), 403
     
@@ -1084,72 +1357,88 @@ def export_appointments_csv():
     if start_str and end_str:
         try:
             start_date = datetime.strptime(start_str, '%Y-%m-%d')
-            end_date = datetime.strptime(end_str, '%Y-%m-%d')
-            query = query.filter(
-                and_(
-                    Appointment.start_datetime >= start_date,
-                    Appointment.start_datetime <= end_date
-                )
-            )
+            # Rango semiabierto [start, end + 1 día): incluye todo el día final
+            end_date = datetime.strptime(end_str, '%Y-%m-%d') + timedelta(days=1)
+            criteria += [
+                Appointment.start_datetime >= start_date,
+                Appointment.start_datetime < end_date
+            ]
         except ValueError:
             return jsonify({'error': 'Formato de fecha inválido. Usa YYYY-MM-DD'}), 400
     
     status = request.args.get('status')
     if status:
-        try:
-            query = query.filter_by(status=AppointmentStatus(status))
-        except ValueError:
+        status_filter = APPOINTMENT_STATUS_BY_VALUE.get(status)
+        if status_filter is None:
             return jsonify({'error': f'Estado inválido: {status}'}), 400
+        criteria.append(Appointment.status == status_filter)
     
-    appointments = query.order_by(Appointment.start_datetime).all()
-    
-    # Crear CSV
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Headers
-    writer.writerow([
-        'ID',
-        'Fecha',
-        'Hora Inicio',
-        'Hora Fin',
-        'Paciente',
-        'Teléfono',
-        'Servicio',
-        'Profesional',
-        'Estado',
-        'Notas'
-    ])
-    
-    # Datos
-    for apt in appointments:
-        start_dt = apt.start_datetime.replace(tzinfo=PERU_TZ)
-        end_dt = apt.end_datetime.replace(tzinfo=PERU_TZ)
-        
-        writer.writerow([
-            apt.id,
-            start_dt.strftime('%Y-%m-%d'),
-            start_dt.strftime('%H:%M'),
-            end_dt.strftime('%H:%M'),
-            apt.patient.name if apt.patient else 'N/A',
-            apt.patient.phone if apt.patient else 'N/A',
-            apt.service.name if apt.service else 'N/A',
-            apt.professional.full_name or apt.professional.username if apt.professional else 'N/A',
-            apt.status.value,
-            apt.notes or ''
-        ])
-
-    # Preparar respuesta
-    output.seek(0)
     filename = f"citas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
+    # Exportación grande: se escribe en un hilo aparte y el worker queda libre.
+    # Solo con cache compartido entre workers; si no, se envía en la misma petición
+    app = current_app._get_current_object()
+    threshold = app.config.get('EXPORT_ASYNC_THRESHOLD')
+    if threshold and async_exports_enabled(app) and count_appointments(criteria) > threshold:
+        job_id = start_export_job(app, criteria, current_user.id, filename)
+        return jsonify({
+            'message': 'La exportación se está generando',
+            'job_id': job_id,
+            'status_url': url_for('api.get_export_job_status', job_id=job_id)
+        }), 202
+    
+    # Exportación normal: CSV enviado por partes mientras se lee
+    headers = {
+        'Content-Disposition': f'attachment; filename={filename}',
+        'Vary': 'Accept-Encoding'
+    }
+    chunks = appointments_csv(criteria)
+    
+    # Comprimido con gzip si el cliente lo acepta (el navegador lo descomprime
+    # al descargar, por eso el archivo conserva la extensión .csv)
+    if request.accept_encodings['gzip'] > 0:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    
     return Response(
-        output.getvalue(),
+        stream_with_context(chunks),
         mimetype='text/csv',
-        headers={
-            'Content-Disposition': f'attachment; filename={filename}'
-        }
+        headers=headers
+    )
+
+
+@api_bp.route('/export/appointments/<job_id>', methods=['GET'])
+@login_required
+def get_export_job_status(job_id):
+    """
+    GET: Estado de una exportación en segundo plano.
+    Responde 202 mientras se genera y el CSV cuando está listo.
+    """
+    job = get_export_job(job_id)
+    
+    # Solo el usuario que la pidió puede verla
+    if not job or job['user_id'] != current_user.id:
+        return jsonify({'error': 'Exportación no encontrada'}), 404
+    
+    if job['status'] == 'pending':
+        return jsonify({'status': 'pending'}), 202
+    
+    if job['status'] == 'failed':
+        return jsonify({'status': 'failed', 'error': 'No se pudo generar la exportación'}), 500
+    
+    response = send_file(
+        job['path'],
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=job['filename']
     )
+    # Descarga única: el trabajo se elimina ya y el archivo al cerrar la respuesta
+    # (ya sin contexto de la app, por eso no se toca el cache ahí). Werkzeug no
+    # ejecuta call_on_close con direct_passthrough: el archivo pasa por el iterador
+    discard_export_job(job_id)
+    response.direct_passthrough = False
+    response.call_on_close(lambda: remove_export_file(job['path']))
+    return response
 
 
 # ============================================================================
@@ -1163,11 +1452,17 @@ def get_report_summary():
     Query params:
         - start (str): Fecha inicio (YYYY-MM-DD)
         - end (str): Fecha fin (YYYY-MM-DD)
+    
+    En PostgreSQL las cifras salen de la vista materializada y pueden ir atrasadas
+    hasta REPORT_VIEW_REFRESH segundos respecto de las citas.
     """
     if not (current_user.is_clinic_admin() or current_user.is_super_admin()):
         return jsonify({'error': 'Solo administradores pueden ver reportes'}), 403
     
-    clinic_id = get_user_clinic_id()
+    # Clínica efectiva resuelta una sola vez (SUPER_ADMIN: ?clinic_id=)
+    clinic_id = resolve_clinic_id()
+    if not clinic_id:
+        return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
     
     start_str = request.args.get('start')
     end_str = request.args.get('end')
@@ -1177,69 +1472,61 @@ def get_report_summary():
     
     try:
         start_date = datetime.strptime(start_str, '%Y-%m-%d')
-        end_date = datetime.strptime(end_str, '%Y-%m-%d')
+        # Rango semiabierto [start, end + 1 día): incluye todo el día final
+        end_date = datetime.strptime(end_str, '%Y-%m-%d') + timedelta(days=1)
     except ValueError:
         return jsonify({'error': 'Formato de fecha inválido. Usa YYYY-MM-DD'}), 400
     
-    # Base query
-    if current_user.is_super_admin():
-        clinic_id_param = request.args.get('clinic_id', type=int)
-        if not clinic_id_param:
-            return jsonify({'error': 'clinic_id requerido para SUPER_ADMIN'}), 400
-        query = Appointment.query.filter_by(clinic_id=clinic_id_param)
+    # Vista materializada en PostgreSQL (se refresca antes de leerla si está vencida)
+    use_view, snapshot = refresh_view_if_stale(current_app._get_current_object())
+    
+    if use_view:
+        # Leído de la vista: no sigue la versión de la clínica (tras una escritura se
+        # recalcularía de la misma vista atrasada). Se cachea por refresco de la vista
+        # y vence con él; mientras otro refresco está en curso no se cachea
+        cache_key = f'report_summary:view:{snapshot}:{clinic_id}:{start_str}:{end_str}' if snapshot else None
+        timeout = current_app.config['REPORT_VIEW_REFRESH']
     else:
-        query = Appointment.query.filter_by(clinic_id=clinic_id)
+        # Cache por clínica y rango: la versión de la clínica lo invalida ante cualquier
+        # cambio confirmado; un rango ya cerrado no cambia y puede vivir mucho más
+        cache_key = clinic_cache_key('report_summary', clinic_id, start_str, end_str)
+        today_start = datetime.combine(get_peru_time().date(), datetime.min.time())
+        timeout = current_app.config[
+            'REPORT_HISTORY_CACHE_TIMEOUT' if end_date <= today_start else 'REPORT_CACHE_TIMEOUT'
+        ]
     
-    # Filtrar por rango de fechas
-    query = query.filter(
-        and_(
-            Appointment.start_datetime >= start_date,
-            Appointment.start_datetime <= end_date
-        )
+    report = cached(
+        cache_key, lambda: _compute_report_summary(clinic_id, start_date, end_date, use_view),
+        timeout=timeout
     )
     
-    # Contadores por estado
-    total_appointments = query.count()
-    programadas = query.filter_by(status=AppointmentStatus.PROGRAMADA).count()
-    completadas = query.filter_by(status=AppointmentStatus.COMPLETADA).count()
-    canceladas = query.filter_by(status=AppointmentStatus.CANCELADA).count()
-    no_asistio = query.filter_by(status=AppointmentStatus.NO_ASISTIO).count()
-    
-    # Ingresos estimados (solo citas completadas con servicio)
-    from sqlalchemy import func
-    ingresos = db.session.query(func.sum(Service.price)).join(
-        Appointment, Appointment.service_id == Service.id
-    ).filter(
-        Appointment.clinic_id == (clinic_id or clinic_id_param),
-        Appointment.status == AppointmentStatus.COMPLETADA,
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    ).scalar() or 0
-    
-    # Citas por profesional
-    appointments_by_professional = db.session.query(
-        User.full_name,
-        User.username,
-        func.count(Appointment.id).label('count')
-    ).join(
-        Appointment, Appointment.professional_id == User.id
-    ).filter(
-        Appointment.clinic_id == (clinic_id or clinic_id_param),
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    ).group_by(User.id).all()
-    
     return jsonify({
         'period': {
             'start': start_str,
             'end': end_str
         },
+        **report
+    })
+
+
+def _compute_report_summary(clinic_id, start_date, end_date, use_view):
+    """Contadores, ingresos y citas por profesional del rango [start_date, end_date)"""
+    # Contadores por estado e ingresos estimados (solo citas completadas con servicio)
+    rows = status_totals(clinic_id, start_date, end_date, use_view)
+    
+    counts = {row_status: count for row_status, count, _ in rows}
+    ingresos = sum(revenue for _, _, revenue in rows if revenue is not None)
+    
+    # Citas por profesional
+    appointments_by_professional = professional_totals(clinic_id, start_date, end_date, use_view)
+    
+    return {
         'summary': {
-            'total': total_appointments,
-            'programadas': programadas,
-            'completadas': completadas,
-            'canceladas': canceladas,
-            'no_asistio': no_asistio
+            'total': sum(counts.values()),
+            'programadas': counts.get(AppointmentStatus.PROGRAMADA, 0),
+            'completadas': counts.get(AppointmentStatus.COMPLETADA, 0),
+            'canceladas': counts.get(AppointmentStatus.CANCELADA, 0),
+            'no_asistio': counts.get(AppointmentStatus.NO_ASISTIO, 0)
         },
         'ingresos_estimados': float(ingresos),
         'by_professional': [
@@ -1249,7 +1536,7 @@ def get_report_summary():
             }
             for prof in appointments_by_professional
         ]
-    })
+    }
 
 
 # ============================================================================
@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from project import db
-from project.models import User, Notification, UserRole, get_peru_time
+from project.models import User, Appointment, Notification, UserRole, get_peru_time, PERM_MANAGE_APPT
 from functools import wraps
+from sqlalchemy import func, select, text, update
+import time
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -50,7 +52,7 @@ def professional_required(f):
             flash('Por favor inicia sesión para acceder.', 'warning')
             return redirect(url_for('auth.login'))
         
-        if not current_user.can_manage_appointments():
+        if not current_user.permissions_mask & PERM_MANAGE_APPT:
             flash('Acceso denegado. Se requieren permisos de profesional.', 'danger')
             return redirect(url_for('auth.dashboard'))
         
@@ -84,10 +86,12 @@ def login():
             flash('Por favor completa todos los campos.', 'warning')
             return render_template('login.html')
         
-        # Buscar usuario por username o email
-        user = User.query.filter(
-            (User.username == username_or_email) | (User.email == username_or_email)
-        ).first()
+        # Buscar usuario por username o email: dos búsquedas por índice único
+        # (un OR entre columnas distintas suele terminar en un escaneo de la tabla)
+        user = (
+            User.query.filter_by(username=username_or_email).first()
+            or User.query.filter_by(email=username_or_email).first()
+        )
         
         # Verificar credenciales
         if user and user.check_password(password):
@@ -107,7 +111,6 @@ def login():
             
             # Actualizar último login
             user.last_login = get_peru_time()
-            db.session.commit()
             
             # Crear notificación de bienvenida
             welcome_notification = Notification(
@@ -116,9 +119,8 @@ def login():
                 type='success'
             )
             db.session.add(welcome_notification)
-            db.session.commit()
             
-            # Flash message según rol
+            # Flash message según rol (antes del commit: después el usuario queda expirado)
             role_names = {
                 UserRole.SUPER_ADMIN: 'Super Administrador',
                 UserRole.CLINIC_ADMIN: 'Administrador de Clínica',
@@ -126,6 +128,9 @@ def login():
             }
             flash(f'¡Bienvenido, {role_names.get(user.role, user.username)}!', 'success')
             
+            # Último login y notificación en una sola transacción
+            db.session.commit()
+            
             # Redirigir según la página solicitada o al dashboard
             next_page = request.args.get('next')
             if next_page and next_page.startswith('/'):
@@ -302,12 +307,20 @@ def toggle_dark_mode():
     API: Alterna el modo oscuro del usuario.
     """
     try:
-        current_user.pref_dark_mode = not current_user.pref_dark_mode
+        # Un solo UPDATE ... RETURNING: se invierte en la base y vuelve el valor nuevo,
+        # sin flush del ORM ni recargar el usuario tras el commit
+        dark_mode = db.session.execute(
+            update(User)
+            .where(User.id == current_user.id)
+            .values(pref_dark_mode=~User.pref_dark_mode)
+            .returning(User.pref_dark_mode)
+            .execution_options(synchronize_session=False)
+        ).scalar_one()
         db.session.commit()
         
         return jsonify({
             'message': 'Preferencia actualizada.',
-            'dark_mode': current_user.pref_dark_mode
+            'dark_mode': dark_mode
         })
     
     except Exception as e:
@@ -325,7 +338,10 @@ def get_current_user():
     API: Retorna información del usuario autenticado.
     Útil para el frontend.
     """
-    user_data = current_user.to_dict(include_sensitive=True)
+    appointments_count = db.session.scalar(
+        select(func.count(Appointment.id)).where(Appointment.professional_id == current_user.id)
+    )
+    user_data = current_user.to_dict(include_sensitive=True, appointments_count=appointments_count)
     
     # Agregar información de clínica si aplica
     if current_user.clinic_id:
@@ -337,14 +353,23 @@ def get_current_user():
 # ============================================================================
 # HEALTH CHECK (para monitoreo)
 # ============================================================================
+# Último ping exitoso a la base (time.monotonic): los probes dentro de la
+# ventana responden sin consultar la base
+_HEALTH_TTL = 5
+_last_db_ok = [0.0]
+
+
 @auth_bp.route('/health', methods=['GET'])
 def health_check():
     """
     Endpoint de health check para monitoreo de la aplicación.
+    El resultado sano se reutiliza durante _HEALTH_TTL segundos.
     """
     try:
-        # Verificar conexión a base de datos
-        db.session.execute('SELECT 1')
+        # Verificar conexión a base de datos (como máximo una vez por ventana)
+        if time.monotonic() - _last_db_ok[0] >= _HEALTH_TTL:
+            db.session.execute(text('SELECT 1'))
+            _last_db_ok[0] = time.monotonic()
         
         return jsonify({
             'status': 'healthy',
@@ -396,14 +421,17 @@ def verify_clinic_access(clinic_id):
 # ============================================================================
 # CONTEXT PROCESSOR: Variables globales para templates
 # ============================================================================
+# Valores constantes: se arman una sola vez, no en cada render
+_TEMPLATE_GLOBALS = {
+    'UserRole': UserRole,
+    'app_name': 'AgendaNova',
+    'app_version': '2.0.0'
+}
+
+
 @auth_bp.app_context_processor
 def inject_global_vars():
     """
     Inyecta variables globales en todos los templates.
     """
-    return {
-        'UserRole': UserRole,
-        'current_year': get_peru_time().year,
-        'app_name': 'AgendaNova',
-        'app_version': '2.0.0'
-    }
\ No newline at end of file
+    return {**_TEMPLATE_GLOBALS, 'current_year': get_peru_time().year}
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Cache de resultados por clínica (Flask-Caching).
+
+Cada clínica tiene una versión en el cache y las claves de resultados la incluyen.
+Al confirmar (commit) cambios en modelos de la clínica se renueva la versión:
+las entradas anteriores dejan de usarse y expiran solas por TTL.
+
+Solo con un cache compartido entre procesos (ej: Redis): con SimpleCache cada
+worker de gunicorn tiene su propia versión y un cambio confirmado en un worker no
+invalidaría lo cacheado en los demás. Con un cache local estos resultados no se
+cachean (clinic_cache_key retorna None).
+"""
+import time
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from project import cache
+from project.models import Appointment, Patient, Service, User
+
+# Modelos cuyos cambios invalidan el cache de su clínica
+# (autocomplete de pacientes, contadores de /stats, reportes y catálogo de servicios)
+TRACKED_MODELS = (Patient, Appointment, User, Service)
+
+_PENDING_KEY = '_cache_dirty_clinics'
+
+# Backends de cache locales al proceso: lo que se guarda no se ve desde otros workers
+_LOCAL_CACHE_TYPES = {'SimpleCache', 'NullCache', 'simple', 'null'}
+
+
+def shared_cache_enabled(app):
+    """True si el cache configurado es compartido entre procesos (no SimpleCache/NullCache)"""
+    cache_type = str(app.config.get('CACHE_TYPE') or 'NullCache').rsplit('.', 1)[-1]
+    return cache_type not in _LOCAL_CACHE_TYPES
+
+
+def clinic_cache_version(clinic_id):
+    """
+    Versión actual del cache de la clínica.
+    Si no existe (cache nuevo o clave desalojada) se crea con la hora actual: una
+    versión nunca se repite, así que las entradas y ETags anteriores no vuelven a valer.
+    """
+    key = f'clinic_version:{clinic_id}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=0)
+        version = cache.get(key)
+    return version
+
+
+def bump_clinic_cache_version(clinic_id):
+    """Invalida todas las entradas cacheadas de la clínica"""
+    cache.set(f'clinic_version:{clinic_id}', time.time_ns(), timeout=0)
+
+
+def clinic_cache_key(prefix, clinic_id, *parts):
+    """
+    Clave de cache versionada por clínica.
+
+    Args:
+        prefix (str): Nombre del resultado (ej: 'search_patients')
+        clinic_id (int): ID de la clínica
+        *parts: Parámetros que distinguen el resultado (ej: término de búsqueda)
+
+    Returns:
+        str | None: None si el cache no es compartido (no se cachea, ver cached())
+    """
+    if not shared_cache_enabled(current_app):
+        return None
+    version = clinic_cache_version(clinic_id)
+    return ':'.join(str(part) for part in (prefix, clinic_id, version, *parts))
+
+
+def cached(cache_key, build, timeout=None):
+    """
+    Resultado de build() cacheado bajo cache_key.
+    Sin clave (cache_key None) se calcula en cada llamada.
+    """
+    if cache_key is None:
+        return build()
+    value = cache.get(cache_key)
+    if value is None:
+        value = build()
+        cache.set(cache_key, value, timeout=timeout)
+    return value
+
+
+# ============================================================================
+# EVENTOS: invalidación al confirmar cambios
+# ============================================================================
+@event.listens_for(Session, 'after_flush')
+def _collect_dirty_clinics(session, flush_context):
+    """Registra las clínicas con cambios en modelos cacheados (aún sin commit)"""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, TRACKED_MODELS) and obj.clinic_id is not None:
+            session.info.setdefault(_PENDING_KEY, set()).add(obj.clinic_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_dirty_clinics(session):
+    """Renueva la versión de las clínicas modificadas una vez confirmado el cambio"""
+    for clinic_id in session.info.pop(_PENDING_KEY, ()):
+        bump_clinic_cache_version(clinic_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_dirty_clinics(session):
+    """Cambios descartados: no hay nada que invalidar"""
+    session.info.pop(_PENDING_KEY, None)
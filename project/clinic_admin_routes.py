@@ -1,16 +1,31 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import (
+    Blueprint, render_template, request, jsonify, flash, redirect, url_for, g, abort, current_app,
+    Response, stream_with_context
+)
 from flask_login import login_required, current_user
 from functools import wraps
+import secrets
 from project import db
+from project.caching import cached, clinic_cache_key
+from project.json_utils import stream_json_array
 from project.models import (
     User, Clinic, Appointment, Patient, Service, Notification,
-    AppointmentStatus, UserRole, get_peru_time
+    AppointmentStatus, UserRole, get_peru_time, STATUS_COLORS, DEFAULT_STATUS_COLOR,
+    ACTIVE_STATUSES
 )
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, select, case, lambda_stmt, bindparam
+from sqlalchemy.orm import contains_eager, joinedload, lazyload, load_only
 from datetime import datetime, timedelta
+from project.api_routes import parse_datetime
 
 clinic_admin_bp = Blueprint('clinic_admin', __name__)
 
+# Columnas de User que usa to_dict() (sin password_hash)
+_PROFESSIONAL_LOAD = (
+    User.id, User.username, User.email, User.role, User.full_name, User.phone,
+    User.is_active, User.clinic_id, User.pref_dark_mode, User.created_at, User.last_login
+)
+
 
 # ============================================================================
 # DECORADOR: Solo CLINIC_ADMIN o SUPER_ADMIN
@@ -31,19 +46,54 @@ def clinic_admin_required(f):
     return decorated_function
 
 
+def professional_of_clinic_required(f):
+    """
+    Decorador: carga una sola vez el profesional <id> de la clínica y lo deja en
+    g.professional. De otra clínica → 404; usuario que no es profesional → 400.
+    """
+    @wraps(f)
+    def decorated_function(id, *args, **kwargs):
+        professional = db.session.get(User, id)
+        
+        if professional is None or professional.clinic_id != get_clinic_id():
+            return jsonify({'error': 'Profesional no encontrado en esta clínica'}), 404
+        
+        if professional.role != UserRole.PROFESSIONAL:
+            return jsonify({'error': 'El usuario no es un profesional'}), 400
+        
+        g.professional = professional
+        return f(id, *args, **kwargs)
+    return decorated_function
+
+
 def get_clinic_id():
     """
     Obtiene el clinic_id del usuario autenticado.
     Para CLINIC_ADMIN: su clinic_id
     Para SUPER_ADMIN: debe especificar clinic_id en query params
+    
+    Se calcula una vez por petición y se guarda en g (como get_user_clinic_id en la API):
+    después de un commit current_user queda expirado y leerlo de nuevo haría un SELECT.
     """
-    if current_user.is_super_admin():
-        # SUPER_ADMIN necesita especificar clinic_id
-        clinic_id = request.args.get('clinic_id', type=int)
-        if not clinic_id:
-            return None
-        return clinic_id
-    return current_user.clinic_id
+    if 'admin_clinic_id' not in g:
+        if current_user.is_super_admin():
+            # SUPER_ADMIN necesita especificar clinic_id
+            g.admin_clinic_id = request.args.get('clinic_id', type=int) or None
+        else:
+            g.admin_clinic_id = current_user.clinic_id
+    return g.admin_clinic_id
+
+
+def get_current_clinic():
+    """
+    Clínica del request (memoizada en g).
+    La del usuario ya está en la sesión (user_loader la carga con el usuario):
+    session.get la toma del identity map sin otra consulta.
+    """
+    if 'current_clinic' not in g:
+        clinic_id = get_clinic_id()
+        g.current_clinic = db.session.get(Clinic, clinic_id) if clinic_id else None
+    return g.current_clinic
 
 
 # ============================================================================
@@ -64,46 +114,49 @@ def dashboard():
         return redirect(url_for('auth.dashboard'))
     
     # Obtener clínica
-    clinic = Clinic.query.get_or_404(clinic_id)
+    clinic = get_current_clinic() or abort(404)
     
     # Verificar que la clínica esté activa
     if not clinic.is_active:
         flash('Esta clínica ha sido suspendida. Contacta al administrador del sistema.', 'danger')
         return redirect(url_for('auth.logout'))
     
-    # Estadísticas de la clínica
-    stats = {
-        'professionals': User.query.filter_by(
-            clinic_id=clinic_id,
-            role=UserRole.PROFESSIONAL,
-            is_active=True
-        ).count(),
-        'patients': Patient.query.filter_by(clinic_id=clinic_id).count(),
-        'services': Service.query.filter_by(
-            clinic_id=clinic_id,
-            is_active=True
-        ).count(),
-        'appointments_programadas': Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            status=AppointmentStatus.PROGRAMADA
-        ).count(),
-        'appointments_completadas': Appointment.query.filter_by(
-            clinic_id=clinic_id,
-            status=AppointmentStatus.COMPLETADA
-        ).count(),
-        'appointments_hoy': 0  # Calculado abajo
-    }
-    
-    # Citas de hoy
-    today_start = datetime.combine(datetime.now().date(), datetime.min.time())
-    today_end = datetime.combine(datetime.now().date(), datetime.max.time())
+    # Citas de hoy: rango semiabierto [hoy, mañana), con la fecha de Perú
+    # (las citas se guardan en hora local de Perú, no en la del servidor)
+    today_start = datetime.combine(get_peru_time().date(), datetime.min.time())
+    tomorrow_start = today_start + timedelta(days=1)
+    
+    # Estadísticas de la clínica en un solo SELECT: conteos de citas con
+    # count(*) FILTER (WHERE ...) y subconsultas escalares para el resto.
+    # lambda_stmt: el SQL se compila una vez por proceso, clinic_id y fechas van como
+    # parámetros (el filtro multi-tenant automático no aplica: clinic_id va explícito)
+    stmt = lambda_stmt(lambda: select(
+        select(func.count(User.id)).where(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.PROFESSIONAL,
+            User.is_active == True
+        ).scalar_subquery().label('professionals'),
+        select(func.count(Patient.id)).where(
+            Patient.clinic_id == clinic_id
+        ).scalar_subquery().label('patients'),
+        select(func.count(Service.id)).where(
+            Service.clinic_id == clinic_id,
+            Service.is_active == True
+        ).scalar_subquery().label('services'),
+        func.count().filter(
+            Appointment.status == AppointmentStatus.PROGRAMADA
+        ).label('appointments_programadas'),
+        func.count().filter(
+            Appointment.status == AppointmentStatus.COMPLETADA
+        ).label('appointments_completadas'),
+        func.count().filter(
+            Appointment.start_datetime >= today_start,
+            Appointment.start_datetime < tomorrow_start,
+            Appointment.status == AppointmentStatus.PROGRAMADA
+        ).label('appointments_hoy')
+    ).select_from(Appointment).where(Appointment.clinic_id == clinic_id))
     
-    stats['appointments_hoy'] = Appointment.query.filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= today_start,
-        Appointment.start_datetime <= today_end,
-        Appointment.status == AppointmentStatus.PROGRAMADA
-    ).count()
+    stats = dict(db.session.execute(stmt).one()._mapping)
     
     # Obtener profesionales con sus estadísticas
     professionals = db.session.query(
@@ -142,32 +195,30 @@ def get_professionals():
     if not clinic_id:
         return jsonify({'error': 'clinic_id requerido'}), 400
     
-    professionals = User.query.filter_by(
+    professionals = User.query.options(load_only(*_PROFESSIONAL_LOAD)).filter_by(
         clinic_id=clinic_id,
         role=UserRole.PROFESSIONAL
     ).order_by(User.full_name).all()
     
+    # Citas por profesional y estado en un solo GROUP BY (no tres COUNT por profesional)
+    counts = {}
+    for prof_id, status, total in db.session.query(
+        Appointment.professional_id, Appointment.status, func.count()
+    ).filter(
+        Appointment.clinic_id == clinic_id
+    ).group_by(Appointment.professional_id, Appointment.status):
+        counts.setdefault(prof_id, {})[status] = total
+    
     # Agregar estadísticas a cada profesional
     professionals_data = []
     for prof in professionals:
-        data = prof.to_dict(include_sensitive=True)
-        
-        # Citas totales
-        data['appointments_total'] = Appointment.query.filter_by(
-            professional_id=prof.id
-        ).count()
+        prof_counts = counts.get(prof.id, {})
+        total = sum(prof_counts.values())
+        data = prof.to_dict(include_sensitive=True, appointments_count=total)
         
-        # Citas programadas
-        data['appointments_programadas'] = Appointment.query.filter_by(
-            professional_id=prof.id,
-            status=AppointmentStatus.PROGRAMADA
-        ).count()
-        
-        # Citas completadas
-        data['appointments_completadas'] = Appointment.query.filter_by(
-            professional_id=prof.id,
-            status=AppointmentStatus.COMPLETADA
-        ).count()
+        data['appointments_total'] = total
+        data['appointments_programadas'] = prof_counts.get(AppointmentStatus.PROGRAMADA, 0)
+        data['appointments_completadas'] = prof_counts.get(AppointmentStatus.COMPLETADA, 0)
         
         professionals_data.append(data)
     
@@ -177,52 +228,44 @@ def get_professionals():
 @clinic_admin_bp.route('/api/professionals/<int:id>', methods=['GET'])
 @login_required
 @clinic_admin_required
+@professional_of_clinic_required
 def get_professional(id):
     """GET: Obtiene detalles de un profesional específico"""
-    professional = User.query.get_or_404(id)
-    
-    clinic_id = get_clinic_id()
-    
-    # Verificar que el profesional pertenece a la clínica
-    if professional.clinic_id != clinic_id:
-        return jsonify({'error': 'Profesional no encontrado en esta clínica'}), 404
-    
-    if professional.role != UserRole.PROFESSIONAL:
-        return jsonify({'error': 'El usuario no es un profesional'}), 400
-    
-    data = professional.to_dict(include_sensitive=True)
+    professional = g.professional
+    
+    # Estadísticas detalladas: conteos por estado y pacientes atendidos en un solo
+    # SELECT con count(*) FILTER (WHERE ...), no una consulta por tarjeta
+    row = db.session.query(
+        func.count().label('total'),
+        *[
+            func.count().filter(Appointment.status == status).label(status.name.lower())
+            for status in AppointmentStatus
+        ],
+        func.count(func.distinct(Appointment.patient_id)).filter(
+            Appointment.status == AppointmentStatus.COMPLETADA
+        ).label('patients_attended')
+    ).filter(Appointment.professional_id == id).one()
     
-    # Estadísticas detalladas
+    # El total ya está en la fila: to_dict no carga todas las citas para contarlas
+    data = professional.to_dict(include_sensitive=True, appointments_count=row.total)
     data['statistics'] = {
         'appointments': {
-            'total': Appointment.query.filter_by(professional_id=id).count(),
-            'programadas': Appointment.query.filter_by(
-                professional_id=id,
-                status=AppointmentStatus.PROGRAMADA
-            ).count(),
-            'completadas': Appointment.query.filter_by(
-                professional_id=id,
-                status=AppointmentStatus.COMPLETADA
-            ).count(),
-            'canceladas': Appointment.query.filter_by(
-                professional_id=id,
-                status=AppointmentStatus.CANCELADA
-            ).count(),
-            'no_asistio': Appointment.query.filter_by(
-                professional_id=id,
-                status=AppointmentStatus.NO_ASISTIO
-            ).count()
+            'total': row.total,
+            'programadas': row.programada,
+            'completadas': row.completada,
+            'canceladas': row.cancelada,
+            'no_asistio': row.no_asistio
         },
-        'patients_attended': db.session.query(
-            func.count(func.distinct(Appointment.patient_id))
-        ).filter(
-            Appointment.professional_id == id,
-            Appointment.status == AppointmentStatus.COMPLETADA
-        ).scalar() or 0
+        'patients_attended': row.patients_attended or 0
     }
     
-    # Últimas 10 citas
-    recent_appointments = Appointment.query.filter_by(
+    # Últimas 10 citas: paciente y servicio en la misma consulta; el profesional ya
+    # está en la sesión (lazyload lo toma del identity map sin otra consulta)
+    recent_appointments = Appointment.query.options(
+        joinedload(Appointment.patient).load_only(Patient.id, Patient.name, Patient.phone),
+        joinedload(Appointment.service).load_only(Service.id, Service.name),
+        lazyload(Appointment.professional)
+    ).filter_by(
         professional_id=id
     ).order_by(Appointment.start_datetime.desc()).limit(10).all()
     
@@ -249,14 +292,13 @@ def create_professional():
         if not data.get(field):
             return jsonify({'error': f'Campo requerido: {field}'}), 400
     
-    # Verificar que el username no exista
-    existing_user = User.query.filter_by(username=data['username']).first()
-    if existing_user:
+    # Verificar que username y email no existan (una consulta, solo esas dos columnas)
+    conflicts = db.session.query(User.username, User.email).filter(
+        or_(User.username == data['username'], User.email == data['email'])
+    ).all()
+    if any(username == data['username'] for username, _ in conflicts):
         return jsonify({'error': f'El username "{data["username"]}" ya está en uso'}), 400
-    
-    # Verificar que el email no exista
-    existing_email = User.query.filter_by(email=data['email']).first()
-    if existing_email:
+    if conflicts:
         return jsonify({'error': f'El email "{data["email"]}" ya está en uso'}), 400
     
     try:
@@ -273,15 +315,14 @@ def create_professional():
         professional.set_password(data['password'])
         
         db.session.add(professional)
-        db.session.commit()
+        db.session.flush()
         
-        # Crear notificación de bienvenida
-        notification = Notification(
-            user_id=professional.id,
-            message=f'¡Bienvenido a {Clinic.query.get(clinic_id).name}! Tu cuenta ha sido creada exitosamente.',
-            type='success'
-        )
-        db.session.add(notification)
+        # Crear notificación de bienvenida (mismo commit que el profesional)
+        Notification.bulk_notify([{
+            'user_id': professional.id,
+            'message': f'¡Bienvenido a {get_current_clinic().name}! Tu cuenta ha sido creada exitosamente.',
+            'type': 'success'
+        }])
         db.session.commit()
         
         return jsonify({
@@ -301,18 +342,10 @@ def create_professional():
 @clinic_admin_bp.route('/api/professionals/<int:id>', methods=['PUT'])
 @login_required
 @clinic_admin_required
+@professional_of_clinic_required
 def update_professional(id):
     """PUT: Actualiza información de un profesional"""
-    professional = User.query.get_or_404(id)
-    
-    clinic_id = get_clinic_id()
-    
-    # Verificar que pertenece a la clínica
-    if professional.clinic_id != clinic_id:
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if professional.role != UserRole.PROFESSIONAL:
-        return jsonify({'error': 'El usuario no es un profesional'}), 400
+    professional = g.professional
     
     data = request.get_json()
     
@@ -350,32 +383,22 @@ def update_professional(id):
 @clinic_admin_bp.route('/api/professionals/<int:id>/toggle-status', methods=['POST'])
 @login_required
 @clinic_admin_required
+@professional_of_clinic_required
 def toggle_professional_status(id):
     """POST: Activa/desactiva un profesional"""
-    professional = User.query.get_or_404(id)
-    
-    clinic_id = get_clinic_id()
-    
-    # Verificar que pertenece a la clínica
-    if professional.clinic_id != clinic_id:
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if professional.role != UserRole.PROFESSIONAL:
-        return jsonify({'error': 'El usuario no es un profesional'}), 400
+    professional = g.professional
     
     try:
         professional.is_active = not professional.is_active
-        db.session.commit()
         
         status = 'activado' if professional.is_active else 'desactivado'
         
-        # Crear notificación
-        notification = Notification(
-            user_id=professional.id,
-            message=f'Tu cuenta ha sido {status} por el administrador.',
-            type='warning' if not professional.is_active else 'success'
-        )
-        db.session.add(notification)
+        # Crear notificación (mismo commit que el cambio de estado)
+        Notification.bulk_notify([{
+            'user_id': professional.id,
+            'message': f'Tu cuenta ha sido {status} por el administrador.',
+            'type': 'warning' if not professional.is_active else 'success'
+        }])
         db.session.commit()
         
         return jsonify({
@@ -391,40 +414,28 @@ def toggle_professional_status(id):
 @clinic_admin_bp.route('/api/professionals/<int:id>/reset-password', methods=['POST'])
 @login_required
 @clinic_admin_required
+@professional_of_clinic_required
 def reset_professional_password(id):
     """POST: Resetea la contraseña de un profesional"""
-    professional = User.query.get_or_404(id)
-    
-    clinic_id = get_clinic_id()
-    
-    # Verificar que pertenece a la clínica
-    if professional.clinic_id != clinic_id:
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if professional.role != UserRole.PROFESSIONAL:
-        return jsonify({'error': 'El usuario no es un profesional'}), 400
+    professional = g.professional
     
     data = request.get_json() or {}
     new_password = data.get('new_password')
     
     # Si no se proporciona, generar una temporal
     if not new_password:
-        import secrets
-        import string
-        alphabet = string.ascii_letters + string.digits
-        new_password = ''.join(secrets.choice(alphabet) for i in range(12))
+        # 9 bytes aleatorios en base64 URL-safe: 12 caracteres [A-Za-z0-9_-]
+        new_password = secrets.token_urlsafe(9)
     
     try:
         professional.set_password(new_password)
-        db.session.commit()
         
-        # Crear notificación
-        notification = Notification(
-            user_id=professional.id,
-            message='Tu contraseña ha sido reseteada. Por favor cámbiala en tu próximo inicio de sesión.',
-            type='warning'
-        )
-        db.session.add(notification)
+        # Crear notificación (mismo commit que la nueva contraseña)
+        Notification.bulk_notify([{
+            'user_id': professional.id,
+            'message': 'Tu contraseña ha sido reseteada. Por favor cámbiala en tu próximo inicio de sesión.',
+            'type': 'warning'
+        }])
         db.session.commit()
         
         return jsonify({
@@ -442,21 +453,13 @@ def reset_professional_password(id):
 @clinic_admin_bp.route('/api/professionals/<int:id>', methods=['DELETE'])
 @login_required
 @clinic_admin_required
+@professional_of_clinic_required
 def delete_professional(id):
     """
     DELETE: Elimina permanentemente un profesional.
     ADVERTENCIA: También eliminará todas sus citas asociadas.
     """
-    professional = User.query.get_or_404(id)
-    
-    clinic_id = get_clinic_id()
-    
-    # Verificar que pertenece a la clínica
-    if professional.clinic_id != clinic_id:
-        return jsonify({'error': 'No autorizado'}), 403
-    
-    if professional.role != UserRole.PROFESSIONAL:
-        return jsonify({'error': 'El usuario no es un profesional'}), 400
+    professional = g.professional
     
     # Contar citas asociadas
     appointments_count = Appointment.query.filter_by(professional_id=id).count()
@@ -493,15 +496,33 @@ def get_services():
     
     # Filtrar por estado si se especifica
     is_active = request.args.get('is_active')
-    
-    query = Service.query.filter_by(clinic_id=clinic_id)
-    
     if is_active is not None:
-        query = query.filter_by(is_active=is_active.lower() == 'true')
-    
-    services = query.order_by(Service.name).all()
-    
-    return jsonify([service.to_dict() for service in services])
+        is_active = is_active.lower() == 'true'
+    
+    # Catálogo casi estático: cacheado por clínica y filtro (mismas claves que /api/services,
+    # cualquier cambio confirmado en servicios renueva la versión de la clínica)
+    def build():
+        # Solo las columnas de to_dict(), sin instancias ORM
+        stmt = select(
+            Service.id, Service.clinic_id, Service.name, Service.description,
+            Service.duration_minutes, Service.price, Service.is_active, Service.created_at
+        ).where(Service.clinic_id == clinic_id)
+        
+        if is_active is not None:
+            stmt = stmt.where(Service.is_active == is_active)
+        
+        services = []
+        for row in db.session.execute(stmt.order_by(Service.name)).mappings():
+            service = dict(row)
+            service['price'] = float(service['price']) if service['price'] else None
+            services.append(service)
+        return services
+    
+    services = cached(
+        clinic_cache_key('services', clinic_id, 'all' if is_active is None else is_active), build,
+        timeout=current_app.config['SERVICES_CACHE_TIMEOUT']
+    )
+    return jsonify(services)
 
 
 @clinic_admin_bp.route('/api/services', methods=['POST'])
@@ -627,7 +648,7 @@ def get_clinic_settings():
     if not clinic_id:
         return jsonify({'error': 'clinic_id requerido'}), 400
     
-    clinic = Clinic.query.get_or_404(clinic_id)
+    clinic = get_current_clinic() or abort(404)
     
     return jsonify(clinic.to_dict())
 
@@ -642,7 +663,7 @@ def update_clinic_settings():
     if not clinic_id:
         return jsonify({'error': 'clinic_id requerido'}), 400
     
-    clinic = Clinic.query.get_or_404(clinic_id)
+    clinic = get_current_clinic() or abort(404)
     data = request.get_json()
     
     try:
@@ -679,6 +700,45 @@ def update_clinic_settings():
 # ============================================================================
 # API: REPORTES DE LA CLÍNICA
 # ============================================================================
+# Contadores por estado e ingresos estimados (solo completadas con servicio) en un
+# solo SELECT con count/sum FILTER sobre el LEFT JOIN a servicio. Construido una vez
+# con parámetros: cada request solo enlaza valores (el SQL compilado sale del cache)
+_CLINIC_REPORT_SUMMARY = select(
+    func.count(Appointment.id).label('total'),
+    *[
+        func.count(Appointment.id).filter(Appointment.status == status).label(status.name.lower())
+        for status in AppointmentStatus
+    ],
+    func.sum(Service.price).filter(
+        Appointment.status == AppointmentStatus.COMPLETADA
+    ).label('ingresos')
+).select_from(Appointment).outerjoin(
+    Service, Appointment.service_id == Service.id
+).where(
+    Appointment.clinic_id == bindparam('clinic_id'),
+    Appointment.start_datetime >= bindparam('start'),
+    Appointment.start_datetime <= bindparam('end')
+)
+
+
+def _cached_report(name, clinic_id, start_str, end_str, end_date, compute):
+    """
+    Reporte cacheado por clínica y rango de fechas.
+    La versión de la clínica lo invalida ante cualquier cambio confirmado; un rango
+    ya cerrado (antes de hoy) no cambia y puede vivir mucho más.
+    
+    Args:
+        name (str): Nombre del reporte (prefijo de la clave)
+        end_date (datetime): Fin del rango, para elegir el TTL
+        compute (callable): Calcula el reporte (dict) si no está en cache
+    """
+    closed = end_date.date() < get_peru_time().date()
+    timeout = current_app.config[
+        'REPORT_HISTORY_CACHE_TIMEOUT' if closed else 'REPORT_CACHE_TIMEOUT'
+    ]
+    return cached(clinic_cache_key(name, clinic_id, start_str, end_str), compute, timeout=timeout)
+
+
 @clinic_admin_bp.route('/api/reports/summary', methods=['GET'])
 @login_required
 @clinic_admin_required
@@ -706,85 +766,75 @@ def get_clinic_report():
     except ValueError:
         return jsonify({'error': 'Formato de fecha inválido. Usa YYYY-MM-DD'}), 400
     
-    # Base query
-    query = Appointment.query.filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    )
-    
-    # Contadores por estado
-    total = query.count()
-    programadas = query.filter_by(status=AppointmentStatus.PROGRAMADA).count()
-    completadas = query.filter_by(status=AppointmentStatus.COMPLETADA).count()
-    canceladas = query.filter_by(status=AppointmentStatus.CANCELADA).count()
-    no_asistio = query.filter_by(status=AppointmentStatus.NO_ASISTIO).count()
-    
-    # Ingresos estimados (solo citas completadas con servicio)
-    ingresos = db.session.query(func.sum(Service.price)).join(
-        Appointment, Appointment.service_id == Service.id
-    ).filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.status == AppointmentStatus.COMPLETADA,
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    ).scalar() or 0
-    
-    # Citas por profesional
-    by_professional = db.session.query(
-        User.full_name,
-        User.username,
-        func.count(Appointment.id).label('count')
-    ).join(
-        Appointment, Appointment.professional_id == User.id
-    ).filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    ).group_by(User.id).all()
-    
-    # Citas por servicio
-    by_service = db.session.query(
-        Service.name,
-        func.count(Appointment.id).label('count')
-    ).join(
-        Appointment, Appointment.service_id == Service.id
-    ).filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= start_date,
-        Appointment.start_datetime <= end_date
-    ).group_by(Service.id).all()
+    # Cache por clínica y rango (invalidado por la versión de la clínica)
+    def build():
+        summary = db.session.execute(_CLINIC_REPORT_SUMMARY, {
+            'clinic_id': clinic_id,
+            'start': start_date,
+            'end': end_date
+        }).one()
+        
+        total = summary.total
+        completadas = summary.completada
+        canceladas = summary.cancelada
+        
+        # Citas por profesional
+        by_professional = db.session.query(
+            User.full_name,
+            User.username,
+            func.count(Appointment.id).label('count')
+        ).join(
+            Appointment, Appointment.professional_id == User.id
+        ).filter(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= start_date,
+            Appointment.start_datetime <= end_date
+        ).group_by(User.id).all()
+        
+        # Citas por servicio
+        by_service = db.session.query(
+            Service.name,
+            func.count(Appointment.id).label('count')
+        ).join(
+            Appointment, Appointment.service_id == Service.id
+        ).filter(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= start_date,
+            Appointment.start_datetime <= end_date
+        ).group_by(Service.id).all()
+        
+        return {
+            'period': {
+                'start': start_str,
+                'end': end_str
+            },
+            'summary': {
+                'total': total,
+                'programadas': summary.programada,
+                'completadas': completadas,
+                'canceladas': canceladas,
+                'no_asistio': summary.no_asistio,
+                'tasa_completadas': round((completadas / total * 100) if total > 0 else 0, 2),
+                'tasa_canceladas': round((canceladas / total * 100) if total > 0 else 0, 2)
+            },
+            'ingresos_estimados': float(summary.ingresos or 0),
+            'by_professional': [
+                {
+                    'name': prof[0] or prof[1],
+                    'appointments': prof[2]
+                }
+                for prof in by_professional
+            ],
+            'by_service': [
+                {
+                    'name': service[0],
+                    'appointments': service[1]
+                }
+                for service in by_service
+            ]
+        }
     
-    return jsonify({
-        'period': {
-            'start': start_str,
-            'end': end_str
-        },
-        'summary': {
-            'total': total,
-            'programadas': programadas,
-            'completadas': completadas,
-            'canceladas': canceladas,
-            'no_asistio': no_asistio,
-            'tasa_completadas': round((completadas / total * 100) if total > 0 else 0, 2),
-            'tasa_canceladas': round((canceladas / total * 100) if total > 0 else 0, 2)
-        },
-        'ingresos_estimados': float(ingresos),
-        'by_professional': [
-            {
-                'name': prof[0] or prof[1],
-                'appointments': prof[2]
-            }
-            for prof in by_professional
-        ],
-        'by_service': [
-            {
-                'name': service[0],
-                'appointments': service[1]
-            }
-            for service in by_service
-        ]
-    })
+    return jsonify(_cached_report('clinic_report', clinic_id, start_str, end_str, end_date, build))
 
 
 @clinic_admin_bp.route('/api/reports/professionals-performance', methods=['GET'])
@@ -816,74 +866,77 @@ def get_professionals_performance():
         except ValueError:
             return jsonify({'error': 'Formato de fecha inválido. Usa YYYY-MM-DD'}), 400
     
-    # Obtener todos los profesionales de la clínica
-    professionals = User.query.filter_by(
-        clinic_id=clinic_id,
-        role=UserRole.PROFESSIONAL
-    ).all()
-    
-    performance_data = []
-    
-    for prof in professionals:
-        # Citas en el período
-        appointments = Appointment.query.filter(
-            Appointment.professional_id == prof.id,
-            Appointment.start_datetime >= start_date,
-            Appointment.start_datetime <= end_date
-        ).all()
+    # Cache por clínica y rango (sin fechas: últimos 30 días, TTL corto)
+    def build():
+        # Un solo SELECT agrupado por profesional: conteos por estado, pacientes únicos e
+        # ingresos con FILTER sobre el LEFT JOIN (profesionales sin citas quedan en cero)
+        completada = Appointment.status == AppointmentStatus.COMPLETADA
+        rows = db.session.query(
+            User.id,
+            User.full_name,
+            User.username,
+            User.email,
+            User.is_active,
+            func.count(Appointment.id).label('total'),
+            func.count(Appointment.id).filter(completada).label('completadas'),
+            func.count(Appointment.id).filter(
+                Appointment.status == AppointmentStatus.CANCELADA
+            ).label('canceladas'),
+            func.count(Appointment.id).filter(
+                Appointment.status == AppointmentStatus.NO_ASISTIO
+            ).label('no_asistio'),
+            func.count(func.distinct(Appointment.patient_id)).filter(completada).label('pacientes'),
+            func.sum(Service.price).filter(completada).label('ingresos')
+        ).select_from(User).outerjoin(
+            Appointment,
+            and_(
+                Appointment.professional_id == User.id,
+                Appointment.start_datetime >= start_date,
+                Appointment.start_datetime <= end_date
+            )
+        ).outerjoin(
+            Service, Service.id == Appointment.service_id
+        ).filter(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.PROFESSIONAL
+        ).group_by(User.id).order_by(User.id).all()
         
-        total = len(appointments)
-        completadas = sum(1 for apt in appointments if apt.status == AppointmentStatus.COMPLETADA)
-        canceladas = sum(1 for apt in appointments if apt.status == AppointmentStatus.CANCELADA)
-        no_asistio = sum(1 for apt in appointments if apt.status == AppointmentStatus.NO_ASISTIO)
+        performance_data = []
         
-        # Pacientes únicos atendidos
-        pacientes_atendidos = db.session.query(
-            func.count(func.distinct(Appointment.patient_id))
-        ).filter(
-            Appointment.professional_id == prof.id,
-            Appointment.status == AppointmentStatus.COMPLETADA,
-            Appointment.start_datetime >= start_date,
-            Appointment.start_datetime <= end_date
-        ).scalar() or 0
+        for row in rows:
+            total = row.total
+            completadas = row.completadas
+            canceladas = row.canceladas
         
-        # Ingresos generados
-        ingresos = db.session.query(func.sum(Service.price)).join(
-            Appointment, Appointment.service_id == Service.id
-        ).filter(
-            Appointment.professional_id == prof.id,
-            Appointment.status == AppointmentStatus.COMPLETADA,
-            Appointment.start_datetime >= start_date,
-            Appointment.start_datetime <= end_date
-        ).scalar() or 0
+            performance_data.append({
+                'professional_id': row.id,
+                'name': row.full_name or row.username,
+                'email': row.email,
+                'is_active': row.is_active,
+                'appointments': {
+                    'total': total,
+                    'completadas': completadas,
+                    'canceladas': canceladas,
+                    'no_asistio': row.no_asistio,
+                    'tasa_completadas': round((completadas / total * 100) if total > 0 else 0, 2),
+                    'tasa_canceladas': round((canceladas / total * 100) if total > 0 else 0, 2)
+                },
+                'pacientes_atendidos': row.pacientes,
+                'ingresos_generados': float(row.ingresos or 0)
+            })
         
-        performance_data.append({
-            'professional_id': prof.id,
-            'name': prof.full_name or prof.username,
-            'email': prof.email,
-            'is_active': prof.is_active,
-            'appointments': {
-                'total': total,
-                'completadas': completadas,
-                'canceladas': canceladas,
-                'no_asistio': no_asistio,
-                'tasa_completadas': round((completadas / total * 100) if total > 0 else 0, 2),
-                'tasa_canceladas': round((canceladas / total * 100) if total > 0 else 0, 2)
+        # Ordenar por citas completadas (descendente)
+        performance_data.sort(key=lambda x: x['appointments']['completadas'], reverse=True)
+        
+        return {
+            'period': {
+                'start': start_date.strftime('%Y-%m-%d'),
+                'end': end_date.strftime('%Y-%m-%d')
             },
-            'pacientes_atendidos': pacientes_atendidos,
-            'ingresos_generados': float(ingresos)
-        })
-    
-    # Ordenar por citas completadas (descendente)
-    performance_data.sort(key=lambda x: x['appointments']['completadas'], reverse=True)
+            'professionals': performance_data
+        }
     
-    return jsonify({
-        'period': {
-            'start': start_date.strftime('%Y-%m-%d'),
-            'end': end_date.strftime('%Y-%m-%d')
-        },
-        'professionals': performance_data
-    })
+    return jsonify(_cached_report('professionals_performance', clinic_id, start_str, end_str, end_date, build))
 
 
 # ============================================================================
@@ -905,8 +958,26 @@ def get_all_clinic_appointments():
     if not clinic_id:
         return jsonify({'error': 'clinic_id requerido'}), 400
     
-    # Base query
-    query = Appointment.query.filter_by(clinic_id=clinic_id)
+    # Solo las columnas del evento como tuplas (sin instancias ORM ni cargas de relaciones)
+    stmt = select(
+        Appointment.id,
+        Appointment.patient_id,
+        Appointment.start_datetime,
+        Appointment.end_datetime,
+        Appointment.status,
+        Appointment.notes,
+        Patient.name,
+        Patient.phone,
+        Service.name,
+        User.full_name,
+        User.username
+    ).select_from(Appointment).outerjoin(
+        Patient, Patient.id == Appointment.patient_id
+    ).outerjoin(
+        Service, Service.id == Appointment.service_id
+    ).outerjoin(
+        User, User.id == Appointment.professional_id
+    ).where(Appointment.clinic_id == clinic_id)
     
     # Filtrar por rango de fechas
     start_str = request.args.get('start')
@@ -914,14 +985,11 @@ def get_all_clinic_appointments():
     
     if start_str and end_str:
         try:
-            from project.api_routes import parse_datetime
             start_dt = parse_datetime(start_str)
             end_dt = parse_datetime(end_str)
-            query = query.filter(
-                and_(
-                    Appointment.start_datetime >= start_dt,
-                    Appointment.end_datetime <= end_dt
-                )
+            stmt = stmt.where(
+                Appointment.start_datetime >= start_dt,
+                Appointment.end_datetime <= end_dt
             )
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
@@ -929,22 +997,49 @@ def get_all_clinic_appointments():
     # Filtrar por profesional (opcional)
     professional_id = request.args.get('professional_id', type=int)
     if professional_id:
-        query = query.filter_by(professional_id=professional_id)
+        stmt = stmt.where(Appointment.professional_id == professional_id)
     
     # Excluir canceladas por defecto
     include_cancelled = request.args.get('include_cancelled', 'false').lower() == 'true'
     if not include_cancelled:
-        query = query.filter(
-            Appointment.status.in_([
-                AppointmentStatus.PROGRAMADA,
-                AppointmentStatus.COMPLETADA
-            ])
-        )
+        stmt = stmt.where(Appointment.status.in_(ACTIVE_STATUSES))
+    
+    stmt = stmt.order_by(Appointment.start_datetime)
     
-    appointments = query.order_by(Appointment.start_datetime).all()
+    # Formato FullCalendar (mismo contenido que Appointment.to_fullcalendar_event).
+    # Streaming: filas por lotes del cursor (yield_per) directo a JSON, sin .all()
+    def generate():
+        now = get_peru_time()
+        rows = db.session.execute(stmt, execution_options={'yield_per': 500})
+        yield from stream_json_array(_calendar_event(row, now) for row in rows)
     
-    # Formato FullCalendar
-    return jsonify([apt.to_fullcalendar_event() for apt in appointments])
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def _calendar_event(row, now):
+    """Evento de FullCalendar a partir de una fila de get_all_clinic_appointments"""
+    (apt_id, patient_id, start_dt, end_dt, status, notes, patient_name, patient_phone,
+     service_name, professional_name, professional_username) = row
+    color = STATUS_COLORS.get(status, DEFAULT_STATUS_COLOR)
+    return {
+        'id': apt_id,
+        'title': patient_name or 'Paciente desconocido',
+        'start': start_dt,
+        'end': end_dt,
+        'backgroundColor': color,
+        'borderColor': color,
+        'extendedProps': {
+            'patient_id': patient_id,
+            'patient_name': patient_name,
+            'patient_phone': patient_phone,
+            'service': service_name,
+            'professional': professional_name or professional_username,
+            'status': status.value,
+            'notes': notes or '',
+            'can_complete': status == AppointmentStatus.PROGRAMADA and end_dt <= now,
+            'can_cancel': status == AppointmentStatus.PROGRAMADA
+        }
+    }
 
 
 # ============================================================================
@@ -960,86 +1055,104 @@ def get_dashboard_stats():
     if not clinic_id:
         return jsonify({'error': 'clinic_id requerido'}), 400
     
-    # Estadísticas generales
+    # Cacheado con la versión de la clínica: cualquier cambio confirmado en citas,
+    # pacientes, usuarios o servicios lo invalida. La fecha entra en la clave:
+    # 'hoy', 'semana' e ingresos del mes cambian con el día
+    today = get_peru_time().date()
+    stats = cached(
+        clinic_cache_key('dashboard_stats', clinic_id, today),
+        lambda: _compute_dashboard_stats(clinic_id, today),
+        timeout=current_app.config['STATS_CACHE_TIMEOUT']
+    )
+    return jsonify(stats)
+
+
+def _compute_dashboard_stats(clinic_id, today):
+    """Estadísticas del dashboard de la clínica (dict) para la fecha dada"""
+    # Citas de hoy y de esta semana (lunes a domingo), en rangos semiabiertos.
+    # Todos los límites salen de la fecha de Perú recibida
+    today_start = datetime.combine(today, datetime.min.time())
+    week_start = today_start - timedelta(days=today.weekday())  # Lunes
+    
+    tomorrow_start = today_start + timedelta(days=1)
+    next_week_start = week_start + timedelta(days=7)
+    
+    # Ingresos del mes
+    month_start = today_start.replace(day=1)
+    
+    # Todo en un solo SELECT: conteos y totales de citas con agregados condicionales
+    # (FILTER / CASE) y subconsultas escalares para profesionales, pacientes y servicios.
+    # lambda_stmt: compilado una vez por proceso (clinic_id explícito en cada subconsulta)
+    stmt = lambda_stmt(lambda: select(
+        select(func.count(User.id)).where(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.PROFESSIONAL
+        ).scalar_subquery().label('professionals_total'),
+        select(func.count(User.id)).where(
+            User.clinic_id == clinic_id,
+            User.role == UserRole.PROFESSIONAL,
+            User.is_active == True
+        ).scalar_subquery().label('professionals_active'),
+        select(func.count(Patient.id)).where(
+            Patient.clinic_id == clinic_id
+        ).scalar_subquery().label('patients_total'),
+        # correlate(None): la consulta externa también tiene service (JOIN para ingresos)
+        select(func.count(Service.id)).where(
+            Service.clinic_id == clinic_id
+        ).correlate(None).scalar_subquery().label('services_total'),
+        select(func.count(Service.id)).where(
+            Service.clinic_id == clinic_id,
+            Service.is_active == True
+        ).correlate(None).scalar_subquery().label('services_active'),
+        func.count().filter(Appointment.status == AppointmentStatus.PROGRAMADA).label('programadas'),
+        func.count().filter(Appointment.status == AppointmentStatus.COMPLETADA).label('completadas'),
+        func.count().filter(Appointment.status == AppointmentStatus.CANCELADA).label('canceladas'),
+        func.count().filter(
+            Appointment.start_datetime >= today_start,
+            Appointment.start_datetime < tomorrow_start,
+            Appointment.status == AppointmentStatus.PROGRAMADA
+        ).label('hoy'),
+        func.count().filter(
+            Appointment.start_datetime >= week_start,
+            Appointment.start_datetime < next_week_start,
+            Appointment.status.in_(ACTIVE_STATUSES)
+        ).label('semana'),
+        func.sum(case((
+            and_(
+                Appointment.status == AppointmentStatus.COMPLETADA,
+                Appointment.start_datetime >= month_start
+            ),
+            Service.price
+        ))).label('ingresos_mes')
+    ).select_from(Appointment).outerjoin(
+        Service, Appointment.service_id == Service.id
+    ).where(Appointment.clinic_id == clinic_id))
+    
+    row = db.session.execute(stmt).one()
+    
     stats = {
         'professionals': {
-            'total': User.query.filter_by(
-                clinic_id=clinic_id,
-                role=UserRole.PROFESSIONAL
-            ).count(),
-            'active': User.query.filter_by(
-                clinic_id=clinic_id,
-                role=UserRole.PROFESSIONAL,
-                is_active=True
-            ).count()
+            'total': row.professionals_total,
+            'active': row.professionals_active
         },
         'patients': {
-            'total': Patient.query.filter_by(clinic_id=clinic_id).count()
+            'total': row.patients_total
         },
         'services': {
-            'total': Service.query.filter_by(clinic_id=clinic_id).count(),
-            'active': Service.query.filter_by(
-                clinic_id=clinic_id,
-                is_active=True
-            ).count()
+            'total': row.services_total,
+            'active': row.services_active
         },
         'appointments': {
-            'programadas': Appointment.query.filter_by(
-                clinic_id=clinic_id,
-                status=AppointmentStatus.PROGRAMADA
-            ).count(),
-            'completadas': Appointment.query.filter_by(
-                clinic_id=clinic_id,
-                status=AppointmentStatus.COMPLETADA
-            ).count(),
-            'canceladas': Appointment.query.filter_by(
-                clinic_id=clinic_id,
-                status=AppointmentStatus.CANCELADA
-            ).count()
-        }
+            'programadas': row.programadas,
+            'completadas': row.completadas,
+            'canceladas': row.canceladas,
+            'hoy': row.hoy,
+            'semana': row.semana
+        },
+        'ingresos_mes': float(row.ingresos_mes or 0)
     }
     
-    # Citas de hoy
-    today_start = datetime.combine(datetime.now().date(), datetime.min.time())
-    today_end = datetime.combine(datetime.now().date(), datetime.max.time())
-    
-    stats['appointments']['hoy'] = Appointment.query.filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= today_start,
-        Appointment.start_datetime <= today_end,
-        Appointment.status == AppointmentStatus.PROGRAMADA
-    ).count()
-    
-    # Citas de esta semana
-    from datetime import date
-    today = date.today()
-    start_week = today - timedelta(days=today.weekday())  # Lunes
-    end_week = start_week + timedelta(days=6)  # Domingo
-    
-    week_start = datetime.combine(start_week, datetime.min.time())
-    week_end = datetime.combine(end_week, datetime.max.time())
-    
-    stats['appointments']['semana'] = Appointment.query.filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.start_datetime >= week_start,
-        Appointment.start_datetime <= week_end,
-        Appointment.status.in_([AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA])
-    ).count()
-    
-    # Ingresos del mes
-    month_start = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    
-    stats['ingresos_mes'] = float(db.session.query(
-        func.sum(Service.price)
-    ).join(
-        Appointment, Appointment.service_id == Service.id
-    ).filter(
-        Appointment.clinic_id == clinic_id,
-        Appointment.status == AppointmentStatus.COMPLETADA,
-        Appointment.start_datetime >= month_start
-    ).scalar() or 0)
-    
-    return jsonify(stats)
+    return stats
 
 
 # ============================================================================
@@ -1061,8 +1174,13 @@ def get_recent_activity():
     
     limit = request.args.get('limit', 20, type=int)
     
-    # Últimas citas creadas
-    recent_appointments = Appointment.query.filter_by(
+    # Últimas citas creadas: paciente y profesional en la misma consulta (JOIN) en lugar
+    # de una selectin por relación; el servicio no se usa aquí
+    recent_appointments = Appointment.query.options(
+        joinedload(Appointment.patient).load_only(Patient.id, Patient.name),
+        joinedload(Appointment.professional).load_only(User.id, User.full_name, User.username),
+        lazyload(Appointment.service)
+    ).filter_by(
         clinic_id=clinic_id
     ).order_by(Appointment.created_at.desc()).limit(limit).all()
     
@@ -1082,10 +1200,8 @@ def get_recent_activity():
             }
         })
     
-    # Ordenar por timestamp
-    activity.sort(key=lambda x: x['timestamp'], reverse=True)
-    
-    return jsonify(activity[:limit])
+    # El ORDER BY created_at DESC y el LIMIT ya dan el orden y el tamaño
+    return jsonify(activity)
 
 
 # ============================================================================
@@ -1116,15 +1232,26 @@ def quick_search():
         'appointments': []
     }
     
+    # Un solo LIKE sobre search_text (minúsculas) en pacientes y profesionales:
+    # en PostgreSQL lo resuelve el índice trigram GIN en lugar de un scan por columna
+    search_pattern = f'%{query_term.lower()}%'
+    
     # Buscar pacientes
-    patients = Patient.query.filter(
-        Patient.clinic_id == clinic_id,
-        or_(
-            Patient.name.ilike(f'%{query_term}%'),
-            Patient.phone.ilike(f'%{query_term}%'),
-            Patient.email.ilike(f'%{query_term}%')
-        )
-    ).limit(5).all()
+    patient_query = Patient.query.filter(
+        Patient.clinic_id == clinic_id
+    )
+    
+    if db.engine.dialect.name == 'postgresql':
+        # Palabras completas (texto completo) o subcadena para el typeahead: cada
+        # condición tiene su índice GIN; las coincidencias por palabra van primero
+        fulltext_match = Patient.fulltext_match(query_term)
+        patient_query = patient_query.filter(
+            or_(fulltext_match, Patient.search_text.like(search_pattern))
+        ).order_by(fulltext_match.desc())
+    else:
+        patient_query = patient_query.filter(Patient.search_text.like(search_pattern))
+    
+    patients = patient_query.limit(5).all()
     
     results['patients'] = [
         {
@@ -1140,11 +1267,7 @@ def quick_search():
     professionals = User.query.filter(
         User.clinic_id == clinic_id,
         User.role == UserRole.PROFESSIONAL,
-        or_(
-            User.full_name.ilike(f'%{query_term}%'),
-            User.username.ilike(f'%{query_term}%'),
-            User.email.ilike(f'%{query_term}%')
-        )
+        User.search_text.like(search_pattern)
     ).limit(5).all()
     
     results['professionals'] = [
@@ -1157,11 +1280,16 @@ def quick_search():
         for p in professionals
     ]
     
-    # Buscar citas recientes por nombre de paciente
-    appointments = Appointment.query.join(Patient).filter(
+    # Buscar citas recientes por nombre de paciente: el paciente sale del mismo JOIN
+    # del filtro (contains_eager) y el profesional de otro JOIN en la misma consulta
+    appointments = Appointment.query.join(Patient).options(
+        contains_eager(Appointment.patient).load_only(Patient.id, Patient.name),
+        joinedload(Appointment.professional).load_only(User.id, User.full_name, User.username),
+        lazyload(Appointment.service)
+    ).filter(
         Appointment.clinic_id == clinic_id,
         Patient.name.ilike(f'%{query_term}%'),
-        Appointment.status.in_([AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA])
+        Appointment.status.in_(ACTIVE_STATUSES)
     ).order_by(Appointment.start_datetime.desc()).limit(5).all()
     
     results['appointments'] = [
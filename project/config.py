@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
     """
@@ -45,6 +46,29 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False  # Cambiar a True para debug SQL
     
+    # Cache de SQL compilado del engine (por defecto 500): holgura para las
+    # consultas lambda_stmt y las combinaciones de filtros de los endpoints
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'query_cache_size': int(os.environ.get('SQLALCHEMY_QUERY_CACHE_SIZE', 1200))
+    }
+    
+    # Pool de conexiones en PostgreSQL (uno por proceso de Gunicorn): las conexiones
+    # se reutilizan entre peticiones en lugar de pagar el handshake TLS/auth en cada una.
+    # pool_size y max_overflow son por worker: total = workers * (pool_size + max_overflow)
+    # debe quedar bajo max_connections del servidor
+    # - LIFO: se reutiliza la conexión más reciente (sesión y planes preparados calientes)
+    #   y las sobrantes quedan ociosas hasta que el servidor las cierra
+    # - pre_ping: descarta conexiones cortadas por el servidor o el proxy antes de usarlas
+    # - recycle: renueva conexiones viejas antes de que las cierre un timeout externo
+    if SQLALCHEMY_DATABASE_URI.startswith('postgresql'):
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'pool_pre_ping': True,
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_use_lifo': True
+        })
+    
     # ========================================================================
     # FLASK ENVIRONMENT
     # ========================================================================
@@ -100,6 +124,41 @@ class Config:
     # ========================================================================
     CREATE_DEMO_DATA = os.environ.get('CREATE_DEMO_DATA', 'false').lower() == 'true'
     
+    # ========================================================================
+    # ESQUEMA AL ARRANCAR
+    # ========================================================================
+    # db.create_all() + índices/restricciones faltantes en cada arranque (ver ensure_indexes).
+    # En producción con el esquema ya creado se puede desactivar con 'false'
+    RUN_MIGRATIONS_ON_START = os.environ.get('RUN_MIGRATIONS_ON_START', 'true').lower() == 'true'
+    
+    # ========================================================================
+    # CACHE (Flask-Caching)
+    # ========================================================================
+    # Redis si hay REDIS_URL (compartido entre workers, requiere el paquete redis);
+    # si no, memoria del proceso
+    CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_TYPE = 'RedisCache' if CACHE_REDIS_URL else 'SimpleCache'
+    CACHE_DEFAULT_TIMEOUT = 30  # segundos
+    SEARCH_CACHE_TIMEOUT = 15  # Autocomplete de pacientes
+    STATS_CACHE_TIMEOUT = 300  # /stats por clínica (se invalida al haber cambios)
+    REPORT_CACHE_TIMEOUT = 60  # /reports/summary con rangos que incluyen hoy o el futuro
+    REPORT_HISTORY_CACHE_TIMEOUT = 86400  # /reports/summary con rangos ya cerrados
+    SERVICES_CACHE_TIMEOUT = 300  # Catálogo de servicios (se invalida al haber cambios)
+    
+    # ========================================================================
+    # EXPORTACIONES CSV
+    # ========================================================================
+    # Sobre este número de citas el CSV se genera en segundo plano (202 + URL de estado)
+    EXPORT_ASYNC_THRESHOLD = int(os.environ.get('EXPORT_ASYNC_THRESHOLD', 50000))
+    EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER') or os.path.join(tempfile.gettempdir(), 'agendanova_exports')
+    EXPORT_JOB_TIMEOUT = 3600  # segundos que se conserva el estado del trabajo
+    
+    # ========================================================================
+    # REPORTES
+    # ========================================================================
+    # Intervalo de refresco de la vista materializada de reportes (solo PostgreSQL)
+    REPORT_VIEW_REFRESH = int(os.environ.get('REPORT_VIEW_REFRESH', 300))  # segundos
+    
     # ========================================================================
     # LOGGING
     # ========================================================================
@@ -172,7 +231,15 @@ class TestingConfig(Config):
     """Configuración para tests (futuro)"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # Base de datos en memoria
+    # Sin opciones de pool: SQLite en memoria usa SingletonThreadPool
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        key: value for key, value in Config.SQLALCHEMY_ENGINE_OPTIONS.items()
+        if not key.startswith('pool_') and key != 'max_overflow'
+    }
     WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4  # Hash mínimo: los tests crean muchos usuarios
+    CACHE_TYPE = 'NullCache'  # Sin cache: cada test ve el estado real de la BD
+    CACHE_NO_NULL_WARNING = True
     DEBUG = True
 
 
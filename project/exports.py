@@ -0,0 +1,246 @@
+"""
+Exportación de citas a CSV.
+
+El CSV se genera por partes desde un cursor por lotes. Las exportaciones chicas
+se envían en la misma petición (streaming); las grandes se escriben a disco en
+un hilo aparte y el cliente consulta el estado del trabajo hasta descargarlo.
+"""
+import csv
+import gzip
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+
+from sqlalchemy import func, select
+
+from project import db, cache
+from project.caching import shared_cache_enabled
+from project.models import Appointment, Patient, Service, User
+
+# Hilos para exportaciones grandes: pocos, para no competir con las peticiones
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='csv-export')
+
+# Filas por lote (cursor del servidor y writerows)
+BATCH_SIZE = 500
+
+CSV_HEADERS = (
+    'ID',
+    'Fecha',
+    'Hora Inicio',
+    'Hora Fin',
+    'Paciente',
+    'Teléfono',
+    'Servicio',
+    'Profesional',
+    'Estado',
+    'Notas'
+)
+
+
+def count_appointments(criteria):
+    """Número de citas que exportaría el filtro"""
+    return db.session.scalar(
+        select(func.count()).select_from(Appointment).where(*criteria)
+    )
+
+
+def appointments_csv(criteria):
+    """
+    Genera el CSV de citas por partes (str).
+
+    Args:
+        criteria (list): Condiciones WHERE (incluyen siempre el clinic_id)
+    """
+    # Solo las columnas del CSV como tuplas (sin construir instancias ORM), por lotes
+    # con cursor del servidor donde el driver lo soporta: la memoria queda acotada
+    # sin importar el tamaño de la exportación
+    stmt = select(
+        Appointment.id,
+        Appointment.start_datetime,
+        Appointment.end_datetime,
+        Patient.name,
+        Patient.phone,
+        Service.name,
+        User.full_name,
+        User.username,
+        Appointment.status,
+        Appointment.notes
+    ).select_from(Appointment).outerjoin(
+        Patient, Patient.id == Appointment.patient_id
+    ).outerjoin(
+        Service, Service.id == Appointment.service_id
+    ).outerjoin(
+        User, User.id == Appointment.professional_id
+    ).where(*criteria).order_by(Appointment.start_datetime).execution_options(yield_per=BATCH_SIZE)
+
+    # Las filas se escriben por lotes (writerows) en un buffer pequeño que se vacía
+    # tras enviarlo; el primer byte sale de inmediato y la memoria no crece con el archivo
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    writer.writerow(CSV_HEADERS)
+    yield flush()
+
+    rows = []
+    for (apt_id, start_dt, end_dt, patient_name, patient_phone, service_name,
+         professional_name, professional_username, status, notes) in db.session.execute(stmt):
+        # Fecha y hora de inicio con un solo strftime (PeruDateTime ya trae la zona)
+        fecha, hora_inicio = start_dt.strftime('%Y-%m-%d %H:%M').split(' ')
+
+        # Sin fila relacionada (LEFT JOIN) las columnas llegan en None
+        rows.append((
+            apt_id,
+            fecha,
+            hora_inicio,
+            end_dt.strftime('%H:%M'),
+            patient_name or 'N/A',
+            patient_phone or 'N/A',
+            service_name or 'N/A',
+            professional_name or professional_username or 'N/A',
+            status.value,
+            notes or ''
+        ))
+
+        if len(rows) >= BATCH_SIZE:
+            writer.writerows(rows)
+            rows.clear()
+            yield flush()
+
+    if rows:
+        writer.writerows(rows)
+        yield flush()
+
+
+def gzip_chunks(chunks, compresslevel=1):
+    """
+    Comprime al vuelo las partes del CSV (gzip) y genera bytes.
+
+    Cada parte se vacía con flush para enviarla sin esperar al final del archivo.
+    Nivel 1: el CSV igual se reduce varias veces y el costo de CPU es mínimo.
+
+    Args:
+        chunks (iterable): Partes del CSV (str)
+        compresslevel (int): Nivel de compresión gzip (1-9)
+    """
+    buffer = BytesIO()
+
+    def drain():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return data
+
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=compresslevel) as gz:
+        for chunk in chunks:
+            gz.write(chunk.encode('utf-8'))
+            gz.flush()
+            yield drain()
+
+    # Cierre del stream gzip (CRC y tamaño)
+    yield drain()
+
+
+# ============================================================================
+# EXPORTACIONES EN SEGUNDO PLANO
+# ============================================================================
+def async_exports_enabled(app):
+    """
+    True si las exportaciones grandes pueden ir en segundo plano.
+    Requiere un cache compartido (ej: Redis): con SimpleCache el estado del trabajo
+    vive en un solo worker y la consulta de estado daría 404 en los demás.
+    """
+    return shared_cache_enabled(app)
+
+
+def _job_key(job_id):
+    return f'export_job:{job_id}'
+
+
+def get_export_job(job_id):
+    """Estado del trabajo (dict) o None si no existe / expiró"""
+    return cache.get(_job_key(job_id))
+
+
+def _save_job(app, job_id, job):
+    cache.set(_job_key(job_id), job, timeout=app.config['EXPORT_JOB_TIMEOUT'])
+
+
+def remove_export_file(path):
+    """Borra el archivo de una exportación (si aún existe)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_export_job(job_id):
+    """Elimina el estado del trabajo (la descarga ya no se puede repetir)"""
+    cache.delete(_job_key(job_id))
+
+
+def _sweep_exports(app):
+    """Borra los archivos con más de EXPORT_JOB_TIMEOUT segundos (trabajos ya expirados)"""
+    folder = app.config['EXPORT_FOLDER']
+    expired_before = time.time() - app.config['EXPORT_JOB_TIMEOUT']
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < expired_before:
+                os.remove(entry.path)
+        except OSError as e:
+            app.logger.warning(f"⚠️ No se pudo borrar la exportación {entry.name}: {e}")
+
+
+def _run_export(app, job_id, job, criteria):
+    """Escribe el CSV a disco dentro de un contexto de aplicación propio"""
+    with app.app_context():
+        try:
+            os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+            with open(job['path'], 'w', newline='', encoding='utf-8') as f:
+                for chunk in appointments_csv(criteria):
+                    f.write(chunk)
+            job['status'] = 'done'
+        except Exception as e:
+            app.logger.error(f"❌ Error en exportación {job_id}: {e}")
+            job['status'] = 'failed'
+            # Sin archivo parcial en disco
+            remove_export_file(job['path'])
+        finally:
+            db.session.remove()
+        _save_job(app, job_id, job)
+
+
+def start_export_job(app, criteria, user_id, filename):
+    """
+    Encola una exportación grande y retorna su ID.
+
+    Args:
+        app (Flask): Aplicación (el hilo abre su propio app_context)
+        criteria (list): Condiciones WHERE de la exportación
+        user_id (int): Usuario dueño del archivo (solo él puede descargarlo)
+        filename (str): Nombre del archivo para la descarga
+    """
+    # Los archivos de trabajos expirados (nunca descargados) se limpian aquí
+    _sweep_exports(app)
+    
+    job_id = uuid.uuid4().hex
+    job = {
+        'status': 'pending',
+        'user_id': user_id,
+        'filename': filename,
+        'path': os.path.join(app.config['EXPORT_FOLDER'], f'{job_id}.csv')
+    }
+    _save_job(app, job_id, job)
+    _executor.submit(_run_export, app, job_id, dict(job), criteria)
+    return job_id
@@ -0,0 +1,76 @@
+"""
+Serialización JSON de la aplicación con orjson.
+
+Reemplaza el proveedor JSON por defecto de Flask, así todos los jsonify()
+usan orjson sin cambiar las rutas.
+"""
+import decimal
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+def _default(obj):
+    """Tipos que orjson no serializa de forma nativa"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    return DefaultJSONProvider.default(obj)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON basado en orjson.
+    datetime/date/Enum se serializan de forma nativa (ISO 8601 / valor del Enum).
+    """
+    # Mismo orden de claves que el proveedor por defecto (sort_keys=True)
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        option = self.option
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        """
+        jsonify(): el cuerpo va directo en bytes de orjson, sin decodificar a str
+        para que Werkzeug lo vuelva a codificar (copia doble en listas grandes)
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=option) + b'\n',
+            mimetype=self.mimetype
+        )
+
+    def loads(self, s, **kwargs):
+        # La sesión de Flask usa object_hook (TaggedJSONSerializer): orjson no lo soporta
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def stream_json_array(items, chunk_size=500):
+    """
+    Genera un array JSON por partes para Response(stream).
+    Serializa cada elemento con orjson y emite bloques de chunk_size elementos,
+    así la memoria no crece con el número de filas.
+    
+    Args:
+        items (iterable): Elementos serializables (ej: dicts de filas)
+        chunk_size (int): Elementos por bloque enviado al cliente
+    """
+    yield b'['
+    buffer = []
+    first = True
+    for item in items:
+        buffer.append(orjson.dumps(item, default=_default, option=OrjsonProvider.option))
+        if len(buffer) >= chunk_size:
+            yield (b'' if first else b',') + b','.join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield (b'' if first else b',') + b','.join(buffer)
+    yield b']'
@@ -1,7 +1,15 @@
 from project import db, bcrypt
+from flask import g, has_request_context
 from flask_login import UserMixin
 from datetime import datetime, timezone, timedelta
 from enum import Enum
+from urllib.parse import quote
+from sqlalchemy import DDL, event, func, insert, select, text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, declared_attr, with_loader_criteria
+from sqlalchemy.sql.lambdas import StatementLambdaElement
 
 # ============================================================================
 # CONFIGURACIÓN: Zona horaria de Perú (UTC-5)
@@ -13,6 +21,26 @@ def get_peru_time():
     return datetime.now(PERU_TZ)
 
 
+class PeruDateTime(TypeDecorator):
+    """
+    DateTime que se guarda naive en hora de Perú y se lee con tzinfo=PERU_TZ.
+    El formato almacenado no cambia (no requiere migración); los valores con
+    zona horaria se convierten a hora de Perú antes de guardarse.
+    """
+    impl = db.DateTime
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(PERU_TZ).replace(tzinfo=None)
+        return value
+    
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=PERU_TZ)
+        return value
+
+
 # ============================================================================
 # ENUMS: Roles y Estados
 # ============================================================================
@@ -23,6 +51,18 @@ class UserRole(str, Enum):
     PROFESSIONAL = 'PROFESSIONAL'
 
 
+# Permisos por rol (bitmask): se resuelven una vez por rol, no por chequeo
+PERM_MANAGE_APPT = 1 << 0
+PERM_MANAGE_USERS = 1 << 1
+PERM_MANAGE_CLINICS = 1 << 2
+
+ROLE_PERMISSIONS = {
+    UserRole.SUPER_ADMIN: PERM_MANAGE_USERS | PERM_MANAGE_CLINICS,
+    UserRole.CLINIC_ADMIN: PERM_MANAGE_APPT | PERM_MANAGE_USERS,
+    UserRole.PROFESSIONAL: PERM_MANAGE_APPT,
+}
+
+
 class AppointmentStatus(str, Enum):
     """Estados de cita"""
     PROGRAMADA = 'Programada'
@@ -31,6 +71,45 @@ class AppointmentStatus(str, Enum):
     NO_ASISTIO = 'No Asistió'
 
 
+# Búsqueda por valor recibido en query params: dict.get en lugar de Enum(valor) + ValueError
+APPOINTMENT_STATUS_BY_VALUE = {status.value: status for status in AppointmentStatus}
+USER_ROLE_BY_VALUE = {role.value: role for role in UserRole}
+
+
+# ============================================================================
+# MULTI-TENANT: Filtro automático por clínica
+# ============================================================================
+class TenantMixin:
+    """
+    Modelos aislados por clínica: aporta la columna clinic_id.
+    Los SELECT sobre estos modelos se filtran automáticamente por la clínica
+    del usuario autenticado (ver _add_tenant_criteria al final del módulo).
+    """
+    
+    @declared_attr
+    def clinic_id(cls):
+        # Sin índice propio: cada modelo declara compuestos que empiezan por clinic_id
+        return db.Column(db.Integer, db.ForeignKey('clinic.id', ondelete='CASCADE'), nullable=False)
+
+
+def get_tenant_user():
+    """
+    Usuario cuya clínica restringe las consultas del request actual.
+    
+    Returns:
+        User | None: Usuario autenticado no SUPER_ADMIN, o None si no aplica filtro
+            (fuera de request, anónimo o SUPER_ADMIN)
+    """
+    if not has_request_context():
+        return None
+    
+    # Flask-Login guarda el usuario ya cargado en g (no dispara el user_loader)
+    user = g.get('_login_user')
+    if user is None or not user.is_authenticated or user.is_super_admin():
+        return None
+    return user
+
+
 # ============================================================================
 # MODELO 1: CLINIC (Entidad Multi-Tenant Principal)
 # ============================================================================
@@ -63,15 +142,35 @@ class Clinic(db.Model):
     
     # Relaciones (cascade para eliminar todo al borrar clínica)
     users = db.relationship('User', backref='clinic', lazy=True, cascade='all, delete-orphan')
-    patients = db.relationship('Patient', backref='clinic', lazy=True, cascade='all, delete-orphan')
+    patients = db.relationship('Patient', back_populates='clinic', lazy=True, cascade='all, delete-orphan')
     services = db.relationship('Service', backref='clinic', lazy=True, cascade='all, delete-orphan')
-    appointments = db.relationship('Appointment', backref='clinic', lazy=True, cascade='all, delete-orphan')
+    appointments = db.relationship('Appointment', back_populates='clinic', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Clinic {self.name}>'
     
-    def to_dict(self):
-        """Serializa el modelo a diccionario"""
+    def to_dict(self, counts=None):
+        """
+        Serializa el modelo a diccionario.
+        
+        Args:
+            counts (dict | None): users_count, patients_count y appointments_count ya
+                calculados en SQL. Si es None se cuentan en un solo SELECT (sin cargar
+                las relaciones).
+        """
+        if counts is None:
+            counts = db.session.execute(select(
+                select(func.count(User.id)).where(
+                    User.clinic_id == self.id
+                ).scalar_subquery().label('users_count'),
+                select(func.count(Patient.id)).where(
+                    Patient.clinic_id == self.id
+                ).scalar_subquery().label('patients_count'),
+                select(func.count(Appointment.id)).where(
+                    Appointment.clinic_id == self.id
+                ).scalar_subquery().label('appointments_count')
+            )).one()._mapping
+        
         return {
             'id': self.id,
             'name': self.name,
@@ -83,9 +182,9 @@ class Clinic(db.Model):
             'is_active': self.is_active,
             'plan': self.plan,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'users_count': len(self.users),
-            'patients_count': len(self.patients),
-            'appointments_count': len(self.appointments)
+            'users_count': counts['users_count'],
+            'patients_count': counts['patients_count'],
+            'appointments_count': counts['appointments_count']
         }
 
 
@@ -100,6 +199,11 @@ class User(UserMixin, db.Model):
     - PROFESSIONAL: Profesional de salud dentro de una clínica
     """
     __tablename__ = 'user'
+    __table_args__ = (
+        # Usuarios de la clínica por rol y estado (listados de profesionales, contadores
+        # de activos del dashboard, reportes, JOIN desde citas)
+        db.Index('ix_user_clinic_role_active', 'clinic_id', 'role', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
@@ -130,7 +234,7 @@ class User(UserMixin, db.Model):
     appointments_as_professional = db.relationship(
         'Appointment',
         foreign_keys='Appointment.professional_id',
-        backref='professional',
+        back_populates='professional',
         lazy=True,
         cascade='all, delete-orphan'
     )
@@ -181,15 +285,27 @@ class User(UserMixin, db.Model):
             return True
         return False
     
+    @property
+    def permissions_mask(self):
+        """Bitmask de permisos del rol (PERM_*), derivado de la columna role"""
+        return ROLE_PERMISSIONS.get(self.role, 0)
+    
     def can_manage_appointments(self):
         """Verifica si puede gestionar citas"""
-        return self.role in [UserRole.CLINIC_ADMIN, UserRole.PROFESSIONAL]
+        return bool(self.permissions_mask & PERM_MANAGE_APPT)
     
     # ========================================================================
     # Serialización
     # ========================================================================
-    def to_dict(self, include_sensitive=False):
-        """Serializa el usuario a diccionario"""
+    def to_dict(self, include_sensitive=False, appointments_count=None):
+        """
+        Serializa el usuario a diccionario.
+        
+        Args:
+            include_sensitive (bool): Incluir el conteo de citas como profesional
+            appointments_count (int | None): Conteo ya calculado en SQL por quien llama.
+                Si es None la clave se omite (no se consulta nada aquí).
+        """
         data = {
             'id': self.id,
             'username': self.username,
@@ -204,26 +320,61 @@ class User(UserMixin, db.Model):
             'last_login': self.last_login.isoformat() if self.last_login else None
         }
         
-        if include_sensitive:
-            data['appointments_count'] = len(self.appointments_as_professional)
+        if include_sensitive and appointments_count is not None:
+            data['appointments_count'] = appointments_count
         
         return data
+    
+    @hybrid_property
+    def search_text(self):
+        """Texto de búsqueda: nombre completo + usuario + email en minúsculas"""
+        return ' '.join([self.full_name or '', self.username or '', self.email or '']).lower()
+    
+    @search_text.expression
+    def search_text(cls):
+        return _user_search_text(cls.full_name, cls.username, cls.email)
+
+
+def _user_search_text(full_name, username, email):
+    """
+    Expresión SQL de User.search_text.
+    Debe ser idéntica a la del índice para que PostgreSQL lo use.
+    """
+    return func.lower(
+        func.coalesce(full_name, '') + ' ' + func.coalesce(username, '') + ' ' + func.coalesce(email, '')
+    )
+
+
+# Índice trigram (GIN) para la búsqueda rápida de profesionales ('%texto%') en PostgreSQL
+db.Index(
+    'ix_user_search_trgm',
+    _user_search_text(
+        User.__table__.c.full_name, User.__table__.c.username, User.__table__.c.email
+    ).label('search_text'),
+    postgresql_using='gin',
+    postgresql_ops={'search_text': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
 
 
 # ============================================================================
 # MODELO 3: PATIENT (Pacientes por Clínica)
 # ============================================================================
-class Patient(db.Model):
+class Patient(TenantMixin, db.Model):
     """
     Paciente vinculado a una clínica específica.
     Los pacientes NO son usuarios del sistema, son registros dentro de cada clínica.
     """
     __tablename__ = 'patient'
+    __table_args__ = (
+        # Listado ordenado por nombre dentro de la clínica (ORDER BY name LIMIT n)
+        db.Index('ix_patient_clinic_name', 'clinic_id', 'name'),
+        # Búsqueda de duplicados por teléfono (no único: update_patient no lo restringe)
+        db.Index('ix_patient_clinic_phone', 'clinic_id', 'phone'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
-    # Multi-tenant
-    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Multi-tenant: clinic_id viene de TenantMixin
     
     # Datos personales
     name = db.Column(db.String(150), nullable=False)
@@ -240,14 +391,22 @@ class Patient(db.Model):
     updated_at = db.Column(db.DateTime, default=get_peru_time, onupdate=get_peru_time)
     
     # Relaciones
-    appointments = db.relationship('Appointment', backref='patient', lazy=True)
+    # Carga diferida: ningún serializador de pacientes usa la clínica
+    clinic = db.relationship('Clinic', back_populates='patients', lazy=True)
+    appointments = db.relationship('Appointment', back_populates='patient', lazy=True)
     
     def __repr__(self):
         return f'<Patient {self.name}>'
     
-    def to_dict(self):
-        """Serializa el paciente a diccionario"""
-        return {
+    def to_dict(self, appointments_count=None):
+        """
+        Serializa el paciente a diccionario.
+        
+        Args:
+            appointments_count (int | None): Conteo de citas ya calculado en SQL por
+                quien llama. Si es None la clave se omite (no se consulta nada aquí).
+        """
+        data = {
             'id': self.id,
             'clinic_id': self.clinic_id,
             'name': self.name,
@@ -256,12 +415,49 @@ class Patient(db.Model):
             'date_of_birth': self.date_of_birth.isoformat() if self.date_of_birth else None,
             'address': self.address,
             'notes': self.notes,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'appointments_count': len(self.appointments)
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
+        
+        if appointments_count is not None:
+            data['appointments_count'] = appointments_count
+        
+        return data
+    
+    @hybrid_property
+    def search_text(self):
+        """Texto de búsqueda: nombre + teléfono + email en minúsculas"""
+        return ' '.join([self.name or '', self.phone or '', self.email or '']).lower()
+    
+    @search_text.expression
+    def search_text(cls):
+        return _patient_search_text(cls.name, cls.phone, cls.email)
     
-    def get_whatsapp_link(self, message=None):
-        """Genera deep link de WhatsApp para recordatorios"""
+    @hybrid_property
+    def phone_digits(self):
+        """Teléfono sin separadores (espacios, guiones, '+', paréntesis, puntos)"""
+        if not self.phone:
+            return self.phone
+        return ''.join(c for c in self.phone if c not in _PHONE_SEPARATORS)
+    
+    @phone_digits.expression
+    def phone_digits(cls):
+        return _patient_phone_digits(cls.phone)
+    
+    @classmethod
+    def fulltext_match(cls, term):
+        """
+        Condición de texto completo (solo PostgreSQL): nombre + email contra las
+        palabras del término, con stemming en español (índice GIN ix_patient_search_fts).
+        """
+        return _patient_search_vector(cls.name, cls.email).op('@@')(
+            func.plainto_tsquery(_FTS_CONFIG, term)
+        )
+    
+    def get_whatsapp_link(self, message=None, quoted=False):
+        """
+        Genera deep link de WhatsApp para recordatorios.
+        Con quoted=True el mensaje ya viene codificado para URL.
+        """
         if not self.phone:
             return None
         
@@ -275,28 +471,129 @@ class Patient(db.Model):
         # Mensaje por defecto
         if not message:
             message = f"Hola {self.name}, te recordamos tu cita programada."
+            quoted = False
         
         # Codificar mensaje para URL
-        from urllib.parse import quote
-        message_encoded = quote(message)
+        if quoted:
+            message_encoded = message
+        else:
+            message_encoded = quote(message)
         
         return f"https://wa.me/{phone_clean}?text={message_encoded}"
 
 
+_PHONE_SEPARATORS = (' ', '-', '+', '(', ')', '.')
+
+
+def _patient_phone_digits(phone):
+    """
+    Expresión SQL de Patient.phone_digits (REPLACE anidado, portable SQLite/PostgreSQL).
+    Debe ser idéntica a la del índice para que PostgreSQL lo use.
+    """
+    expr = phone
+    for separator in _PHONE_SEPARATORS:
+        expr = func.replace(expr, separator, '')
+    return expr
+
+
+def _patient_search_text(name, phone, email):
+    """
+    Expresión SQL de Patient.search_text.
+    Debe ser idéntica a la del índice para que PostgreSQL lo use.
+    """
+    return func.lower(
+        func.coalesce(name, '') + ' ' + func.coalesce(phone, '') + ' ' + func.coalesce(email, '')
+    )
+
+
+# Índice trigram (GIN) para búsquedas '%texto%' en PostgreSQL.
+# En SQLite no aplica: la búsqueda cae en un scan acotado por clinic_id
+db.Index(
+    'ix_patient_search_trgm',
+    _patient_search_text(
+        Patient.__table__.c.name, Patient.__table__.c.phone, Patient.__table__.c.email
+    ).label('search_text'),
+    postgresql_using='gin',
+    postgresql_ops={'search_text': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
+
+# Configuración de texto completo (diccionario y stopwords en español)
+_FTS_CONFIG = text("'spanish'::regconfig")
+
+
+def _patient_search_vector(name, email):
+    """
+    Expresión SQL tsvector de Patient.fulltext_match (solo PostgreSQL).
+    Debe ser idéntica a la del índice para que PostgreSQL lo use.
+    """
+    return func.to_tsvector(
+        _FTS_CONFIG, func.coalesce(name, '') + ' ' + func.coalesce(email, '')
+    )
+
+
+# Índice GIN de texto completo (sin columna generada: create_all no altera tablas existentes)
+db.Index(
+    'ix_patient_search_fts',
+    _patient_search_vector(Patient.__table__.c.name, Patient.__table__.c.email).label('search_vector'),
+    postgresql_using='gin'
+).ddl_if(dialect='postgresql')
+
+# Trigram solo del nombre: búsqueda rápida de citas por paciente (ILIKE '%texto%')
+db.Index(
+    'ix_patient_name_trgm',
+    Patient.__table__.c.name,
+    postgresql_using='gin',
+    postgresql_ops={'name': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
+
+# Índices para autocomplete por prefijo (LIKE 'texto%') en PostgreSQL:
+# text_pattern_ops permite usar el B-tree con LIKE sin depender del collation
+db.Index(
+    'ix_patient_clinic_phone_digits_prefix',
+    Patient.__table__.c.clinic_id,
+    _patient_phone_digits(Patient.__table__.c.phone).label('phone_digits'),
+    postgresql_ops={'phone_digits': 'text_pattern_ops'}
+).ddl_if(dialect='postgresql')
+
+db.Index(
+    'ix_patient_clinic_name_lower_prefix',
+    Patient.__table__.c.clinic_id,
+    func.lower(Patient.__table__.c.name).label('name_lower'),
+    postgresql_ops={'name_lower': 'text_pattern_ops'}
+).ddl_if(dialect='postgresql')
+
+# Extensión requerida por gin_trgm_ops (antes de crear tablas/índices)
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+# Extensión requerida por el EXCLUDE de Appointment (igualdad de enteros en GiST)
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql')
+)
+
+
 # ============================================================================
 # MODELO 4: SERVICE (Servicios/Tratamientos por Clínica)
 # ============================================================================
-class Service(db.Model):
+class Service(TenantMixin, db.Model):
     """
     Servicio o tratamiento ofrecido por una clínica.
     Ejemplos: Consulta general, Limpieza dental, Terapia física, etc.
     """
     __tablename__ = 'service'
+    __table_args__ = (
+        # Servicios activos de la clínica ordenados por nombre
+        db.Index('ix_service_clinic_active_name', 'clinic_id', 'is_active', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
-    # Multi-tenant
-    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Multi-tenant: clinic_id viene de TenantMixin
     
     # Datos del servicio
     name = db.Column(db.String(100), nullable=False)
@@ -312,7 +609,7 @@ class Service(db.Model):
     updated_at = db.Column(db.DateTime, default=get_peru_time, onupdate=get_peru_time)
     
     # Relaciones
-    appointments = db.relationship('Appointment', backref='service', lazy=True)
+    appointments = db.relationship('Appointment', back_populates='service', lazy=True)
     
     def __repr__(self):
         return f'<Service {self.name}>'
@@ -334,26 +631,83 @@ class Service(db.Model):
 # ============================================================================
 # MODELO 5: APPOINTMENT (Citas Multi-Tenant)
 # ============================================================================
-class Appointment(db.Model):
+# Nombre de la restricción EXCLUDE anti-solapamiento (PostgreSQL)
+OVERLAP_CONSTRAINT = 'no_overlap'
+
+# Colores de FullCalendar según estado (una sola vez, no por evento)
+STATUS_COLORS = {
+    AppointmentStatus.PROGRAMADA: '#0d6efd',  # Azul
+    AppointmentStatus.COMPLETADA: '#198754',  # Verde
+    AppointmentStatus.CANCELADA: '#dc3545',   # Rojo
+    AppointmentStatus.NO_ASISTIO: '#ffc107'   # Amarillo
+}
+DEFAULT_STATUS_COLOR = '#6c757d'
+
+# Estados que ocupan agenda (calendario por defecto, solapamiento, slots libres)
+ACTIVE_STATUSES = (AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA)
+
+class Appointment(TenantMixin, db.Model):
     """
     Cita médica/profesional.
     Aislada por clínica y asociada a un profesional y paciente específicos.
     """
     __tablename__ = 'appointment'
+    # Cada índice responde a consultas concretas; clinic_id, professional_id y
+    # start_datetime no llevan índice propio (son prefijo de los compuestos)
+    __table_args__ = (
+        # Calendario por defecto (solo citas activas): índice parcial con el mismo predicado
+        # que get_appointments cuando include_cancelled=false (el Enum guarda los nombres).
+        # También la verificación de solapamiento (_overlap_criteria) y los horarios libres
+        db.Index(
+            'ix_appointment_active_cal',
+            'clinic_id', 'professional_id', 'start_datetime',
+            postgresql_where=text("status IN ('PROGRAMADA', 'COMPLETADA')"),
+            sqlite_where=text("status IN ('PROGRAMADA', 'COMPLETADA')")
+        ),
+        # Conteo de citas por profesional y estado en el listado de profesionales
+        # (GROUP BY professional_id, status resuelto solo con el índice)
+        db.Index('ix_appointment_clinic_prof_status', 'clinic_id', 'professional_id', 'status'),
+        # Citas de un profesional por fecha en todos los estados (últimas citas del detalle,
+        # /stats del profesional); también sirve las búsquedas por professional_id (FK)
+        db.Index('ix_appointment_prof_start', 'professional_id', 'start_datetime'),
+        # Citas de la clínica por rango (start >= X AND end <= Y): calendario de toda la
+        # clínica (el filtro de citas activas sale del estado en INCLUDE), dashboard,
+        # reportes y exportación. En PostgreSQL INCLUDE cubre las columnas de los
+        # FILTER/JOIN y el COUNT es un Index Only Scan. El estado va en INCLUDE y no en la
+        # clave: los reportes agregan todos los estados del rango, y clinic_id +
+        # start_datetime lo acota sin saltos (en SQLite se ignora INCLUDE)
+        db.Index(
+            'ix_appointment_clinic_start',
+            'clinic_id', 'start_datetime', 'end_datetime',
+            postgresql_include=['status', 'professional_id', 'patient_id', 'service_id']
+        ),
+        # Rango válido: tsrange() de la EXCLUDE rechaza rangos con fin anterior al inicio
+        db.CheckConstraint('end_datetime > start_datetime', name='ck_appointment_end_after_start'),
+        # Anti-solapamiento garantizado por la base (solo PostgreSQL, requiere btree_gist):
+        # dos citas activas del mismo profesional no pueden cruzarse en [start, end)
+        ExcludeConstraint(
+            ('clinic_id', '='),
+            ('professional_id', '='),
+            (func.tsrange(text('start_datetime'), text('end_datetime')), '&&'),
+            name=OVERLAP_CONSTRAINT,
+            using='gist',
+            where=text("status IN ('PROGRAMADA', 'COMPLETADA')")
+        ).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     
-    # Multi-tenant
-    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Multi-tenant: clinic_id viene de TenantMixin
     
     # Relaciones principales
-    professional_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    professional_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id', ondelete='CASCADE'), nullable=False, index=True)
     service_id = db.Column(db.Integer, db.ForeignKey('service.id', ondelete='SET NULL'), nullable=True)
     
     # Fechas y horarios
-    start_datetime = db.Column(db.DateTime, nullable=False, index=True)
-    end_datetime = db.Column(db.DateTime, nullable=False, index=True)
+    # Se leen con zona horaria de Perú (ver PeruDateTime)
+    start_datetime = db.Column(PeruDateTime, nullable=False)
+    end_datetime = db.Column(PeruDateTime, nullable=False)
     
     # Estado
     status = db.Column(db.Enum(AppointmentStatus), nullable=False, default=AppointmentStatus.PROGRAMADA)
@@ -369,18 +723,34 @@ class Appointment(db.Model):
     created_at = db.Column(db.DateTime, default=get_peru_time, nullable=False)
     updated_at = db.Column(db.DateTime, default=get_peru_time, onupdate=get_peru_time)
     
+    # Relaciones (selectin: un SELECT ... IN por relación al serializar listas, no uno por fila)
+    clinic = db.relationship('Clinic', back_populates='appointments')
+    professional = db.relationship(
+        'User',
+        foreign_keys=[professional_id],
+        back_populates='appointments_as_professional',
+        lazy='selectin'
+    )
+    patient = db.relationship('Patient', back_populates='appointments', lazy='selectin')
+    service = db.relationship('Service', back_populates='appointments', lazy='selectin')
+    
     def __repr__(self):
         return f'<Appointment {self.id} - {self.status.value}>'
     
     # ========================================================================
     # Métodos de validación
     # ========================================================================
-    def can_be_completed(self):
-        """Verifica si la cita puede marcarse como completada"""
+    def can_be_completed(self, now=None):
+        """
+        Verifica si la cita puede marcarse como completada.
+        
+        Args:
+            now (datetime): Hora actual de Perú (para serializar muchas citas con una sola lectura)
+        """
         if self.status != AppointmentStatus.PROGRAMADA:
             return False
         
-        now_peru = get_peru_time()
+        now_peru = now or get_peru_time()
         end_aware = self.end_datetime.replace(tzinfo=PERU_TZ) if self.end_datetime.tzinfo is None else self.end_datetime
         return end_aware <= now_peru
     
@@ -425,6 +795,34 @@ class Appointment(db.Model):
     # ========================================================================
     # Validación de solapamiento
     # ========================================================================
+    @staticmethod
+    def _overlap_criteria(clinic_id, professional_id, start_dt, end_dt, exclude_appointment_id=None):
+        """Condiciones de solapamiento (ignora citas canceladas y "No Asistió")"""
+        criteria = [
+            Appointment.clinic_id == clinic_id,
+            Appointment.professional_id == professional_id,
+            Appointment.status.in_(ACTIVE_STATUSES),
+            Appointment.start_datetime < end_dt,
+            Appointment.end_datetime > start_dt
+        ]
+        if exclude_appointment_id:
+            criteria.append(Appointment.id != exclude_appointment_id)
+        return criteria
+    
+    @staticmethod
+    def has_overlap(clinic_id, professional_id, start_dt, end_dt, exclude_appointment_id=None):
+        """
+        Verifica con SELECT EXISTS si hay solapamiento de horarios (sin cargar filas).
+        
+        Returns:
+            bool: True si alguna cita se solapa
+        """
+        return db.session.execute(
+            db.select(db.exists().where(*Appointment._overlap_criteria(
+                clinic_id, professional_id, start_dt, end_dt, exclude_appointment_id
+            )))
+        ).scalar()
+    
     @staticmethod
     def check_overlap(clinic_id, professional_id, start_dt, end_dt, exclude_appointment_id=None):
         """
@@ -434,18 +832,9 @@ class Appointment(db.Model):
         Returns:
             Appointment | None: La cita que se solapa, o None si no hay conflicto
         """
-        query = Appointment.query.filter(
-            Appointment.clinic_id == clinic_id,
-            Appointment.professional_id == professional_id,
-            Appointment.status.in_([AppointmentStatus.PROGRAMADA, AppointmentStatus.COMPLETADA]),
-            Appointment.start_datetime < end_dt,
-            Appointment.end_datetime > start_dt
-        )
-        
-        if exclude_appointment_id:
-            query = query.filter(Appointment.id != exclude_appointment_id)
-        
-        return query.first()
+        return Appointment.query.filter(*Appointment._overlap_criteria(
+            clinic_id, professional_id, start_dt, end_dt, exclude_appointment_id
+        )).first()
     
     # ========================================================================
     # Serialización
@@ -478,36 +867,38 @@ class Appointment(db.Model):
             'can_edit': self.can_be_edited()
         }
     
-    def to_fullcalendar_event(self):
-        """Serializa para FullCalendar"""
-        # Color según estado
-        color_map = {
-            AppointmentStatus.PROGRAMADA: '#0d6efd',  # Azul
-            AppointmentStatus.COMPLETADA: '#198754',  # Verde
-            AppointmentStatus.CANCELADA: '#dc3545',   # Rojo
-            AppointmentStatus.NO_ASISTIO: '#ffc107'   # Amarillo
-        }
+    def to_fullcalendar_event(self, now=None):
+        """
+        Serializa para FullCalendar.
         
-        start_aware = self.start_datetime.replace(tzinfo=PERU_TZ) if self.start_datetime.tzinfo is None else self.start_datetime
-        end_aware = self.end_datetime.replace(tzinfo=PERU_TZ) if self.end_datetime.tzinfo is None else self.end_datetime
+        Args:
+            now (datetime): Hora actual de Perú, compartida al serializar un calendario completo
+        """
+        status = self.status
+        color = STATUS_COLORS.get(status, DEFAULT_STATUS_COLOR)
+        patient = self.patient
+        service = self.service
+        professional = self.professional
+        patient_name = patient.name if patient else None
         
+        # PeruDateTime ya entrega datetime con zona horaria: orjson lo emite en ISO 8601
         return {
             'id': self.id,
-            'title': self.patient.name if self.patient else 'Paciente desconocido',
-            'start': start_aware.isoformat(),
-            'end': end_aware.isoformat(),
-            'backgroundColor': color_map.get(self.status, '#6c757d'),
-            'borderColor': color_map.get(self.status, '#6c757d'),
+            'title': patient_name or 'Paciente desconocido',
+            'start': self.start_datetime,
+            'end': self.end_datetime,
+            'backgroundColor': color,
+            'borderColor': color,
             'extendedProps': {
                 'patient_id': self.patient_id,
-                'patient_name': self.patient.name if self.patient else None,
-                'patient_phone': self.patient.phone if self.patient else None,
-                'service': self.service.name if self.service else None,
-                'professional': self.professional.full_name or self.professional.username if self.professional else None,
-                'status': self.status.value,
+                'patient_name': patient_name,
+                'patient_phone': patient.phone if patient else None,
+                'service': service.name if service else None,
+                'professional': professional.full_name or professional.username if professional else None,
+                'status': status.value,
                 'notes': self.notes or '',
-                'can_complete': self.can_be_completed(),
-                'can_cancel': self.can_be_cancelled()
+                'can_complete': self.can_be_completed(now),
+                'can_cancel': status == AppointmentStatus.PROGRAMADA
             }
         }
 
@@ -540,6 +931,18 @@ class Notification(db.Model):
     def __repr__(self):
         return f'<Notification {self.id} - {self.type}>'
     
+    @staticmethod
+    def bulk_notify(rows):
+        """
+        Inserta varias notificaciones en un solo INSERT (executemany), sin instancias ORM.
+        Quedan en la transacción actual: el commit lo hace quien llama.
+        
+        Args:
+            rows (list): Dicts con user_id, message y type (opcional, 'info' por defecto)
+        """
+        if rows:
+            db.session.execute(insert(Notification), rows)
+    
     def to_dict(self):
         """Serializa la notificación a diccionario"""
         return {
@@ -549,4 +952,55 @@ class Notification(db.Model):
             'type': self.type,
             'is_read': self.is_read,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M')
-        }
\ No newline at end of file
+        }
+
+
+# Badge de notificaciones (no leídas del usuario, más recientes primero, LIMIT 10):
+# índice parcial ya ordenado; en PostgreSQL INCLUDE cubre las columnas de to_dict()
+db.Index(
+    'ix_notification_unread',
+    Notification.__table__.c.user_id,
+    Notification.__table__.c.created_at.desc(),
+    postgresql_where=Notification.__table__.c.is_read == False,
+    postgresql_include=['id', 'message', 'type'],
+    sqlite_where=Notification.__table__.c.is_read == False
+)
+
+
+# ============================================================================
+# EVENTO: Criterio multi-tenant global
+# ============================================================================
+@event.listens_for(Session, 'do_orm_execute')
+def _add_tenant_criteria(execute_state):
+    """
+    Agrega clinic_id = <clínica del usuario> a todo SELECT ORM sobre modelos TenantMixin.
+    Se omite con .execution_options(skip_tenant=True). Las cargas de relaciones y
+    de atributos expirados no se filtran: su padre ya pasó por el filtro.
+    
+    Las consultas lambda_stmt tampoco se filtran: with_loader_criteria no se puede
+    agregar a un lambda (resolverlo fijaría los parámetros de la primera ejecución),
+    así que esas consultas deben filtrar clinic_id de forma explícita.
+    """
+    if (
+        not execute_state.is_select
+        or execute_state.is_column_load
+        or execute_state.is_relationship_load
+        or execute_state.execution_options.get('skip_tenant', False)
+        or isinstance(execute_state.statement, StatementLambdaElement)
+    ):
+        return
+    
+    user = get_tenant_user()
+    if user is None:
+        return
+    
+    # Un usuario sin clínica (no SUPER_ADMIN) filtra por NULL: no ve ningún registro
+    clinic_id = user.clinic_id
+    
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(
+            TenantMixin,
+            lambda cls: cls.clinic_id == clinic_id,
+            include_aliases=True
+        )
+    )
@@ -0,0 +1,196 @@
+"""
+Agregados de citas para reportes.
+
+En PostgreSQL salen de la vista materializada mv_appointment_daily_counts
+(citas e ingresos por clínica, profesional, día y estado): el reporte lee unas
+pocas filas por día en lugar de recorrer las citas. La vista se refresca en la
+petición que la encuentra vencida, antes de leerla, así que va atrasada como
+máximo REPORT_VIEW_REFRESH segundos. En otros motores (SQLite en desarrollo), o
+si el refresco falla, se calculan directamente sobre appointment.
+"""
+import time
+
+from sqlalchemy import DDL, DateTime, Integer, Numeric, case, cast, column, event, func, select, table, text
+
+from project import db, cache
+from project.models import Appointment, AppointmentStatus, Service, User
+
+REPORT_VIEW = 'mv_appointment_daily_counts'
+
+# Estados del marcador de refresco (si no, guarda la marca del último refresco)
+_REFRESHING = 'refreshing'
+_FAILED = 'failed'
+
+# El Enum guarda los nombres ('COMPLETADA'); día = inicio de la cita truncado
+event.listen(
+    db.metadata,
+    'after_create',
+    DDL(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {REPORT_VIEW} AS
+        SELECT a.clinic_id,
+               a.professional_id,
+               date_trunc('day', a.start_datetime) AS day,
+               a.status,
+               count(*) AS appointments,
+               sum(CASE WHEN a.status = 'COMPLETADA' THEN s.price END) AS revenue
+        FROM appointment a
+        LEFT JOIN service s ON s.id = a.service_id
+        GROUP BY a.clinic_id, a.professional_id, date_trunc('day', a.start_datetime), a.status
+    """).execute_if(dialect='postgresql')
+)
+
+# Índice único: requerido por REFRESH ... CONCURRENTLY (no bloquea las lecturas)
+event.listen(
+    db.metadata,
+    'after_create',
+    DDL(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS ux_{REPORT_VIEW} '
+        f'ON {REPORT_VIEW} (clinic_id, professional_id, day, status)'
+    ).execute_if(dialect='postgresql')
+)
+
+# La vista depende de appointment y service: se elimina antes que las tablas
+event.listen(
+    db.metadata,
+    'before_drop',
+    DDL(f'DROP MATERIALIZED VIEW IF EXISTS {REPORT_VIEW}').execute_if(dialect='postgresql')
+)
+
+# Columnas de la vista para consultarla (no forma parte de metadata: create_all no la toca)
+daily_counts = table(
+    REPORT_VIEW,
+    column('clinic_id', Integer),
+    column('professional_id', Integer),
+    column('day', DateTime),
+    column('status', Appointment.__table__.c.status.type),
+    column('appointments', Integer),
+    column('revenue', Numeric)
+)
+
+
+def report_view_enabled():
+    """True si los reportes se leen de la vista materializada (PostgreSQL)"""
+    return db.engine.dialect.name == 'postgresql'
+
+
+# ============================================================================
+# REFRESCO DE LA VISTA
+# ============================================================================
+def _refresh_view(app):
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {REPORT_VIEW}'))
+        return True
+    except Exception as e:
+        app.logger.warning(f"⚠️ No se pudo refrescar {REPORT_VIEW}: {e}")
+        return False
+
+
+def refresh_view_if_stale(app):
+    """
+    Refresca la vista en esta misma petición si pasó el intervalo, antes de leerla.
+    cache.add solo tiene éxito para el primero que llega: un refresco por intervalo.
+    Las peticiones concurrentes leen la versión anterior mientras tanto
+    (CONCURRENTLY no bloquea las lecturas), que tampoco supera el intervalo más
+    la duración del refresco.
+    
+    Returns:
+        tuple: (use_view, snapshot)
+            use_view (bool): True si los reportes deben leer la vista. False si no
+                es PostgreSQL o si el último refresco falló: hasta el siguiente
+                intervalo se calcula sobre appointment en lugar de servir una vista
+                de antigüedad desconocida.
+            snapshot (str | None): Identifica el refresco de la vista que se va a
+                leer; None mientras otro refresco está en curso. Lo leído de la vista
+                vale exactamente hasta el próximo refresco: se cachea con esta clave.
+    """
+    if not report_view_enabled():
+        return False, None
+    
+    key = f'{REPORT_VIEW}:fresh'
+    timeout = app.config['REPORT_VIEW_REFRESH']
+    if cache.add(key, _REFRESHING, timeout=timeout):
+        if not _refresh_view(app):
+            # Sin reintentar en cada petición: el fallo se recuerda por un intervalo
+            cache.set(key, _FAILED, timeout=timeout)
+            return False, None
+        snapshot = str(time.time())
+        cache.set(key, snapshot, timeout=timeout)
+        return True, snapshot
+    
+    state = cache.get(key)
+    if state == _FAILED:
+        return False, None
+    return True, None if state in (_REFRESHING, None) else state
+
+
+# ============================================================================
+# CONSULTAS
+# ============================================================================
+def status_totals(clinic_id, start_date, end_date, use_view=False):
+    """
+    Citas e ingresos estimados (solo completadas con servicio) por estado.
+
+    Args:
+        use_view (bool): Leer la vista materializada (ver refresh_view_if_stale)
+
+    Returns:
+        list: Filas (status, count, revenue) del rango [start_date, end_date)
+    """
+    if use_view:
+        # SUM de bigint es numeric en PostgreSQL: cast para devolver int
+        stmt = select(
+            daily_counts.c.status,
+            cast(func.sum(daily_counts.c.appointments), Integer),
+            func.sum(daily_counts.c.revenue)
+        ).where(
+            daily_counts.c.clinic_id == clinic_id,
+            daily_counts.c.day >= start_date,
+            daily_counts.c.day < end_date
+        ).group_by(daily_counts.c.status)
+    else:
+        # Un único GROUP BY status en lugar de un COUNT y un SUM por separado
+        stmt = select(
+            Appointment.status,
+            func.count(Appointment.id),
+            func.sum(case((Appointment.status == AppointmentStatus.COMPLETADA, Service.price)))
+        ).outerjoin(
+            Service, Appointment.service_id == Service.id
+        ).where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= start_date,
+            Appointment.start_datetime < end_date
+        ).group_by(Appointment.status)
+
+    return db.session.execute(stmt).all()
+
+
+def professional_totals(clinic_id, start_date, end_date, use_view=False):
+    """
+    Citas por profesional.
+
+    Args:
+        use_view (bool): Leer la vista materializada (ver refresh_view_if_stale)
+
+    Returns:
+        list: Filas (full_name, username, count) del rango [start_date, end_date)
+    """
+    if use_view:
+        count = cast(func.sum(daily_counts.c.appointments), Integer)
+        stmt = select(User.full_name, User.username, count).join(
+            daily_counts, daily_counts.c.professional_id == User.id
+        ).where(
+            daily_counts.c.clinic_id == clinic_id,
+            daily_counts.c.day >= start_date,
+            daily_counts.c.day < end_date
+        )
+    else:
+        stmt = select(User.full_name, User.username, func.count(Appointment.id)).join(
+            Appointment, Appointment.professional_id == User.id
+        ).where(
+            Appointment.clinic_id == clinic_id,
+            Appointment.start_datetime >= start_date,
+            Appointment.start_datetime < end_date
+        )
+
+    return db.session.execute(stmt.group_by(User.id)).all()
@@ -1,9 +1,11 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from flask_login import login_required, current_user
 from functools import wraps
+import secrets
 from project import db
-from project.models import User, Clinic, Appointment, Patient, Service, UserRole, get_peru_time
-from sqlalchemy import func
+from project.models import User, Clinic, Appointment, Patient, Service, UserRole, get_peru_time, USER_ROLE_BY_VALUE
+from sqlalchemy import func, or_, select
+from datetime import datetime, timedelta
 
 super_admin_bp = Blueprint('super_admin', __name__)
 
@@ -38,14 +40,18 @@ def dashboard():
     Dashboard principal del Super Administrador.
     Vista general de todas las clínicas del sistema.
     """
-    # Estadísticas globales
-    stats = {
-        'total_clinics': Clinic.query.count(),
-        'active_clinics': Clinic.query.filter_by(is_active=True).count(),
-        'total_users': User.query.filter(User.role != UserRole.SUPER_ADMIN).count(),
-        'total_appointments': Appointment.query.count(),
-        'total_patients': Patient.query.count()
-    }
+    # Estadísticas globales: un solo SELECT con una subconsulta escalar por contador
+    stats = dict(db.session.execute(select(
+        select(func.count(Clinic.id)).scalar_subquery().label('total_clinics'),
+        select(func.count(Clinic.id)).where(
+            Clinic.is_active == True
+        ).scalar_subquery().label('active_clinics'),
+        select(func.count(User.id)).where(
+            User.role != UserRole.SUPER_ADMIN
+        ).scalar_subquery().label('total_users'),
+        select(func.count(Appointment.id)).scalar_subquery().label('total_appointments'),
+        select(func.count(Patient.id)).scalar_subquery().label('total_patients')
+    )).one()._mapping)
     
     # Obtener todas las clínicas con información agregada
     clinics = db.session.query(
@@ -77,33 +83,37 @@ def dashboard():
 @super_admin_required
 def get_clinics():
     """GET: Obtiene lista de todas las clínicas"""
-    clinics = Clinic.query.order_by(Clinic.created_at.desc()).all()
+    # Conteos como subconsultas escalares correlacionadas: una sola consulta para todas
+    def count_of(model):
+        return select(func.count(model.id)).where(
+            model.clinic_id == Clinic.id
+        ).correlate(Clinic).scalar_subquery()
+    
+    rows = db.session.execute(select(
+        Clinic,
+        count_of(User).label('users_count'),
+        count_of(Patient).label('patients_count'),
+        count_of(Appointment).label('appointments_count')
+    ).order_by(Clinic.created_at.desc())).all()
+    
+    # CLINIC_ADMIN de cada clínica en una sola consulta (el de menor id por clínica)
+    admins = {}
+    for admin in db.session.execute(select(
+        User.id, User.clinic_id, User.username, User.email, User.full_name
+    ).where(User.role == UserRole.CLINIC_ADMIN).order_by(User.id)):
+        admins.setdefault(admin.clinic_id, {
+            'id': admin.id,
+            'username': admin.username,
+            'email': admin.email,
+            'full_name': admin.full_name
+        })
     
     clinics_data = []
-    for clinic in clinics:
-        data = clinic.to_dict()
-        
-        # Agregar estadísticas adicionales
-        data['users_count'] = User.query.filter_by(clinic_id=clinic.id).count()
-        data['patients_count'] = Patient.query.filter_by(clinic_id=clinic.id).count()
-        data['appointments_count'] = Appointment.query.filter_by(clinic_id=clinic.id).count()
-        
-        # Obtener CLINIC_ADMIN
-        clinic_admin = User.query.filter_by(
-            clinic_id=clinic.id,
-            role=UserRole.CLINIC_ADMIN
-        ).first()
-        
-        if clinic_admin:
-            data['admin'] = {
-                'id': clinic_admin.id,
-                'username': clinic_admin.username,
-                'email': clinic_admin.email,
-                'full_name': clinic_admin.full_name
-            }
-        else:
-            data['admin'] = None
-        
+    for clinic, *counts in rows:
+        data = clinic.to_dict(counts=dict(zip(
+            ('users_count', 'patients_count', 'appointments_count'), counts
+        )))
+        data['admin'] = admins.get(clinic.id)
         clinics_data.append(data)
     
     return jsonify(clinics_data)
@@ -160,14 +170,13 @@ def create_clinic():
     if not data.get('admin_username') or not data.get('admin_email') or not data.get('admin_password'):
         return jsonify({'error': 'Credenciales del administrador son requeridas'}), 400
     
-    # Verificar que el username no exista
-    existing_user = User.query.filter_by(username=data['admin_username']).first()
-    if existing_user:
+    # Verificar que username y email no existan (una consulta, solo esas dos columnas)
+    conflicts = db.session.query(User.username, User.email).filter(
+        or_(User.username == data['admin_username'], User.email == data['admin_email'])
+    ).all()
+    if any(username == data['admin_username'] for username, _ in conflicts):
         return jsonify({'error': f'El username "{data["admin_username"]}" ya está en uso'}), 400
-    
-    # Verificar que el email no exista
-    existing_email = User.query.filter_by(email=data['admin_email']).first()
-    if existing_email:
+    if conflicts:
         return jsonify({'error': f'El email "{data["admin_email"]}" ya está en uso'}), 400
     
     try:
@@ -345,10 +354,10 @@ def get_all_users():
     
     role = request.args.get('role')
     if role:
-        try:
-            query = query.filter_by(role=UserRole(role))
-        except ValueError:
+        role_filter = USER_ROLE_BY_VALUE.get(role)
+        if role_filter is None:
             return jsonify({'error': f'Rol inválido: {role}'}), 400
+        query = query.filter_by(role=role_filter)
     
     is_active = request.args.get('is_active')
     if is_active is not None:
@@ -356,7 +365,17 @@ def get_all_users():
     
     users = query.order_by(User.created_at.desc()).all()
     
-    return jsonify([u.to_dict(include_sensitive=True) for u in users])
+    # Citas por profesional en una sola consulta (GROUP BY), no un COUNT por usuario
+    counts = dict(db.session.execute(
+        select(Appointment.professional_id, func.count(Appointment.id)).where(
+            Appointment.professional_id.in_([u.id for u in users])
+        ).group_by(Appointment.professional_id)
+    ).all())
+    
+    return jsonify([
+        u.to_dict(include_sensitive=True, appointments_count=counts.get(u.id, 0))
+        for u in users
+    ])
 
 
 @super_admin_bp.route('/api/users/<int:id>/toggle-status', methods=['POST'])
@@ -408,10 +427,8 @@ def reset_user_password(id):
     
     # Si no se proporciona, generar una temporal
     if not new_password:
-        import secrets
-        import string
-        alphabet = string.ascii_letters + string.digits
-        new_password = ''.join(secrets.choice(alphabet) for i in range(12))
+        # 9 bytes aleatorios en base64 URL-safe: 12 caracteres [A-Za-z0-9_-]
+        new_password = secrets.token_urlsafe(9)
     
     try:
         user.set_password(new_password)
@@ -437,8 +454,6 @@ def reset_user_password(id):
 @super_admin_required
 def get_global_stats():
     """GET: Obtiene estadísticas globales del sistema"""
-    from datetime import datetime, timedelta
-    
     # Rango de fechas (últimos 30 días)
     end_date = get_peru_time()
     start_date = end_date - timedelta(days=30)
@@ -516,8 +531,6 @@ def get_activity_stats():
     Query params:
         - period (str): 'week', 'month', 'year' (default: 'month')
     """
-    from datetime import datetime, timedelta
-    
     period = request.args.get('period', 'month')
     
     end_date = get_peru_time()
@@ -0,0 +1,150 @@
+"""
+Fixtures de pruebas: app con TestingConfig (SQLite en memoria, NullCache o un cache
+compartido), datos mínimos de dos clínicas y un contador de consultas SQL.
+"""
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy import event
+
+from project import cache, create_app, db
+from project.models import (
+    Appointment, AppointmentStatus, Clinic, Patient, Service, User, UserRole
+)
+
+PASSWORD = 'Test@2025!'
+
+
+class IsolatedClient(FlaskClient):
+    """
+    Cliente que atiende cada petición en un contexto vacío: contexto de app, g y
+    sesión de BD propios, como en producción. Si no, las peticiones reutilizan el
+    contexto abierto por el fixture app y comparten g (usuario de Flask-Login,
+    clínica memoizada) entre peticiones.
+    """
+    def open(self, *args, **kwargs):
+        # Cuerpo leído dentro del mismo contexto (los listados por streaming consultan ahí)
+        kwargs.setdefault('buffered', True)
+        return contextvars.Context().run(super().open, *args, **kwargs)
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    app.test_client_class = IsolatedClient
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def shared_cache(app, tmp_path):
+    """
+    Cache compartido entre procesos (FileSystemCache) en lugar del NullCache de
+    pruebas: los caches por versión de clínica solo se activan con uno así.
+    """
+    app.config.update(CACHE_TYPE='FileSystemCache', CACHE_DIR=str(tmp_path / 'cache'))
+    cache.init_app(app)
+    return cache
+
+
+def _user(clinic, username, role):
+    user = User(
+        username=username,
+        email=f'{username}@test.com',
+        role=role,
+        full_name=username.title(),
+        clinic_id=clinic.id
+    )
+    user.set_password(PASSWORD)
+    db.session.add(user)
+    return user
+
+
+@pytest.fixture
+def clinic_data(app):
+    """Dos clínicas con admin, profesional, servicio y paciente cada una"""
+    data = {}
+    for key in ('a', 'b'):
+        clinic = Clinic(name=f'Clínica {key.upper()}')
+        db.session.add(clinic)
+        db.session.flush()
+        data[key] = {
+            'clinic': clinic,
+            'admin': _user(clinic, f'admin_{key}', UserRole.CLINIC_ADMIN),
+            'professional': _user(clinic, f'doctor_{key}', UserRole.PROFESSIONAL),
+            'service': Service(clinic_id=clinic.id, name=f'Consulta {key}', duration_minutes=30, price=50),
+            'patient': Patient(clinic_id=clinic.id, name=f'Paciente {key}', phone=f'90000000{key == "b":d}')
+        }
+        db.session.add_all([data[key]['service'], data[key]['patient']])
+    db.session.commit()
+    return data
+
+
+@pytest.fixture
+def add_rows(clinic_data):
+    """
+    Agrega n pacientes, profesionales y citas a la clínica A.
+    Cada cita tiene su propio paciente y profesional: así una consulta por fila
+    (N+1) en cualquier relación cambia el número de consultas.
+    """
+    counter = {'next': 0}
+
+    def add(n):
+        a = clinic_data['a']
+        start = datetime(2030, 1, 7, 9, 0)
+        for _ in range(n):
+            i = counter['next'] = counter['next'] + 1
+            professional = _user(a['clinic'], f'extra_doctor_{i}', UserRole.PROFESSIONAL)
+            patient = Patient(clinic_id=a['clinic'].id, name=f'Paciente extra {i}', phone=f'91{i:07d}')
+            db.session.add(patient)
+            db.session.flush()
+            begin = start + timedelta(hours=i)
+            db.session.add(Appointment(
+                clinic_id=a['clinic'].id,
+                professional_id=professional.id,
+                patient_id=patient.id,
+                service_id=a['service'].id,
+                start_datetime=begin,
+                end_datetime=begin + timedelta(minutes=30),
+                status=AppointmentStatus.PROGRAMADA
+            ))
+        db.session.commit()
+        # Cada petición debe cargar sus datos desde la base, no del identity map
+        db.session.expire_all()
+
+    return add
+
+
+@pytest.fixture
+def login(app):
+    def login(username, password=PASSWORD):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        assert response.status_code in (200, 302)
+        return client
+
+    return login
+
+
+@pytest.fixture
+def count_queries(app):
+    """Contexto que cuenta las sentencias SQL ejecutadas: with count_queries() as n: ...; n[0]"""
+    @contextmanager
+    def counter():
+        count = [0]
+
+        def before_cursor_execute(*args):
+            count[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield count
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
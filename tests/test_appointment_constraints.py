@@ -0,0 +1,85 @@
+"""
+Integridad de las citas: rango válido (fin posterior al inicio) y anti-solapamiento,
+tanto en la API como en las restricciones de la base.
+"""
+import logging
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from project import db, ensure_indexes, seed_initial_data
+from project.models import Appointment, AppointmentStatus
+
+
+def _payload(clinic, start, end):
+    return {
+        'patient_id': clinic['patient'].id,
+        'service_id': clinic['service'].id,
+        'start_datetime': start,
+        'end_datetime': end
+    }
+
+
+def test_overlapping_appointment_is_rejected(clinic_data, login):
+    a = clinic_data['a']
+    client = login('doctor_a')
+
+    first = client.post('/api/appointments', json=_payload(a, '2030-01-07T09:00:00', '2030-01-07T09:30:00'))
+    overlap = client.post('/api/appointments', json=_payload(a, '2030-01-07T09:15:00', '2030-01-07T09:45:00'))
+    adjacent = client.post('/api/appointments', json=_payload(a, '2030-01-07T09:30:00', '2030-01-07T10:00:00'))
+
+    assert first.status_code == 201
+    assert overlap.status_code == 409
+    assert adjacent.status_code == 201
+
+
+def test_end_before_start_is_rejected_by_the_database(clinic_data):
+    a = clinic_data['a']
+    db.session.add(Appointment(
+        clinic_id=a['clinic'].id,
+        professional_id=a['professional'].id,
+        patient_id=a['patient'].id,
+        service_id=a['service'].id,
+        start_datetime=datetime(2030, 1, 7, 10, 0),
+        end_datetime=datetime(2030, 1, 7, 9, 0),
+        status=AppointmentStatus.PROGRAMADA
+    ))
+
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_demo_seed_appointments_have_valid_ranges(app):
+    app.config['CREATE_DEMO_DATA'] = True
+    seed_initial_data(app)
+
+    appointments = Appointment.query.all()
+
+    assert appointments
+    assert all(apt.end_datetime > apt.start_datetime for apt in appointments)
+
+
+def test_ensure_indexes_reports_rows_that_violate_constraints(app, clinic_data, caplog):
+    a = clinic_data['a']
+    # Simula una base anterior a la restricción CHECK
+    db.session.execute(text('PRAGMA ignore_check_constraints = ON'))
+    db.session.add(Appointment(
+        clinic_id=a['clinic'].id,
+        professional_id=a['professional'].id,
+        patient_id=a['patient'].id,
+        service_id=a['service'].id,
+        start_datetime=datetime(2030, 1, 7, 10, 0),
+        end_datetime=datetime(2030, 1, 7, 9, 0),
+        status=AppointmentStatus.PROGRAMADA
+    ))
+    db.session.commit()
+    bad_id = Appointment.query.one().id
+    db.session.execute(text('PRAGMA ignore_check_constraints = OFF'))
+
+    with caplog.at_level(logging.ERROR):
+        ensure_indexes(app)
+
+    assert f'violan ck_appointment_end_after_start (ids: {bad_id})' in caplog.text
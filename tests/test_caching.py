@@ -0,0 +1,75 @@
+"""
+Cache por versión de clínica: solo con un cache compartido, y cualquier cambio
+confirmado en la clínica invalida sus resultados cacheados.
+"""
+from project import cache
+from project.caching import clinic_cache_key
+
+
+def test_local_cache_disables_clinic_caches(app, clinic_data):
+    clinic_id = clinic_data['a']['clinic'].id
+    app.config['CACHE_TYPE'] = 'SimpleCache'
+    cache.init_app(app)
+
+    assert clinic_cache_key('stats', clinic_id) is None
+
+
+def test_shared_cache_serves_repeated_requests_without_queries(clinic_data, shared_cache, login, count_queries):
+    client = login('admin_a')
+    client.get('/api/stats')
+
+    with count_queries() as count:
+        response = client.get('/api/stats')
+
+    assert response.status_code == 200
+    # Solo la carga del usuario: la versión y las estadísticas salen del cache
+    assert count[0] <= 1
+
+
+def test_stats_are_invalidated_after_a_write(clinic_data, shared_cache, login):
+    client = login('admin_a')
+    before = client.get('/api/stats').get_json()['patients_count']
+
+    client.post('/api/patients', json={'name': 'Nuevo paciente', 'phone': '955555555'})
+
+    assert client.get('/api/stats').get_json()['patients_count'] == before + 1
+
+
+def test_dashboard_stats_are_invalidated_after_a_write(clinic_data, shared_cache, login):
+    client = login('admin_a')
+    url = '/clinic-admin/api/stats/dashboard'
+    before = client.get(url).get_json()
+
+    client.post('/api/patients', json={'name': 'Nuevo paciente', 'phone': '955555555'})
+
+    assert client.get(url).get_json() != before
+
+
+def test_patient_search_is_invalidated_after_a_write(clinic_data, shared_cache, login):
+    client = login('admin_a')
+    assert client.get('/api/search/patients?q=Nuevo').get_json() == []
+
+    client.post('/api/patients', json={'name': 'Nuevo paciente', 'phone': '955555555'})
+
+    names = [patient['name'] for patient in client.get('/api/search/patients?q=Nuevo').get_json()]
+    assert names == ['Nuevo paciente']
+
+
+def test_services_catalog_is_invalidated_after_a_write(clinic_data, shared_cache, login):
+    client = login('admin_a')
+    assert len(client.get('/api/services').get_json()) == 1
+
+    client.post('/clinic-admin/api/services', json={'name': 'Terapia', 'duration_minutes': 45})
+
+    assert len(client.get('/api/services').get_json()) == 2
+    assert len(client.get('/clinic-admin/api/services').get_json()) == 2
+
+
+def test_write_in_one_clinic_keeps_the_other_cached(clinic_data, shared_cache, login):
+    client_b = login('admin_b')
+    client_b.get('/api/stats')
+    version_b = clinic_cache_key('stats', clinic_data['b']['clinic'].id)
+
+    login('admin_a').post('/api/patients', json={'name': 'Nuevo paciente', 'phone': '955555555'})
+
+    assert clinic_cache_key('stats', clinic_data['b']['clinic'].id) == version_b
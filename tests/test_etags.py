@@ -0,0 +1,54 @@
+"""
+ETags de /professionals y /stats: un If-None-Match vigente responde 304 y cualquier
+cambio confirmado produce un ETag nuevo.
+"""
+
+
+def _revalidate(client, url):
+    etag = client.get(url).headers['ETag']
+    return etag, client.get(url, headers={'If-None-Match': etag})
+
+
+def test_professionals_etag_is_stable_without_shared_cache(clinic_data, login):
+    client = login('admin_a')
+
+    _, response = _revalidate(client, '/api/professionals')
+
+    assert response.status_code == 304
+
+
+def test_professionals_revalidation_skips_the_query(clinic_data, shared_cache, login, count_queries):
+    client = login('admin_a')
+    etag = client.get('/api/professionals').headers['ETag']
+
+    with count_queries() as count:
+        response = client.get('/api/professionals', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    # Solo la carga del usuario
+    assert count[0] == 1
+
+
+def test_professionals_etag_changes_after_a_write(clinic_data, shared_cache, login):
+    client = login('admin_a')
+    etag, _ = _revalidate(client, '/api/professionals')
+
+    created = client.post('/clinic-admin/api/professionals', json={
+        'username': 'doctor_nuevo',
+        'email': 'doctor_nuevo@test.com',
+        'full_name': 'Doctor Nuevo',
+        'password': 'Test@2025!'
+    })
+    assert created.status_code == 201
+    response = client.get('/api/professionals', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert 'doctor_nuevo' in {prof['username'] for prof in response.get_json()}
+
+
+def test_stats_etag_is_stable(clinic_data, login):
+    client = login('admin_a')
+
+    _, response = _revalidate(client, '/api/stats')
+
+    assert response.status_code == 304
@@ -0,0 +1,61 @@
+"""
+Exportación CSV: en la misma petición con cache local, en segundo plano sobre
+EXPORT_ASYNC_THRESHOLD con cache compartido (descarga única y archivo eliminado).
+"""
+import time
+
+
+def _export_folder(app, tmp_path):
+    app.config.update(EXPORT_ASYNC_THRESHOLD=2, EXPORT_FOLDER=str(tmp_path / 'exports'))
+    return tmp_path / 'exports'
+
+
+def _wait(client, status_url):
+    """Consulta el estado hasta que la exportación termine (máximo 5 s)"""
+    deadline = time.monotonic() + 5
+    response = client.get(status_url)
+    while response.status_code == 202 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        response = client.get(status_url)
+    return response
+
+
+def test_local_cache_streams_large_exports(app, add_rows, login, tmp_path):
+    _export_folder(app, tmp_path)
+    add_rows(3)
+    client = login('admin_a')
+
+    response = client.get('/api/export/appointments')
+
+    assert response.status_code == 200
+    # Encabezado + 3 citas
+    assert len(response.get_data(as_text=True).strip().splitlines()) == 4
+
+
+def test_large_export_runs_in_background_and_is_downloaded_once(app, add_rows, shared_cache, login, tmp_path):
+    folder = _export_folder(app, tmp_path)
+    add_rows(3)
+    client = login('admin_a')
+
+    started = client.get('/api/export/appointments')
+    assert started.status_code == 202
+    status_url = started.get_json()['status_url']
+
+    response = _wait(client, status_url)
+
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).strip().splitlines()) == 4
+    response.close()
+    assert list(folder.iterdir()) == []
+    assert client.get(status_url).status_code == 404
+
+
+def test_export_job_is_private_to_its_user(app, add_rows, shared_cache, login, tmp_path):
+    _export_folder(app, tmp_path)
+    add_rows(3)
+
+    owner = login('admin_a')
+    status_url = owner.get('/api/export/appointments').get_json()['status_url']
+
+    assert login('doctor_a').get(status_url).status_code == 404
+    assert _wait(owner, status_url).status_code == 200
@@ -0,0 +1,44 @@
+"""
+Número de consultas de los listados: no debe crecer con el número de filas (N+1)
+y debe quedar dentro del presupuesto de cada endpoint.
+"""
+import pytest
+
+# (usuario, URL, máximo de consultas por petición incluyendo la carga del usuario)
+LIST_ENDPOINTS = [
+    ('admin_a', '/api/patients', 3),
+    ('admin_a', '/api/appointments', 5),
+    ('admin_a', '/api/services', 3),
+    ('admin_a', '/clinic-admin/api/professionals', 3),
+    ('admin_a', '/clinic-admin/api/calendar/all-appointments', 3),
+    ('admin_a', '/clinic-admin/api/activity/recent', 3),
+    ('admin_a', '/clinic-admin/api/search/quick?q=extra', 5),
+    ('admin_a', '/clinic-admin/api/stats/dashboard', 3),
+    ('superadmin', '/super-admin/api/clinics', 4),
+    ('superadmin', '/super-admin/api/users', 4),
+]
+
+
+def _measure(client, url, count_queries):
+    with count_queries() as count:
+        response = client.get(url)
+        # Los listados por streaming consultan mientras se envía el cuerpo
+        body = response.get_data()
+    assert response.status_code == 200, body[:200]
+    return count[0]
+
+
+@pytest.mark.parametrize('username, url, budget', LIST_ENDPOINTS)
+def test_list_queries_do_not_grow_with_rows(app, login, add_rows, count_queries, username, url, budget):
+    add_rows(2)
+    if username == 'superadmin':
+        client = login(app.config['SUPER_ADMIN_USERNAME'], app.config['SUPER_ADMIN_PASSWORD'])
+    else:
+        client = login(username)
+    few = _measure(client, url, count_queries)
+
+    add_rows(8)
+    many = _measure(client, url, count_queries)
+
+    assert many == few, f'{url}: {few} consultas con 2 filas, {many} con 10'
+    assert many <= budget, f'{url}: {many} consultas (máximo {budget})'
@@ -0,0 +1,67 @@
+"""
+Resumen de reportes: agregados del rango y uso de la vista materializada
+(refresco antes de leerla, cálculo directo si el refresco falla).
+"""
+from cachelib import SimpleCache
+
+from project import api_routes, reports
+
+
+def test_report_summary_counts_the_range(clinic_data, add_rows, login):
+    add_rows(3)
+    client = login('admin_a')
+
+    report = client.get('/api/reports/summary?start=2030-01-07&end=2030-01-07').get_json()
+    empty = client.get('/api/reports/summary?start=2030-01-08&end=2030-01-08').get_json()
+
+    assert report['summary']['total'] == 3
+    assert report['summary']['programadas'] == 3
+    assert empty['summary']['total'] == 0
+
+
+def test_stale_view_is_refreshed_before_reading(app, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(reports, 'cache', SimpleCache())
+    monkeypatch.setattr(reports, 'report_view_enabled', lambda: True)
+    monkeypatch.setattr(reports, '_refresh_view', lambda app: refreshes.append(app) or True)
+
+    use_view, snapshot = reports.refresh_view_if_stale(app)
+
+    assert use_view and snapshot
+    assert reports.refresh_view_if_stale(app) == (True, snapshot)
+    assert len(refreshes) == 1
+
+
+def test_failed_refresh_falls_back_to_appointments(app, monkeypatch):
+    refreshes = []
+    monkeypatch.setattr(reports, 'cache', SimpleCache())
+    monkeypatch.setattr(reports, 'report_view_enabled', lambda: True)
+    monkeypatch.setattr(reports, '_refresh_view', lambda app: refreshes.append(app) and False)
+
+    assert reports.refresh_view_if_stale(app) == (False, None)
+    # Sin reintentos en cada petición hasta el siguiente intervalo
+    assert reports.refresh_view_if_stale(app) == (False, None)
+    assert len(refreshes) == 1
+
+
+def test_view_reports_are_cached_per_view_refresh(clinic_data, shared_cache, login, monkeypatch):
+    computed = []
+    snapshot = {'id': 's1'}
+    monkeypatch.setattr(api_routes, 'refresh_view_if_stale', lambda app: (True, snapshot['id']))
+    monkeypatch.setattr(
+        api_routes, '_compute_report_summary',
+        lambda *args: computed.append(args) or {'summary': {}, 'by_professional': []}
+    )
+    client = login('admin_a')
+    url = '/api/reports/summary?start=2030-01-07&end=2030-01-07'
+
+    client.get(url)
+    # Una escritura no invalida lo leído de la vista: la vista aún no la refleja
+    response = client.put(f"/api/patients/{clinic_data['a']['patient'].id}", json={'name': 'Otro nombre'})
+    assert response.status_code == 200
+    client.get(url)
+    assert len(computed) == 1
+
+    snapshot['id'] = 's2'
+    client.get(url)
+    assert len(computed) == 2
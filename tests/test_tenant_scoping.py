@@ -0,0 +1,97 @@
+"""
+Aislamiento por clínica: los listados y detalles solo muestran datos de la clínica
+del usuario (criterio multi-tenant global y filtros explícitos de lambda_stmt).
+"""
+from datetime import datetime
+
+from project import db
+from project.models import Appointment, AppointmentStatus
+
+
+def test_patient_list_only_shows_own_clinic(clinic_data, login):
+    client = login('admin_a')
+
+    names = {patient['name'] for patient in client.get('/api/patients').get_json()}
+
+    assert names == {clinic_data['a']['patient'].name}
+
+
+def test_patient_of_other_clinic_is_not_visible(clinic_data, login):
+    client = login('admin_a')
+
+    response = client.get(f"/api/patients/{clinic_data['b']['patient'].id}")
+
+    assert response.status_code in (403, 404)
+
+
+def test_appointments_only_show_own_clinic(clinic_data, add_rows, login):
+    add_rows(3)
+    client = login('admin_b')
+
+    assert client.get('/api/appointments').get_json() == []
+    assert client.get('/clinic-admin/api/calendar/all-appointments').get_json() == []
+    assert client.get('/clinic-admin/api/activity/recent').get_json() == []
+
+
+# lambda_stmt no pasa por el criterio multi-tenant global: cada consulta filtra
+# clinic_id explícito. Se alternan clínicas para que una consulta cacheada con los
+# parámetros de la primera ejecución se note en la segunda.
+def test_lambda_patient_and_service_lists_follow_the_clinic(clinic_data, login):
+    client_a, client_b = login('admin_a'), login('admin_b')
+
+    for client, key in ((client_a, 'a'), (client_b, 'b'), (client_a, 'a')):
+        patients = {patient['name'] for patient in client.get('/api/patients').get_json()}
+        services = {service['name'] for service in client.get('/api/services').get_json()}
+        assert patients == {clinic_data[key]['patient'].name}
+        assert services == {clinic_data[key]['service'].name}
+
+
+def test_duplicate_phone_check_is_per_clinic(clinic_data, login):
+    client = login('admin_a')
+    phone_b = clinic_data['b']['patient'].phone
+
+    response = client.post('/api/patients', json={'name': 'Mismo teléfono', 'phone': phone_b})
+    duplicate = client.post('/api/patients', json={'name': 'Otra vez', 'phone': phone_b})
+
+    assert response.status_code == 201
+    assert duplicate.status_code == 400
+
+
+def test_lambda_professionals_search_and_appointments_follow_the_clinic(clinic_data, login):
+    for key in ('a', 'b'):
+        data = clinic_data[key]
+        db.session.add(Appointment(
+            clinic_id=data['clinic'].id,
+            professional_id=data['professional'].id,
+            patient_id=data['patient'].id,
+            service_id=data['service'].id,
+            start_datetime=datetime(2030, 1, 7, 9, 0),
+            end_datetime=datetime(2030, 1, 7, 9, 30),
+            status=AppointmentStatus.PROGRAMADA
+        ))
+    db.session.commit()
+    client_a, client_b = login('admin_a'), login('admin_b')
+
+    for client, key in ((client_a, 'a'), (client_b, 'b'), (client_a, 'a')):
+        data = clinic_data[key]
+        professionals = {prof['username'] for prof in client.get('/api/professionals').get_json()}
+        found = {patient['id'] for patient in client.get('/api/search/patients?q=Paciente').get_json()}
+        appointments = client.get('/api/appointments').get_json()
+        assert professionals == {data['professional'].username}
+        assert found == {data['patient'].id}
+        assert {apt['extendedProps']['patient_id'] for apt in appointments} == {data['patient'].id}
+
+
+def test_lambda_dashboard_counters_follow_the_clinic(clinic_data, add_rows, login):
+    add_rows(3)
+    client_a, client_b = login('admin_a'), login('admin_b')
+    expected = {'a': (4, 4, 3), 'b': (1, 1, 0)}
+
+    for client, key in ((client_a, 'a'), (client_b, 'b'), (client_a, 'a')):
+        stats = client.get('/clinic-admin/api/stats/dashboard').get_json()
+        counts = (
+            stats['patients']['total'],
+            stats['professionals']['total'],
+            stats['appointments']['programadas']
+        )
+        assert counts == expected[key]